@@ -0,0 +1,173 @@
+"""
+BuildLogService基准测试
+
+在子进程中启动本地构建日志API替身服务（build_log_server.py），按逐级增加的并发数驱动BuildLogService，
+输出每一级的吞吐量和p50/p95/p99延迟，以及重试、失败、后端调用和缓存命中次数，用于调整连接池和缓存参数。
+
+模式：
+- errors: get_build_log_errors_by_inst_id，使用接口返回的错误关键字
+- raw:    get_build_log_errors_by_inst_id，BUILD_LOG_SOURCE=raw，下载原始日志在本地分析
+- query:  query_build_errors，按构建日志URL查询，不经过缓存
+
+--ids 控制实例ID的取值范围，小于请求数时会重复查询同一实例，可以观察缓存和并发合并的效果。
+
+用法: python benchmarks/bench_build_log_service.py --concurrency 1,8,32,128 --requests 1000 --latency lognormal:0.05,0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.build_log_server import add_arguments  # noqa: E402
+from devops_qa_agent.config import config  # noqa: E402
+from devops_qa_agent.services.build_log_service import BuildLogService  # noqa: E402
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build_log_server.py")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    """在子进程中启动替身服务，避免服务端和客户端争用同一个事件循环"""
+    command = [
+        sys.executable, SERVER_SCRIPT, "--port", str(port),
+        "--latency", args.latency,
+        "--error-rate", str(args.error_rate),
+        "--error-status", str(args.error_status),
+        "--errors-per-response", str(args.errors_per_response),
+        "--running-rate", str(args.running_rate),
+        "--log-size-kb", str(args.log_size_kb),
+        "--chunk-size", str(args.chunk_size),
+        "--chunk-delay", str(args.chunk_delay),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stats", timeout=1).read()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(process.stderr.read().decode("utf-8", "replace"))
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("替身服务启动超时")
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def run_level(mode: str, concurrency: int, total: int, ids: int, url: str) -> Dict[str, Any]:
+    """以固定并发数发出total次请求，每级使用新的服务实例，缓存和连接池从空开始"""
+    service = BuildLogService()
+    await service.start()
+    rng = random.Random(concurrency)
+    targets = [str(rng.randrange(ids)) for _ in range(total)]
+    latencies: List[float] = []
+    empty = 0
+    
+    async def call(target: str):
+        if mode == "query":
+            return await service.query_build_errors(f"https://jenkins.example.com/job/app/{target}/console")
+        return await service.get_build_log_errors_by_inst_id(target)
+    
+    async def worker():
+        nonlocal empty
+        while targets:
+            target = targets.pop()
+            start = time.perf_counter()
+            errors = await call(target)
+            latencies.append(time.perf_counter() - start)
+            if not errors:
+                empty += 1
+    
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    finally:
+        elapsed = time.perf_counter() - start
+        stats = service.get_stats()
+        await service.close()
+    
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "empty_results": empty,
+        "http_requests": stats["requests"],
+        "retries": stats["retries"],
+        "failures": stats["failures"],
+        "backend_calls": stats["cache"]["backend_calls"],
+        "cache_hits": stats["cache"]["hits"],
+        "coalesced": stats["cache"]["coalesced"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BuildLogService基准测试")
+    parser.add_argument("--mode", choices=["errors", "raw", "query"], default="errors")
+    parser.add_argument("--concurrency", default="1,8,32,128", help="并发数，逗号分隔")
+    parser.add_argument("--requests", type=int, default=1000, help="每一级的请求数")
+    parser.add_argument("--ids", type=int, default=0, help="实例ID的取值范围，默认等于请求数的10倍（几乎不重复）")
+    parser.add_argument("--max-concurrency", type=int, help="覆盖BUILD_LOG_MAX_CONCURRENCY")
+    parser.add_argument("--max-connections-per-host", type=int, help="覆盖BUILD_LOG_MAX_CONNECTIONS_PER_HOST")
+    parser.add_argument("--output", help="将结果写入JSON文件")
+    add_arguments(parser)
+    args = parser.parse_args()
+    
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/api/build-log"
+    config.BUILD_LOG_API_URL = url
+    config.BUILD_LOG_MOCK = False
+    config.BUILD_LOG_SOURCE = "raw" if args.mode == "raw" else "api"
+    if args.max_concurrency:
+        config.BUILD_LOG_MAX_CONCURRENCY = args.max_concurrency
+    if args.max_connections_per_host:
+        config.BUILD_LOG_MAX_CONNECTIONS_PER_HOST = args.max_connections_per_host
+    ids = args.ids or args.requests * 10
+    
+    server = start_server(args, port)
+    results = []
+    try:
+        print(f"{'并发':>6} {'请求/秒':>10} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} "
+              f"{'HTTP请求':>9} {'重试':>6} {'失败':>6} {'缓存命中':>8} {'合并':>6}")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            result = asyncio.run(run_level(args.mode, concurrency, args.requests, ids, url))
+            results.append(result)
+            print(f"{concurrency:>6} {result['throughput']:>10.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+                  f"{result['p99_ms']:>9.1f} {result['http_requests']:>9} {result['retries']:>6} "
+                  f"{result['failures']:>6} {result['cache_hits']:>8} {result['coalesced']:>6}")
+    finally:
+        server.terminate()
+        server.wait()
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+请求热点路径微基准测试
+
+离线运行，LLM使用本地的假模型，不访问网络。覆盖每次请求都会经过的路径：
+- kb_search:        KnowledgeBase.search_knowledge，100 / 1万 / 10万条合成知识
+- message_build:    创建消息对象，每轮的用户消息和回答以及从会话存储恢复历史时经过
+- state_restore:    从检查点channel_values构造ConversationState，长对话历史
+- checkpoint_load:  从BoundedMemorySaver读取检查点，即每轮开始时图读取检查点的路径（消息通道从追加日志截取，不反序列化）
+- checkpoint_put:   长对话追加一条消息后写入检查点，即每个节点完成后的路径
+- get_context:      ConversationState.get_context
+- prompt_assembly:  LLMService.generate_response（假模型，关闭回答缓存），主要耗时在提示词组装
+- sse_frame:        /api/chat的SSE帧序列化
+
+每个用例先自动确定循环次数使单轮耗时不少于--min-time秒，再重复--repeat轮，记录每次操作的最短和中位耗时。
+结果写入JSON文件；指定--baseline时与之前的结果对比，最短耗时变慢超过--threshold的用例视为性能回退，
+以非零状态码退出，可以直接用于CI。
+
+用法:
+    python benchmarks/bench_hot_paths.py --output benchmarks/results/baseline.json
+    python benchmarks/bench_hot_paths.py --baseline benchmarks/results/baseline.json --threshold 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 导入服务模块前关闭会产生本地文件的组件
+os.environ.setdefault("SESSION_STORE_ENABLED", "false")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("KNOWLEDGE_SEMANTIC_ENABLED", "false")
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel  # noqa: E402
+from langgraph.checkpoint.base import empty_checkpoint  # noqa: E402
+
+from devops_qa_agent.config import config  # noqa: E402
+from devops_qa_agent.knowledge.base import KnowledgeBase  # noqa: E402
+from devops_qa_agent.models import ConversationState, Message, MessageRole  # noqa: E402
+from devops_qa_agent.services.checkpoint import BoundedMemorySaver  # noqa: E402
+from devops_qa_agent.services.llm_service import LLMService  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(ROOT, "benchmarks", "results", "latest.json")
+
+WORDS = [
+    "构建", "部署", "依赖", "编译", "测试", "镜像", "流水线", "缓存", "超时", "权限",
+    "maven", "gradle", "npm", "docker", "kubernetes", "pipeline", "artifact", "cache", "timeout", "network",
+]
+
+ERROR_KEYWORDS = ["BUILD FAILED", "Compilation failed", "Permission denied", "Test failure", "npm ERR!"]
+
+
+def synthetic_knowledge(size: int, seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """生成合成知识库，构建错误和一般问答各占一半，关键字在词表内组合保证有命中"""
+    rng = random.Random(seed)
+    data = {"build_errors": [], "general_qa": []}
+    for i in range(size):
+        category = "build_errors" if i % 2 == 0 else "general_qa"
+        keywords = [f"{rng.choice(WORDS)}{rng.choice(WORDS)}{i}", rng.choice(WORDS) + rng.choice(WORDS)]
+        if category == "build_errors" and i < len(ERROR_KEYWORDS) * 2:
+            keywords.append(ERROR_KEYWORDS[i // 2])
+        data[category].append({
+            "keywords": keywords,
+            "question": f"{rng.choice(WORDS)}{rng.choice(WORDS)}问题{i}怎么处理？",
+            "answer": "，".join(rng.choice(WORDS) for _ in range(30))
+        })
+    return data
+
+
+def synthetic_state(messages: int, session_id: str = "bench") -> ConversationState:
+    rng = random.Random(messages)
+    start = datetime(2024, 1, 1)
+    history = [
+        Message(
+            role=MessageRole.USER if i % 2 == 0 else MessageRole.ASSISTANT,
+            content=" ".join(rng.choice(WORDS) for _ in range(40 if i % 2 == 0 else 200)),
+            created=(start + timedelta(seconds=i)).timestamp()
+        )
+        for i in range(messages)
+    ]
+    return ConversationState(
+        session_id=session_id,
+        messages=history,
+        build_errors=ERROR_KEYWORDS[:3],
+        knowledge_base_results=[
+            {"id": f"build_errors:{i}", "type": "build_error", "question": f"问题{i}",
+             "answer": "，".join(WORDS) * 3, "score": 1.0}
+            for i in range(5)
+        ]
+    )
+
+
+def case_kb_search(size: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    path = tempfile.mkdtemp(prefix="bench_kb_")
+    with open(os.path.join(path, "knowledge_base.json"), "w", encoding="utf-8") as f:
+        json.dump(synthetic_knowledge(size), f, ensure_ascii=False)
+    previous_path = config.KNOWLEDGE_BASE_PATH
+    config.KNOWLEDGE_BASE_PATH = path
+    try:
+        knowledge_base = KnowledgeBase()
+    finally:
+        config.KNOWLEDGE_BASE_PATH = previous_path
+    query = "流水线构建失败，docker镜像拉取超时，npm依赖缓存怎么处理"
+    return (lambda: knowledge_base.search_knowledge(query, ERROR_KEYWORDS),
+            lambda: shutil.rmtree(path, ignore_errors=True))
+
+
+def case_message_build(messages: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    contents = [random.Random(i).choice(WORDS) for i in range(messages)]
+    return lambda: [Message(role=MessageRole.USER, content=content) for content in contents], None
+
+
+def case_state_restore(messages: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    state = synthetic_state(messages)
+    # 与检查点中的channel_values一致：每个字段一个通道，值为原始对象
+    channel_values = {name: getattr(state, name) for name in ConversationState.model_fields}
+    return lambda: ConversationState(**channel_values), None
+
+
+def case_checkpoint_load(messages: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    state = synthetic_state(messages)
+    channel_values = {name: getattr(state, name) for name in ConversationState.model_fields}
+    saver = BoundedMemorySaver()
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = channel_values
+    versions = {name: saver.get_next_version(None, None) for name in channel_values}
+    checkpoint["channel_versions"] = versions
+    saver.put({"configurable": {"thread_id": "bench", "checkpoint_ns": ""}}, checkpoint,
+              {"source": "loop", "step": 1}, versions)
+    config = {"configurable": {"thread_id": "bench"}}
+    return lambda: saver.get_tuple(config), None
+
+
+def case_checkpoint_put(messages: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    state = synthetic_state(messages)
+    saver = BoundedMemorySaver()
+    config = {"configurable": {"thread_id": "bench", "checkpoint_ns": ""}}
+    history = list(state.messages)
+    version = None
+    
+    def run():
+        nonlocal history, version
+        # 与图的执行一致：消息通道的新值为旧列表加上新增的消息
+        history = history + [Message(role=MessageRole.ASSISTANT, content="请检查依赖配置。")]
+        version = saver.get_next_version(version, None)
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"session_id": state.session_id, "messages": history}
+        checkpoint["channel_versions"] = {"session_id": version, "messages": version}
+        saver.put(config, checkpoint, {"source": "loop", "step": 1}, checkpoint["channel_versions"])
+    
+    return run, None
+
+
+def case_get_context(messages: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    state = synthetic_state(messages)
+    return state.get_context, None
+
+
+def case_prompt_assembly(messages: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    previous_cache = config.ANSWER_CACHE_ENABLED
+    config.ANSWER_CACHE_ENABLED = False
+    try:
+        service = LLMService()
+    finally:
+        config.ANSWER_CACHE_ENABLED = previous_cache
+    service.llm = FakeListChatModel(responses=["构建失败通常由依赖缺失引起，请检查依赖配置。"])
+    state = synthetic_state(messages)
+    loop = asyncio.new_event_loop()
+    
+    def run():
+        return loop.run_until_complete(service.generate_response(state, "构建失败怎么办？"))
+    
+    return run, loop.close
+
+
+def case_sse_frame(tokens: int) -> Tuple[Callable[[], Any], Callable[[], None]]:
+    from devops_qa_agent.api.streaming import FrameEncoder, sse_event
+    
+    chunks = [random.Random(i).choice(WORDS) for i in range(tokens)]
+    session_id = "0f8fad5b-d9cb-469f-a165-70867728950e"
+    stats = {"ttft_ms": 812.4, "total_ms": 5230.1, "tokens": tokens}
+    
+    def run():
+        # 与/api/chat一致：每个流创建一次编码器，不合并帧时每个token一帧
+        encoder = FrameEncoder({"session_id": session_id}, "chunk", b"data: ", b"\n\n")
+        frames = [encoder.encode(chunk) for chunk in chunks]
+        frames.append(sse_event({"complete": True, "session_id": session_id, "stats": stats}))
+        return frames
+    
+    return run, None
+
+
+# 用例名 -> (构造函数, 参数)；构造函数返回 (被测函数, 清理函数)
+CASES: Dict[str, Tuple[Callable, Any]] = {
+    "kb_search[100]": (case_kb_search, 100),
+    "kb_search[10k]": (case_kb_search, 10_000),
+    "kb_search[100k]": (case_kb_search, 100_000),
+    "message_build[1000]": (case_message_build, 1000),
+    "state_restore[50]": (case_state_restore, 50),
+    "state_restore[1000]": (case_state_restore, 1000),
+    "checkpoint_load[50]": (case_checkpoint_load, 50),
+    "checkpoint_load[1000]": (case_checkpoint_load, 1000),
+    "checkpoint_put[1000]": (case_checkpoint_put, 1000),
+    "get_context[1000]": (case_get_context, 1000),
+    "prompt_assembly[20]": (case_prompt_assembly, 20),
+    "prompt_assembly[200]": (case_prompt_assembly, 200),
+    "sse_frame[500]": (case_sse_frame, 500),
+}
+
+
+def measure(func: Callable[[], Any], min_time: float, repeat: int) -> Dict[str, Any]:
+    """自动确定循环次数后重复计时，返回每次操作的最短和中位耗时（微秒）"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+    
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+    return {
+        "loops": loops,
+        "repeat": repeat,
+        "best_us": round(min(timings) * 1e6, 3),
+        "median_us": round(statistics.median(timings) * 1e6, 3),
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float) -> List[Dict[str, Any]]:
+    """与基线对比最短耗时，返回每个共同用例的变化比例以及是否回退"""
+    rows = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["best_us"]
+        change = (result["best_us"] - before) / before if before else 0.0
+        rows.append({
+            "name": name,
+            "baseline_us": before,
+            "current_us": result["best_us"],
+            "change": round(change, 4),
+            "regression": change > threshold
+        })
+    return rows
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求热点路径微基准测试")
+    parser.add_argument("--filter", default="", help="只运行名称以该字符串开头的用例，逗号分隔多个")
+    parser.add_argument("--min-time", type=float, default=0.2, help="单轮最短计时秒数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复轮数")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="结果JSON文件")
+    parser.add_argument("--baseline", help="用于对比的基线结果JSON文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="变慢超过该比例视为回退")
+    parser.add_argument("--list", action="store_true", help="列出所有用例")
+    args = parser.parse_args()
+    
+    if args.list:
+        print("\n".join(CASES))
+        return
+    
+    filters = [f for f in args.filter.split(",") if f]
+    results = {}
+    for name, (factory, param) in CASES.items():
+        if filters and not any(name.startswith(f) for f in filters):
+            continue
+        func, cleanup = factory(param)
+        try:
+            result = measure(func, args.min_time, args.repeat)
+        finally:
+            if cleanup:
+                cleanup()
+        results[name] = result
+        print(f"{name:<24} 最短 {result['best_us']:>12.1f}us  中位 {result['median_us']:>12.1f}us  循环 {result['loops']}")
+    
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        rows = compare(results, baseline, args.threshold)
+        print(f"\n与基线对比（阈值 {args.threshold:.0%}）:")
+        for row in rows:
+            flag = "  回退" if row["regression"] else ""
+            print(f"{row['name']:<24} {row['baseline_us']:>12.1f}us -> {row['current_us']:>12.1f}us "
+                  f"{row['change']:>+8.1%}{flag}")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
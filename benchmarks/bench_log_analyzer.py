@@ -0,0 +1,135 @@
+"""
+构建日志分析基准测试
+
+生成指定大小的模拟构建日志，分别在独立子进程中运行以下方式并对比耗时和内存峰值：
+- naive: 整个文件读入内存后逐行执行各个错误正则
+- in_memory: 整个文件读入内存后用LogAnalyzer分析
+- streaming: LogAnalyzer按块流式分析
+
+用法: python benchmarks/bench_log_analyzer.py --size-mb 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from devops_qa_agent.services.log_analyzer import DEFAULT_SIGNATURES, LogAnalyzer  # noqa: E402
+
+NOISE_LINES = [
+    "[INFO] Downloading from central: https://repo.maven.apache.org/maven2/org/apache/commons/commons-lang3/3.12.0/commons-lang3-3.12.0.pom",
+    "[INFO] Compiling 248 source files to /workspace/service/target/classes",
+    "    at org.example.service.OrderService.process(OrderService.java:118)",
+    "npm WARN deprecated request@2.88.2: request has been deprecated, see https://github.com/request/request/issues/3142",
+    "Step 5/12 : RUN pip install --no-cache-dir -r requirements.txt",
+    " ---> Running in 3f9c2a1b7d4e",
+    "[INFO] Tests run: 42, Failures: 0, Errors: 0, Skipped: 1, Time elapsed: 3.21 s",
+    "Collecting urllib3<3,>=1.21.1 (from requests==2.31.0)",
+]
+
+ERROR_LINES = [
+    "src/main/java/App.java:12: error: cannot find symbol",
+    "[ERROR] Failed to execute goal org.apache.maven.plugins:maven-compiler-plugin:3.8.1:compile (default-compile)",
+    "npm ERR! code ELIFECYCLE",
+    "ERROR: No matching distribution found for foo==9.9",
+    "java.lang.OutOfMemoryError: Java heap space",
+    "The command '/bin/sh -c make' returned a non-zero code: 2",
+]
+
+
+def generate_log(path: str, size_mb: int, error_rate: float = 0.0005):
+    """生成模拟构建日志"""
+    rng = random.Random(42)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            lines = [
+                rng.choice(ERROR_LINES) if rng.random() < error_rate else rng.choice(NOISE_LINES)
+                for _ in range(10000)
+            ]
+            block = "\n".join(lines) + "\n"
+            f.write(block)
+            written += len(block)
+
+
+def run_naive(path: str):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    patterns = [(error, re.compile(pattern, re.IGNORECASE)) for error, pattern, _ in DEFAULT_SIGNATURES]
+    found = {}
+    for line_number, line in enumerate(text.splitlines(), 1):
+        for error, pattern in patterns:
+            if pattern.search(line):
+                found.setdefault(error, line_number)
+    return list(found)
+
+
+def run_in_memory(path: str):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    return LogAnalyzer().analyze_text(text).errors
+
+
+def run_streaming(path: str):
+    return asyncio.run(LogAnalyzer().analyze_file(path)).errors
+
+
+MODES = {"naive": run_naive, "in_memory": run_in_memory, "streaming": run_streaming}
+
+
+def child(mode: str, path: str):
+    """在子进程中运行单个模式，输出耗时和内存峰值"""
+    start = time.perf_counter()
+    errors = MODES[mode](path)
+    elapsed = time.perf_counter() - start
+    # Linux上ru_maxrss的单位是KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"mode": mode, "seconds": round(elapsed, 3), "peak_rss_mb": round(peak_mb, 1), "errors": len(errors)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建日志分析基准测试")
+    parser.add_argument("--size-mb", type=int, default=500, help="模拟日志大小（MB）")
+    parser.add_argument("--modes", default="naive,in_memory,streaming", help="要运行的模式，逗号分隔")
+    parser.add_argument("--log", help="使用已有的日志文件，不再生成")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        child(*args.child)
+        return
+    
+    path = args.log
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), "build.log")
+        print(f"生成 {args.size_mb}MB 模拟日志: {path}")
+        generate_log(path, args.size_mb)
+    
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    results = []
+    for mode in args.modes.split(","):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", mode, path],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["mb_per_second"] = round(size_mb / result["seconds"], 1)
+        results.append(result)
+        print(f"{mode:<10} {result['seconds']:>8.2f}s {result['mb_per_second']:>8.1f}MB/s "
+              f"峰值内存 {result['peak_rss_mb']:>8.1f}MB 错误关键字 {result['errors']}")
+    
+    if not args.log:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+多进程扩展基准测试
+
+在子进程中启动本地LLM接口替身服务（llm_server.py），再按不同的工作进程数启动完整的应用
+（uvicorn --workers N，SHARED_STATE_ENABLED=true），以固定并发数驱动 POST /api/chat 的多轮对话：
+每个会话连续发送多轮消息，请求不做会话亲和，同一会话的各轮会落在不同的工作进程。
+
+输出每种进程数的吞吐量、p50/p95延迟和相对单进程的加速比，并通过 GET /api/sessions/{id} 检查
+每个会话的历史是否完整（每轮一问一答），验证会话状态在进程间正确共享。
+
+用法: python benchmarks/bench_workers.py --workers 1,2,4 --sessions 200 --turns 3 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LLM_SERVER_SCRIPT = os.path.join(ROOT, "benchmarks", "llm_server.py")
+
+QUESTIONS = [
+    "Maven构建失败，提示找不到依赖怎么办",
+    "npm install报错ELIFECYCLE如何处理",
+    "Docker build的时候pip安装超时",
+    "编译时报cannot find symbol是什么原因",
+    "Jenkins流水线构建时内存溢出",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(process: subprocess.Popen, url: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"进程已退出: {url}")
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"启动超时: {url}")
+
+
+def start_llm_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, LLM_SERVER_SCRIPT, "--port", str(port),
+        "--latency", args.llm_latency, "--tokens", str(args.tokens), "--token-delay", str(args.token_delay)
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_ready(process, f"http://127.0.0.1:{port}/_stats")
+    return process
+
+
+def start_app(workers: int, port: int, llm_port: int, data_dir: str) -> subprocess.Popen:
+    """以独立的数据目录启动应用，所有工作进程共用其中的会话存储和缓存文件"""
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+        DATA_DIR=data_dir,
+        SESSION_DB_PATH=os.path.join(data_dir, "sessions.db"),
+        ANSWER_CACHE_PATH=os.path.join(data_dir, "answer_cache.db"),
+        # 每轮的问题归一化后相同，关闭回答缓存，每个请求都经过完整链路
+        ANSWER_CACHE_ENABLED="false",
+        WORKERS=str(workers),
+        SHARED_STATE_ENABLED="true",
+        LOG_LEVEL="WARNING",
+    )
+    command = [
+        sys.executable, "-m", "uvicorn", "devops_qa_agent.api.server:app",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+        "--log-level", "warning", "--no-access-log"
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_ready(process, f"http://127.0.0.1:{port}/metrics")
+    return process
+
+
+def llm_requests(port: int) -> int:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stats", timeout=5) as response:
+        return json.load(response)["requests"]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def chat(http: aiohttp.ClientSession, base_url: str, session_id: str, message: str) -> bool:
+    """发送一轮消息并读完整个SSE响应，返回是否正常完成"""
+    async with http.post(f"{base_url}/api/chat", json={"message": message, "session_id": session_id}) as response:
+        complete = False
+        async for line in response.content:
+            if line.startswith(b"data: ") and b'"complete"' in line:
+                complete = True
+        return response.status == 200 and complete
+
+
+async def run_level(base_url: str, sessions: int, turns: int, concurrency: int, prefix: str) -> Dict[str, Any]:
+    session_ids = [f"{prefix}-{i}" for i in range(sessions)]
+    pending = list(range(sessions))
+    latencies: List[float] = []
+    failures = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+    
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        # 预热：每个工作进程加载知识库、建立连接
+        await asyncio.gather(*[chat(http, base_url, f"{prefix}-warmup-{i}", QUESTIONS[0]) for i in range(concurrency)])
+        
+        async def worker():
+            nonlocal failures
+            while pending:
+                index = pending.pop()
+                for turn in range(turns):
+                    start = time.perf_counter()
+                    ok = await chat(http, base_url, session_ids[index], QUESTIONS[(index + turn) % len(QUESTIONS)])
+                    latencies.append(time.perf_counter() - start)
+                    if not ok:
+                        failures += 1
+        
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        
+        # 每个会话应有 turns 条用户消息和 turns 条回答
+        consistent = 0
+        for session_id in session_ids:
+            async with http.get(f"{base_url}/api/sessions/{session_id}", params={"limit": str(turns * 2 + 1)}) as response:
+                data = await response.json()
+            if len(data.get("messages", [])) == turns * 2:
+                consistent += 1
+    
+    total = sessions * turns
+    return {
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "failures": failures,
+        "consistent_sessions": consistent,
+        "sessions": sessions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程扩展基准测试")
+    parser.add_argument("--workers", default="1,2,4", help="工作进程数，逗号分隔")
+    parser.add_argument("--sessions", type=int, default=200, help="每一级的会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的轮数")
+    parser.add_argument("--concurrency", type=int, default=64, help="同时进行的会话数")
+    parser.add_argument("--llm-latency", default="fixed:0.2", help="LLM替身的首token延迟分布")
+    parser.add_argument("--tokens", type=int, default=40, help="LLM替身每个回答的token数")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="LLM替身两个token之间的间隔秒数")
+    parser.add_argument("--output", help="将结果写入JSON文件")
+    args = parser.parse_args()
+    
+    llm_port = free_port()
+    llm_server = start_llm_server(args, llm_port)
+    results = []
+    try:
+        print(f"{'进程数':>6} {'请求/秒':>10} {'加速比':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'失败':>6} {'历史完整':>10} {'LLM请求':>8}")
+        for workers in [int(w) for w in args.workers.split(",")]:
+            data_dir = tempfile.mkdtemp(prefix="bench-workers-")
+            port = free_port()
+            app = start_app(workers, port, llm_port, data_dir)
+            llm_before = llm_requests(llm_port)
+            try:
+                result = asyncio.run(run_level(
+                    f"http://127.0.0.1:{port}", args.sessions, args.turns, args.concurrency, f"w{workers}"
+                ))
+            finally:
+                app.terminate()
+                app.wait()
+                shutil.rmtree(data_dir, ignore_errors=True)
+            
+            result["workers"] = workers
+            # 包含预热请求，用于确认回答确实来自LLM替身而不是失败后的默认回复
+            result["llm_requests"] = llm_requests(llm_port) - llm_before
+            result["speedup"] = round(result["throughput"] / results[0]["throughput"], 2) if results else 1.0
+            results.append(result)
+            print(f"{workers:>6} {result['throughput']:>10.1f} {result['speedup']:>8.2f} {result['p50_ms']:>9.1f} "
+                  f"{result['p95_ms']:>9.1f} {result['failures']:>6} "
+                  f"{result['consistent_sessions']:>5}/{result['sessions']} {result['llm_requests']:>8}")
+    finally:
+        llm_server.terminate()
+        llm_server.wait()
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+本地构建日志API替身服务
+
+实现BuildLogService使用的接口，不依赖真实的CI系统：
+- POST {prefix}                       请求体 {"build_log_url": ...}，返回 {"errors": [...]}
+- GET  {prefix}/build-log/{cd_inst_id}     返回 {"errors": [...], "status": "finished"}
+- GET  {prefix}/build-log/{cd_inst_id}/raw 分块返回原始日志，响应头X-Build-Status为构建状态
+- GET  /_stats                         返回各接口的请求数和注入的错误数
+
+延迟、错误率、响应大小、原始日志大小和分块间隔都可以配置，同一实例ID每次返回相同的内容。
+启动后将BUILD_LOG_API_URL指向该服务、BUILD_LOG_MOCK设为false即可在本地联调。
+
+用法: python benchmarks/build_log_server.py --port 8001 --latency lognormal:0.05,0.5 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import math
+import random
+import zlib
+from typing import Callable, Dict
+
+from aiohttp import web
+
+ERROR_KEYWORDS = [
+    "Compilation error",
+    "cannot find symbol",
+    "BUILD FAILURE",
+    "Failed to execute goal",
+    "Could not resolve dependencies",
+    "npm ERR!",
+    "Module not found",
+    "No matching distribution",
+    "Docker build error",
+    "OutOfMemoryError",
+    "Timeout",
+    "Permission denied",
+    "Test failure",
+]
+
+NOISE_LINES = [
+    "[INFO] Downloading from central: https://repo.maven.apache.org/maven2/org/apache/commons/commons-lang3/3.12.0/commons-lang3-3.12.0.pom",
+    "[INFO] Compiling 248 source files to /workspace/service/target/classes",
+    "    at org.example.service.OrderService.process(OrderService.java:118)",
+    "Step 5/12 : RUN pip install --no-cache-dir -r requirements.txt",
+    " ---> Running in 3f9c2a1b7d4e",
+    "[INFO] Tests run: 42, Failures: 0, Errors: 0, Skipped: 1, Time elapsed: 3.21 s",
+]
+
+ERROR_LINES = [
+    "src/main/java/App.java:12: error: cannot find symbol",
+    "[ERROR] Failed to execute goal org.apache.maven.plugins:maven-compiler-plugin:3.8.1:compile (default-compile)",
+    "npm ERR! code ELIFECYCLE",
+    "ERROR: No matching distribution found for foo==9.9",
+    "java.lang.OutOfMemoryError: Java heap space",
+    "The command '/bin/sh -c make' returned a non-zero code: 2",
+]
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """解析延迟分布，返回按分布采样秒数的函数
+
+    支持的格式：
+    - fixed:0.05            固定延迟
+    - uniform:0.01,0.2      均匀分布
+    - exp:0.05              指数分布，参数为均值
+    - lognormal:0.05,0.5    对数正态分布，参数为中位数和sigma，适合模拟长尾
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+class BuildLogStandIn:
+    """构建日志API替身"""
+    
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0, error_status: int = 503,
+                 errors_per_response: int = 3, running_rate: float = 0.0, log_size_kb: int = 256,
+                 chunk_size: int = 64 * 1024, chunk_delay: float = 0.0, seed: int = 42):
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.errors_per_response = errors_per_response
+        self.running_rate = running_rate
+        self.log_size = log_size_kb * 1024
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.rng = random.Random(seed)
+        self.stats: Dict[str, int] = {"query": 0, "errors": 0, "raw": 0, "injected_failures": 0, "raw_bytes": 0}
+    
+    def create_app(self, prefix: str = "/api/build-log") -> web.Application:
+        app = web.Application()
+        app.router.add_post(prefix, self.handle_query)
+        app.router.add_get(prefix + "/build-log/{cd_inst_id}", self.handle_errors)
+        app.router.add_get(prefix + "/build-log/{cd_inst_id}/raw", self.handle_raw)
+        app.router.add_get("/_stats", self.handle_stats)
+        return app
+    
+    def _errors_for(self, key: str):
+        """同一个键每次返回相同的错误关键字"""
+        rng = random.Random(zlib.crc32(key.encode("utf-8")))
+        count = min(self.errors_per_response, len(ERROR_KEYWORDS))
+        return rng.sample(ERROR_KEYWORDS, count)
+    
+    def _status_for(self, cd_inst_id: str) -> str:
+        rng = random.Random(zlib.crc32(cd_inst_id.encode("utf-8")) ^ 0x5A5A)
+        return "running" if rng.random() < self.running_rate else "finished"
+    
+    async def _simulate(self) -> bool:
+        """等待模拟延迟，返回本次请求是否应注入失败"""
+        delay = self.sample_latency(self.rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.rng.random() < self.error_rate:
+            self.stats["injected_failures"] += 1
+            return True
+        return False
+    
+    async def handle_query(self, request: web.Request) -> web.Response:
+        self.stats["query"] += 1
+        payload = await request.json()
+        if await self._simulate():
+            return web.Response(status=self.error_status)
+        return web.json_response({"errors": self._errors_for(payload.get("build_log_url", ""))})
+    
+    async def handle_errors(self, request: web.Request) -> web.Response:
+        self.stats["errors"] += 1
+        cd_inst_id = request.match_info["cd_inst_id"]
+        if await self._simulate():
+            return web.Response(status=self.error_status)
+        return web.json_response({"errors": self._errors_for(cd_inst_id), "status": self._status_for(cd_inst_id)})
+    
+    async def handle_raw(self, request: web.Request) -> web.StreamResponse:
+        self.stats["raw"] += 1
+        cd_inst_id = request.match_info["cd_inst_id"]
+        if await self._simulate():
+            return web.Response(status=self.error_status)
+        
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/plain; charset=utf-8",
+            "X-Build-Status": self._status_for(cd_inst_id)
+        })
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        
+        rng = random.Random(zlib.crc32(cd_inst_id.encode("utf-8")))
+        sent = 0
+        buffer = []
+        buffered = 0
+        while sent + buffered < self.log_size:
+            line = (rng.choice(ERROR_LINES) if rng.random() < 0.001 else rng.choice(NOISE_LINES)) + "\n"
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= self.chunk_size:
+                sent += await self._write_chunk(response, buffer)
+                buffer, buffered = [], 0
+        if buffer:
+            sent += await self._write_chunk(response, buffer)
+        await response.write_eof()
+        return response
+    
+    async def _write_chunk(self, response: web.StreamResponse, lines) -> int:
+        data = "".join(lines).encode("utf-8")
+        await response.write(data)
+        self.stats["raw_bytes"] += len(data)
+        if self.chunk_delay > 0:
+            await asyncio.sleep(self.chunk_delay)
+        return len(data)
+    
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="fixed:0.02", help="延迟分布，如 fixed:0.05、uniform:0.01,0.2、exp:0.05、lognormal:0.05,0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入失败的比例")
+    parser.add_argument("--error-status", type=int, default=503, help="注入失败时返回的状态码")
+    parser.add_argument("--errors-per-response", type=int, default=3, help="每次返回的错误关键字数")
+    parser.add_argument("--running-rate", type=float, default=0.0, help="状态为running的实例比例")
+    parser.add_argument("--log-size-kb", type=int, default=256, help="原始日志大小（KB）")
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024, help="原始日志每块的字节数")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="原始日志两块之间的间隔秒数")
+
+
+def stand_in_from_args(args: argparse.Namespace) -> BuildLogStandIn:
+    return BuildLogStandIn(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        errors_per_response=args.errors_per_response,
+        running_rate=args.running_rate,
+        log_size_kb=args.log_size_kb,
+        chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地构建日志API替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_arguments(parser)
+    args = parser.parse_args()
+    
+    stand_in = stand_in_from_args(args)
+    print(f"构建日志API替身服务: http://{args.host}:{args.port}/api/build-log", flush=True)
+    web.run_app(stand_in.create_app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
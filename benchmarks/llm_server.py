@@ -0,0 +1,117 @@
+"""
+本地LLM接口替身服务
+
+实现兼容OpenAI的 POST /v1/chat/completions（支持stream=true的SSE流式响应和普通响应），
+不依赖真实的模型服务，用于多进程扩展等需要驱动完整请求链路的基准测试：
+- 首token延迟按分布采样，之后每个token间隔固定时间
+- 回答内容由最后一条用户消息决定，同一问题每次返回相同的回答
+- GET /_stats 返回请求数和输出的token数
+
+启动后将OPENAI_BASE_URL指向 http://127.0.0.1:{port}/v1 即可。
+
+用法: python benchmarks/llm_server.py --port 8002 --latency fixed:0.2 --tokens 40 --token-delay 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from typing import Dict, List
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.build_log_server import parse_latency  # noqa: E402
+
+ANSWER_WORDS = [
+    "请", "检查", "依赖", "版本", "是否", "一致，", "清理", "本地", "缓存", "后", "重新", "构建。",
+    "如果", "仍然", "失败，", "查看", "构建日志", "中的", "第一条", "错误", "信息。"
+]
+
+
+class LLMStandIn:
+    """兼容OpenAI接口的LLM替身"""
+    
+    def __init__(self, latency: str = "fixed:0", tokens: int = 40, token_delay: float = 0.0, seed: int = 42):
+        self.sample_latency = parse_latency(latency)
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.rng = random.Random(seed)
+        self.stats: Dict[str, int] = {"requests": 0, "streaming": 0, "tokens": 0}
+    
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle_completions)
+        app.router.add_get("/_stats", self.handle_stats)
+        return app
+    
+    def _answer_for(self, messages: List[Dict[str, str]]) -> List[str]:
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        rng = random.Random(zlib.crc32(str(question).encode("utf-8")))
+        return [rng.choice(ANSWER_WORDS) for _ in range(self.tokens)]
+    
+    async def handle_completions(self, request: web.Request) -> web.StreamResponse:
+        self.stats["requests"] += 1
+        payload = await request.json()
+        model = payload.get("model", "stand-in")
+        tokens = self._answer_for(payload.get("messages", []))
+        delay = self.sample_latency(self.rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        
+        created = int(time.time())
+        if not payload.get("stream"):
+            self.stats["tokens"] += len(tokens)
+            return web.json_response({
+                "id": "chatcmpl-stand-in", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+            })
+        
+        self.stats["streaming"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        
+        def chunk(delta: Dict[str, str], finish_reason: str = None) -> bytes:
+            data = {
+                "id": "chatcmpl-stand-in", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        
+        await response.write(chunk({"role": "assistant", "content": ""}))
+        for token in tokens:
+            await response.write(chunk({"content": token}))
+            self.stats["tokens"] += 1
+            if self.token_delay > 0:
+                await asyncio.sleep(self.token_delay)
+        await response.write(chunk({}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地LLM接口替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--latency", default="fixed:0.2", help="首token延迟分布，格式同build_log_server.py")
+    parser.add_argument("--tokens", type=int, default=40, help="每个回答的token数")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="两个token之间的间隔秒数")
+    args = parser.parse_args()
+    
+    stand_in = LLMStandIn(args.latency, args.tokens, args.token_delay)
+    print(f"LLM接口替身服务: http://{args.host}:{args.port}/v1", flush=True)
+    web.run_app(stand_in.create_app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
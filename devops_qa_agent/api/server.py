@@ -1,22 +1,39 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
-import json
 import asyncio
-from typing import Dict, List
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
 import uuid
 
 from ..models import ChatRequest, ChatResponse, StreamResponse
-from ..services.chat_service import ChatAgent
+from ..services.chat_service import ChatAgent, StreamStats
+from ..services import logs, metrics
 from ..config import config
+from .streaming import ClientDisconnected, FrameEncoder, aclosing, coalesce, dumps, sse_event, wait_for_disconnect
 
-app = FastAPI(title="智能问答系统", version="1.0.0")
+# 先配置日志，之后各模块的日志经队列由后台线程输出
+logs.setup_logging()
+metrics.LOG_DROPPED.set_function(lambda: {(): logs.dropped_records()})
 
 # 创建聊天智能体实例
 chat_agent = ChatAgent()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 构建日志服务的连接池在应用生命周期内共享
+    await chat_agent.start()
+    yield
+    # 关闭连接池，并等待会话存储写入完成
+    await chat_agent.close()
+    logs.shutdown_logging()
+
+app = FastAPI(title="智能问答系统", version="1.0.0", lifespan=lifespan)
+
 # 存储活跃的WebSocket连接
 active_connections: Dict[str, WebSocket] = {}
 
@@ -30,8 +47,12 @@ async def get_chat_page(request: Request):
     return templates.TemplateResponse("chat.html", {"request": request})
 
 @app.post("/api/chat")
-async def chat_endpoint(request: ChatRequest):
-    """聊天接口 - 流式返回"""
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    """聊天接口 - 流式返回
+    
+    客户端中途断开时取消图的运行以及其中的LLM和构建日志请求，本轮不写入会话存储。
+    """
+    received_at = time.perf_counter()
     try:
         if not request.session_id:
             request.session_id = str(uuid.uuid4())
@@ -51,27 +72,53 @@ async def chat_endpoint(request: ChatRequest):
             cd_inst_id = None
             problem_desc = None
         
+        in_flight = metrics.IN_FLIGHT.labels("/api/chat")
+        first_chunk_latency = metrics.FIRST_CHUNK_LATENCY.labels("/api/chat")
+        
         async def generate_response():
             """生成流式响应"""
+            stats = StreamStats()
+            first_chunk = True
+            finished = False
+            # session_id只编码一次，每帧只编码内容
+            encoder = FrameEncoder({"session_id": request.session_id}, "chunk", b"data: ", b"\n\n")
+            disconnected = asyncio.ensure_future(wait_for_disconnect(http_request.receive))
+            in_flight.inc()
             try:
-                # 流式处理消息
-                async for chunk in chat_agent.process_streaming_message(
+                # 流式处理消息，token按时间窗口合并成帧后转发
+                chunks = chat_agent.process_streaming_message(
                     actual_message, 
                     request.session_id,
                     problem_type,
                     cd_inst_id,
-                    problem_desc
-                ):
-                    # 返回JSON格式的流式数据
-                    yield f"data: {json.dumps({'chunk': chunk, 'session_id': request.session_id})}\n\n"
-                    await asyncio.sleep(config.STREAM_DELAY)  # 控制输出速度
+                    problem_desc,
+                    stats=stats
+                )
+                frames = coalesce(chunks, config.SSE_FRAME_WINDOW_MS / 1000, config.SSE_FRAME_MAX_CHARS, disconnected)
+                async with aclosing(frames):
+                    async for chunk in frames:
+                        if first_chunk:
+                            first_chunk = False
+                            first_chunk_latency.observe(time.perf_counter() - received_at)
+                        # 返回JSON格式的流式数据
+                        yield encoder.encode(chunk)
                 
-                # 发送完成信号
-                yield f"data: {json.dumps({'complete': True, 'session_id': request.session_id})}\n\n"
+                # 发送完成信号，附带首token耗时等统计
+                yield sse_event({'complete': True, 'session_id': request.session_id, 'stats': stats.to_dict()})
+                finished = True
                 
+            except ClientDisconnected:
+                pass
             except Exception as e:
                 # 发送错误信息
-                yield f"data: {json.dumps({'error': str(e), 'session_id': request.session_id})}\n\n"
+                yield sse_event({'error': str(e), 'session_id': request.session_id})
+                finished = True
+            finally:
+                # 断开可能由上面的监听发现，也可能由Starlette取消本生成器或写入失败时关闭本生成器
+                if not finished:
+                    metrics.STREAMS_CANCELLED.labels("/api/chat").inc()
+                disconnected.cancel()
+                in_flight.dec()
         
         return StreamingResponse(
             generate_response(),
@@ -86,16 +133,37 @@ async def chat_endpoint(request: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def read_messages(websocket: WebSocket, incoming: "asyncio.Queue[Optional[str]]"):
+    """持续读取WebSocket消息放入队列，连接断开时放入None
+    
+    生成回答期间也在读取，客户端断开时本任务结束，用于及时取消正在进行的处理。
+    """
+    try:
+        while True:
+            incoming.put_nowait(await websocket.receive_text())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        incoming.put_nowait(None)
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """WebSocket流式聊天接口"""
     await websocket.accept()
     active_connections[session_id] = websocket
+    in_flight = metrics.IN_FLIGHT.labels("/ws")
+    first_chunk_latency = metrics.FIRST_CHUNK_LATENCY.labels("/ws")
+    chunk_encoder = FrameEncoder({"type": "chunk", "session_id": session_id}, "content")
+    incoming: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    reader = asyncio.ensure_future(read_messages(websocket, incoming))
     
     try:
         while True:
-            # 接收用户消息
-            data = await websocket.receive_text()
+            # 接收用户消息，None表示连接已断开
+            data = await incoming.get()
+            if data is None:
+                break
+            received_at = time.perf_counter()
             message_data = json.loads(data)
             user_message = message_data.get("message", "")
             
@@ -103,47 +171,72 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                 continue
             
             # 发送处理步骤
-            await websocket.send_text(json.dumps({
+            await websocket.send_text(dumps({
                 "type": "status",
                 "content": "正在处理您的问题...",
                 "session_id": session_id
-            }))
+            }).decode())
             
-            # 流式处理消息
-            async for chunk in chat_agent.process_streaming_message(user_message, session_id):
-                await websocket.send_text(json.dumps({
-                    "type": "chunk",
-                    "content": chunk,
-                    "session_id": session_id
-                }))
-                await asyncio.sleep(config.STREAM_DELAY)  # 控制输出速度
+            # 流式处理消息，token按时间窗口合并成帧后转发；连接断开时取消本轮处理
+            stats = StreamStats()
+            first_chunk = True
+            in_flight.inc()
+            try:
+                chunks = chat_agent.process_streaming_message(user_message, session_id, stats=stats)
+                frames = coalesce(chunks, config.WS_FRAME_WINDOW_MS / 1000, config.WS_FRAME_MAX_CHARS, reader)
+                async with aclosing(frames):
+                    async for chunk in frames:
+                        if first_chunk:
+                            first_chunk = False
+                            first_chunk_latency.observe(time.perf_counter() - received_at)
+                        await websocket.send_text(chunk_encoder.encode(chunk).decode())
+            except (ClientDisconnected, WebSocketDisconnect):
+                metrics.STREAMS_CANCELLED.labels("/ws").inc()
+                break
+            finally:
+                in_flight.dec()
             
-            # 发送完成信号
-            await websocket.send_text(json.dumps({
+            # 发送完成信号，附带首token耗时等统计
+            await websocket.send_text(dumps({
                 "type": "complete",
                 "content": "",
-                "session_id": session_id
-            }))
+                "session_id": session_id,
+                "stats": stats.to_dict()
+            }).decode())
             
     except WebSocketDisconnect:
-        if session_id in active_connections:
-            del active_connections[session_id]
+        pass
     except Exception as e:
-        await websocket.send_text(json.dumps({
-            "type": "error",
-            "content": f"处理失败: {str(e)}",
-            "session_id": session_id
-        }))
+        # 连接已断开时不再发送
+        if not reader.done():
+            try:
+                await websocket.send_text(dumps({
+                    "type": "error",
+                    "content": f"处理失败: {str(e)}",
+                    "session_id": session_id
+                }).decode())
+            except (WebSocketDisconnect, RuntimeError):
+                pass
+    finally:
+        reader.cancel()
+        if active_connections.get(session_id) is websocket:
+            del active_connections[session_id]
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus格式的运行指标"""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/api/sessions/{session_id}")
-async def get_session_history(session_id: str):
-    """获取会话历史"""
+async def get_session_history(session_id: str, before: Optional[int] = None, limit: Optional[int] = None):
+    """分页获取会话历史，before为上一页返回的next_cursor"""
     try:
-        # 这里应该从持久化存储中获取会话历史
-        # 目前返回空历史
+        limit = min(max(limit or config.SESSION_HISTORY_PAGE_SIZE, 1), 500)
+        history = await chat_agent.get_session_history(session_id, before, limit)
         return {
             "session_id": session_id,
-            "messages": []
+            "messages": history["messages"],
+            "next_cursor": history["next_cursor"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -152,7 +245,7 @@ async def get_session_history(session_id: str):
 async def delete_session(session_id: str):
     """删除会话"""
     try:
-        # 这里应该从持久化存储中删除会话
+        await chat_agent.delete_session(session_id)
         return {"message": "会话已删除", "session_id": session_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,184 @@
+"""
+流式输出
+
+- dumps: JSON编码，使用orjson（requirements.txt已包含），输出UTF-8字节
+- FrameEncoder: 固定字段（session_id、type等）预先编码，每帧只编码内容字段
+- coalesce: 把token流合并成帧，减少小帧和系统调用；客户端断开时取消上游
+- aclosing: 退出时关闭异步生成器，contextlib.aclosing需要Python 3.10
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 缺少orjson时退回标准库json，编码较慢但输出相同
+    orjson = None
+
+
+def dumps(data: Any) -> bytes:
+    """编码为紧凑的UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FrameEncoder:
+    """内容字段之外的字段固定不变的JSON帧
+
+    固定字段在创建时编码一次，每帧只编码内容字段再拼接，
+    prefix和suffix为帧的前后缀（如SSE的"data: "和空行）。
+    """
+    
+    def __init__(self, fields: Dict[str, Any], content_key: str, prefix: bytes = b"", suffix: bytes = b""):
+        head = dumps(fields)[:-1]
+        if fields:
+            head += b","
+        self._head = prefix + head + dumps(content_key) + b":"
+        self._tail = b"}" + suffix
+    
+    def encode(self, content: Any) -> bytes:
+        return self._head + dumps(content) + self._tail
+
+
+class aclosing:
+    """退出时调用aclose()的异步上下文管理器，与contextlib.aclosing相同"""
+    
+    def __init__(self, thing):
+        self.thing = thing
+    
+    async def __aenter__(self):
+        return self.thing
+    
+    async def __aexit__(self, *exc_info):
+        await self.thing.aclose()
+
+
+class ClientDisconnected(Exception):
+    """输出过程中客户端断开了连接"""
+
+
+async def wait_for_disconnect(receive: Callable[[], Awaitable[Dict[str, Any]]]):
+    """读取ASGI消息直到收到http.disconnect
+
+    请求体已读完时receive只会在连接断开时返回。Starlette只在ASGI HTTP规范低于2.4时自己监听断开，
+    并且只在写入时才会发现，等待首个token期间客户端断开也需要由这里通知。
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def sse_event(data: Dict[str, Any]) -> bytes:
+    """将数据序列化为一个SSE帧"""
+    return b"data: " + dumps(data) + b"\n\n"
+
+
+class _Pump:
+    """在单独的任务中读取上游的token，累积到下一帧输出"""
+    
+    def __init__(self, chunks: AsyncIterator[str], max_chars: int):
+        self.max_chars = max_chars
+        self.pending: List[str] = []
+        self.size = 0
+        self.started_at = 0.0
+        self.done = False
+        self.disconnected = False
+        self.cancelled = False
+        self.error: Optional[BaseException] = None
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        # 整个上游在同一个任务中迭代，上游设置的上下文变量在各步之间保持
+        self.task = asyncio.ensure_future(self._run(chunks))
+    
+    async def _run(self, chunks: AsyncIterator[str]):
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if not self.pending:
+                    self.started_at = self.loop.time()
+                    self.wakeup.set()
+                self.pending.append(chunk)
+                self.size += len(chunk)
+                if self.size >= self.max_chars:
+                    self.wakeup.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.wakeup.set()
+    
+    async def wait(self):
+        await self.wakeup.wait()
+        self.wakeup.clear()
+    
+    def cancel(self):
+        """取消上游，只取消一次：再次取消会打断上游收到取消后的清理（如图等待节点任务退出）"""
+        if not self.cancelled:
+            self.cancelled = True
+            self.task.cancel()
+    
+    def disconnect(self, _=None):
+        """客户端已断开：取消上游，丢弃未输出的内容"""
+        self.disconnected = True
+        self.cancel()
+        self.wakeup.set()
+    
+    def take(self) -> str:
+        frame = "".join(self.pending)
+        self.pending = []
+        self.size = 0
+        return frame
+
+
+async def coalesce(chunks: AsyncIterator[str], window: float, max_chars: int,
+                   disconnected: Optional[asyncio.Future] = None) -> AsyncIterator[str]:
+    """把token流合并成帧
+
+    第一帧立即输出；之后每帧从第一个token起最多等待window秒，攒够max_chars个字符时提前输出。
+    window不大于0时不等待，只合并输出上一帧期间已到达的token。上游的异常在输出已收到的内容后抛出；
+    调用方提前关闭时取消上游。disconnected完成时（客户端断开）立即取消上游并抛出ClientDisconnected，
+    不必等到下一次写入失败。
+    """
+    pump = _Pump(chunks, max_chars)
+    if disconnected is not None:
+        disconnected.add_done_callback(pump.disconnect)
+    first = True
+    try:
+        while True:
+            while not pump.pending and not pump.done and not pump.disconnected:
+                await pump.wait()
+            if pump.disconnected:
+                raise ClientDisconnected()
+            if not pump.pending:
+                break
+            
+            if not first and window > 0:
+                deadline = pump.started_at + window
+                timer = pump.loop.call_at(deadline, pump.wakeup.set)
+                try:
+                    while (pump.size < max_chars and not pump.done and not pump.disconnected
+                           and pump.loop.time() < deadline):
+                        await pump.wait()
+                finally:
+                    timer.cancel()
+                if pump.disconnected:
+                    raise ClientDisconnected()
+            first = False
+            yield pump.take()
+        
+        if pump.error is not None:
+            raise pump.error
+    finally:
+        if disconnected is not None:
+            disconnected.remove_done_callback(pump.disconnect)
+        if not pump.task.done():
+            pump.cancel()
+            try:
+                # 等待上游清理完成；调用方自身被取消时（如Starlette在断开后反复取消）不把取消再传给上游
+                await asyncio.shield(pump.task)
+            except asyncio.CancelledError:
+                if not pump.task.done():
+                    raise
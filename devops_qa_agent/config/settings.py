@@ -8,18 +8,117 @@ class Config:
     # OpenAI配置
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "")  # 兼容OpenAI接口的服务地址，为空时使用OpenAI官方地址
+    
+    # LLM客户端配置（意图识别和回答生成共用一个连接池）
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))  # 按服务商的并发限制设置
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    LLM_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))  # 空闲连接保留秒数
+    LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "true").lower() == "true"  # 需要安装h2，未安装时使用HTTP/1.1
+    LLM_CONNECT_TIMEOUT: float = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "120"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    LLM_STREAMING: bool = os.getenv("LLM_STREAMING", "true").lower() == "true"  # 部分服务商要求必须启用流式模式
+    INTENT_LLM_MODEL: str = os.getenv("INTENT_LLM_MODEL", "")  # 为空时使用OPENAI_MODEL
+    INTENT_LLM_TEMPERATURE: float = float(os.getenv("INTENT_LLM_TEMPERATURE", "0.1"))
+    INTENT_LLM_MAX_TOKENS: int = int(os.getenv("INTENT_LLM_MAX_TOKENS", "0"))  # 0表示不限制
+    ANSWER_LLM_MODEL: str = os.getenv("ANSWER_LLM_MODEL", "")  # 为空时使用OPENAI_MODEL
+    ANSWER_LLM_TEMPERATURE: float = float(os.getenv("ANSWER_LLM_TEMPERATURE", "0.7"))
+    ANSWER_LLM_MAX_TOKENS: int = int(os.getenv("ANSWER_LLM_MAX_TOKENS", "0"))  # 0表示不限制
+    
+    # 意图识别配置
+    INTENT_CONFIDENCE_THRESHOLD: float = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))  # 本地分类置信度低于该值时调用LLM
+    INTENT_MODEL_PATH: str = os.getenv("INTENT_MODEL_PATH", "")  # 可选的本地线性意图模型（JSON）
+    INTENT_CACHE_SIZE: int = int(os.getenv("INTENT_CACHE_SIZE", "1024"))
+    INTENT_CACHE_TTL: float = float(os.getenv("INTENT_CACHE_TTL", "3600"))  # 秒
     
     # 外部API配置
     BUILD_LOG_API_URL: str = os.getenv("BUILD_LOG_API_URL", "http://localhost:8001/api/build-log")
+    BUILD_LOG_MOCK: bool = os.getenv("BUILD_LOG_MOCK", "true").lower() == "true"  # 按实例ID查询时返回模拟数据
+    BUILD_LOG_SOURCE: str = os.getenv("BUILD_LOG_SOURCE", "api")  # api-使用接口返回的错误关键字，raw-下载原始日志在本地分析
+    BUILD_LOG_CHUNK_SIZE: int = int(os.getenv("BUILD_LOG_CHUNK_SIZE", str(1024 * 1024)))  # 流式分析原始日志时每块的字节数
+    BUILD_LOG_MAX_CONNECTIONS: int = int(os.getenv("BUILD_LOG_MAX_CONNECTIONS", "100"))
+    BUILD_LOG_MAX_CONNECTIONS_PER_HOST: int = int(os.getenv("BUILD_LOG_MAX_CONNECTIONS_PER_HOST", "20"))
+    BUILD_LOG_MAX_CONCURRENCY: int = int(os.getenv("BUILD_LOG_MAX_CONCURRENCY", "32"))  # 同时发往构建日志API的请求数上限
+    BUILD_LOG_KEEPALIVE_TIMEOUT: float = float(os.getenv("BUILD_LOG_KEEPALIVE_TIMEOUT", "30"))  # 空闲连接保留秒数
+    BUILD_LOG_CONNECT_TIMEOUT: float = float(os.getenv("BUILD_LOG_CONNECT_TIMEOUT", "3"))
+    BUILD_LOG_READ_TIMEOUT: float = float(os.getenv("BUILD_LOG_READ_TIMEOUT", "10"))
+    BUILD_LOG_TOTAL_TIMEOUT: float = float(os.getenv("BUILD_LOG_TOTAL_TIMEOUT", "30"))
+    BUILD_LOG_MAX_RETRIES: int = int(os.getenv("BUILD_LOG_MAX_RETRIES", "2"))
+    BUILD_LOG_RETRY_BACKOFF: float = float(os.getenv("BUILD_LOG_RETRY_BACKOFF", "0.2"))  # 退避基准秒数，按2的幂增长并加随机抖动
+    BUILD_LOG_CACHE_SIZE: int = int(os.getenv("BUILD_LOG_CACHE_SIZE", "1024"))  # 按实例ID缓存的条数
+    BUILD_LOG_CACHE_TTL: float = float(os.getenv("BUILD_LOG_CACHE_TTL", "86400"))  # 已结束实例的缓存秒数
+    BUILD_LOG_RUNNING_TTL: float = float(os.getenv("BUILD_LOG_RUNNING_TTL", "15"))  # 执行中实例的缓存秒数
     
     # 知识库配置
     KNOWLEDGE_BASE_PATH: str = os.getenv("KNOWLEDGE_BASE_PATH", "./devops_qa_agent/knowledge/data")
+    KNOWLEDGE_SEARCH_MODE: str = os.getenv("KNOWLEDGE_SEARCH_MODE", "bm25")  # bm25 或 keyword
+    KNOWLEDGE_TOP_K: int = int(os.getenv("KNOWLEDGE_TOP_K", "3"))  # 发送给LLM的知识条数
+    KNOWLEDGE_SEMANTIC_ENABLED: bool = os.getenv("KNOWLEDGE_SEMANTIC_ENABLED", "true").lower() == "true"  # 语义检索（numpy）
+    KNOWLEDGE_SEMANTIC_MIN_SCORE: float = float(os.getenv("KNOWLEDGE_SEMANTIC_MIN_SCORE", "0.15"))
+    KNOWLEDGE_EMBEDDING_DIM: int = int(os.getenv("KNOWLEDGE_EMBEDDING_DIM", "512"))
+    KNOWLEDGE_IVF_LISTS: int = int(os.getenv("KNOWLEDGE_IVF_LISTS", "256"))  # 条目数超过1万时启用IVF分区
+    KNOWLEDGE_IVF_PROBES: int = int(os.getenv("KNOWLEDGE_IVF_PROBES", "8"))
+    
+    # 提示词配置
+    PROMPT_MAX_TOKENS: int = int(os.getenv("PROMPT_MAX_TOKENS", "3000"))  # 输入token预算（估算值）
+    PROMPT_RECENT_MESSAGES: int = int(os.getenv("PROMPT_RECENT_MESSAGES", "6"))  # 保留原文的最近历史消息数，更早的并入摘要
+    PROMPT_SUMMARY_MAX_TOKENS: int = int(os.getenv("PROMPT_SUMMARY_MAX_TOKENS", "400"))
+    
+    # 本地数据目录（缓存、会话、语义索引等）
+    DATA_DIR: str = os.getenv("DATA_DIR", "./data")
+    # 语义索引文件所在目录，不写入包内的知识库目录（安装目录可能只读）
+    KNOWLEDGE_INDEX_DIR: str = os.getenv("KNOWLEDGE_INDEX_DIR", os.path.join(DATA_DIR, "knowledge_index"))
+    
+    # 多进程配置（uvicorn多个工作进程，或同一主机上的多个副本）
+    WORKERS: int = int(os.getenv("WORKERS", "1"))
+    # 会话和缓存放在同一主机上所有进程共用的SQLite文件中，WORKERS大于1时总是开启
+    SHARED_STATE_ENABLED: bool = os.getenv("SHARED_STATE_ENABLED", "false").lower() == "true" or WORKERS > 1
+    # 意图识别和构建日志缓存的磁盘层，为空时共享状态模式下使用DATA_DIR中的默认文件，否则只使用内存层
+    INTENT_CACHE_PATH: str = os.getenv("INTENT_CACHE_PATH") or (
+        os.path.join(DATA_DIR, "intent_cache.db") if SHARED_STATE_ENABLED else ""
+    )
+    BUILD_LOG_CACHE_PATH: str = os.getenv("BUILD_LOG_CACHE_PATH") or (
+        os.path.join(DATA_DIR, "build_log_cache.db") if SHARED_STATE_ENABLED else ""
+    )
+    
+    # 会话检查点配置
+    CHECKPOINT_MAX_SESSIONS: int = int(os.getenv("CHECKPOINT_MAX_SESSIONS", "1000"))
+    CHECKPOINT_MAX_BYTES: int = int(os.getenv("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))
+    CHECKPOINT_SESSION_TTL: float = float(os.getenv("CHECKPOINT_SESSION_TTL", "3600"))  # 会话空闲超过该秒数后淘汰
+    CHECKPOINT_KEEP_PER_THREAD: int = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "2"))  # 每个会话保留的检查点数
+    
+    # 会话持久化配置
+    SESSION_STORE_ENABLED: bool = os.getenv("SESSION_STORE_ENABLED", "true").lower() == "true"
+    SESSION_DB_PATH: str = os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, "sessions.db"))
+    SESSION_RESTORE_MESSAGES: int = int(os.getenv("SESSION_RESTORE_MESSAGES", "50"))  # 从存储恢复会话时加载的最近消息数
+    SESSION_HISTORY_PAGE_SIZE: int = int(os.getenv("SESSION_HISTORY_PAGE_SIZE", "50"))
+    
+    # 回答缓存配置
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_SIZE: int = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+    ANSWER_CACHE_MAX_BYTES: int = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+    ANSWER_CACHE_TTL: float = float(os.getenv("ANSWER_CACHE_TTL", "1800"))  # 秒
+    ANSWER_CACHE_PATH: str = os.getenv("ANSWER_CACHE_PATH", os.path.join(DATA_DIR, "answer_cache.db"))  # 为空时只使用内存层
+    
+    # 提示词和模型参数完全相同的并发LLM调用共享一次上游请求
+    LLM_COALESCE_ENABLED: bool = os.getenv("LLM_COALESCE_ENABLED", "true").lower() == "true"
+    
+    # 流式输出配置：token合并成帧，攒够字符数或距帧内第一个token超过窗口时输出一帧，窗口为0时不等待，只合并写出上一帧期间到达的token
+    SSE_FRAME_WINDOW_MS: float = float(os.getenv("SSE_FRAME_WINDOW_MS", "16"))  # /api/chat
+    SSE_FRAME_MAX_CHARS: int = int(os.getenv("SSE_FRAME_MAX_CHARS", "1024"))
+    WS_FRAME_WINDOW_MS: float = float(os.getenv("WS_FRAME_WINDOW_MS", "16"))  # /ws/{session_id}
+    WS_FRAME_MAX_CHARS: int = int(os.getenv("WS_FRAME_MAX_CHARS", "1024"))
+    
+    # 日志配置
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")  # json 或 text
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # 待写入的日志条数上限，超出时丢弃
+    LOG_PAYLOAD_MAX_CHARS: int = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "500"))  # DEBUG日志中提示词、回答等内容的最大字符数
+    LOG_PAYLOAD_SAMPLE_RATE: float = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))  # DEBUG日志中输出大段内容的比例
     
     # 服务器配置
     HOST: str = os.getenv("HOST", "127.0.0.1")
     PORT: int = int(os.getenv("PORT", "8000"))
-    
-    # 流式输出配置
-    STREAM_DELAY: float = 0.05  # 每个字符输出的延迟时间（秒）
 
 config = Config()
@@ -1,11 +1,26 @@
 import json
+import logging
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from ..config import config
+from .matcher import KeywordAutomaton
+from .ranking import BM25Index
+from . import semantic
+
+logger = logging.getLogger(__name__)
+
+# 分类名 -> 检索结果中的类型
+CATEGORY_TYPES = {
+    "build_errors": "build_error",
+    "general_qa": "general"
+}
 
 class KnowledgeBase:
-    def __init__(self):
+    def __init__(self, embedder: semantic.Embedder = None):
         self.kb_path = config.KNOWLEDGE_BASE_PATH
+        # 语义检索使用的向量化函数，默认使用本地哈希向量化
+        self.embedder = embedder
+        self.semantic_index = None
         self.ensure_kb_directory()
         self.load_knowledge_base()
     
@@ -24,6 +39,59 @@ class KnowledgeBase:
         
         with open(self.kb_file, 'r', encoding='utf-8') as f:
             self.knowledge_data = json.load(f)
+        
+        self.build_index()
+    
+    def build_index(self):
+        """为构建错误知识和一般知识分别构建关键字匹配自动机"""
+        self.build_error_automaton, self.build_error_owners = self._build_automaton(
+            self.knowledge_data.get("build_errors", [])
+        )
+        self.general_automaton, self.general_owners = self._build_automaton(
+            self.knowledge_data.get("general_qa", [])
+        )
+        
+        # 所有分类的条目按文件顺序展开，条目ID形如 "build_errors:0"
+        self.entries = []
+        for category, category_entries in self.knowledge_data.items():
+            for index, entry in enumerate(category_entries):
+                self.entries.append((f"{category}:{index}", category, entry))
+        documents = [
+            " ".join([entry["question"], entry["answer"]] + entry["keywords"])
+            for _, _, entry in self.entries
+        ]
+        self.bm25_index = BM25Index(documents)
+        self.build_semantic_index(documents)
+    
+    def build_semantic_index(self, documents: List[str]):
+        """构建语义向量索引，条目未变化时直接复用已有的索引文件"""
+        if not config.KNOWLEDGE_SEMANTIC_ENABLED:
+            return
+        
+        if self.semantic_index is None:
+            embedder = self.embedder or semantic.HashingEmbedder(config.KNOWLEDGE_EMBEDDING_DIM)
+            self.semantic_index = semantic.SemanticIndex(
+                config.KNOWLEDGE_INDEX_DIR,
+                embedder,
+                nlist=config.KNOWLEDGE_IVF_LISTS,
+                nprobe=config.KNOWLEDGE_IVF_PROBES
+            )
+        try:
+            self.semantic_index.build(documents)
+        except OSError as e:
+            logger.warning("语义索引文件写入失败，语义检索不可用: %s", e, extra={"index_dir": config.KNOWLEDGE_INDEX_DIR})
+            self.semantic_index = None
+    
+    @staticmethod
+    def _build_automaton(entries: List[Dict[str, Any]]) -> Tuple[KeywordAutomaton, List[Tuple[int, int]]]:
+        """构建自动机，并记录每个关键字所属的(条目序号, 关键字序号)"""
+        patterns = []
+        owners = []
+        for entry_index, entry in enumerate(entries):
+            for keyword_index, keyword in enumerate(entry["keywords"]):
+                patterns.append(keyword)
+                owners.append((entry_index, keyword_index))
+        return KeywordAutomaton(patterns), owners
     
     def create_default_knowledge_base(self):
         """创建默认知识库"""
@@ -68,33 +136,89 @@ class KnowledgeBase:
             json.dump(default_kb, f, ensure_ascii=False, indent=2)
     
     def search_knowledge(self, query: str, error_keywords: List[str] = None) -> List[Dict[str, Any]]:
-        """搜索知识库"""
+        """搜索知识库
+        
+        对每段文本只扫描一遍自动机，再将命中的关键字映射回知识条目。
+        结果与逐条目、逐关键字做子串匹配的顺序和内容完全一致。
+        """
         results = []
         
         # 如果有错误关键字，优先搜索构建错误知识库
         if error_keywords:
-            for error_kb in self.knowledge_data.get("build_errors", []):
-                for keyword in error_keywords:
-                    if any(kw.lower() in keyword.lower() for kw in error_kb["keywords"]):
-                        results.append({
-                            "type": "build_error",
-                            "question": error_kb["question"],
-                            "answer": error_kb["answer"],
-                            "matched_keyword": keyword
-                        })
-        
-        # 搜索一般知识库
-        for general_kb in self.knowledge_data.get("general_qa", []):
-            for keyword in general_kb["keywords"]:
-                if keyword.lower() in query.lower():
+            build_errors = self.knowledge_data.get("build_errors", [])
+            # 条目序号 -> 命中该条目的错误关键字序号
+            hits_by_entry: Dict[int, set] = {}
+            for error_index, matched in enumerate(self.build_error_automaton.search_many(error_keywords)):
+                for pattern_id in matched:
+                    entry_index = self.build_error_owners[pattern_id][0]
+                    hits_by_entry.setdefault(entry_index, set()).add(error_index)
+            
+            for entry_index in sorted(hits_by_entry):
+                error_kb = build_errors[entry_index]
+                for error_index in sorted(hits_by_entry[entry_index]):
                     results.append({
-                        "type": "general",
-                        "question": general_kb["question"],
-                        "answer": general_kb["answer"],
-                        "matched_keyword": keyword
+                        "type": "build_error",
+                        "question": error_kb["question"],
+                        "answer": error_kb["answer"],
+                        "matched_keyword": error_keywords[error_index]
                     })
-                    break
         
+        # 搜索一般知识库，每个条目取关键字列表中第一个命中的关键字
+        general_qa = self.knowledge_data.get("general_qa", [])
+        first_keyword_by_entry: Dict[int, int] = {}
+        for pattern_id in self.general_automaton.search(query):
+            entry_index, keyword_index = self.general_owners[pattern_id]
+            current = first_keyword_by_entry.get(entry_index)
+            if current is None or keyword_index < current:
+                first_keyword_by_entry[entry_index] = keyword_index
+        
+        for entry_index in sorted(first_keyword_by_entry):
+            general_kb = general_qa[entry_index]
+            results.append({
+                "type": "general",
+                "question": general_kb["question"],
+                "answer": general_kb["answer"],
+                "matched_keyword": general_kb["keywords"][first_keyword_by_entry[entry_index]]
+            })
+        
+        return results
+    
+    def search_ranked(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
+        """按BM25得分检索知识库，返回得分最高的top_k条结果"""
+        if top_k is None:
+            top_k = config.KNOWLEDGE_TOP_K
+        
+        results = []
+        for doc_id, score in self.bm25_index.search(query, top_k):
+            entry_id, category, entry = self.entries[doc_id]
+            results.append({
+                "id": entry_id,
+                "type": CATEGORY_TYPES.get(category, category),
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "score": round(score, 4)
+            })
+        return results
+    
+    def search_semantic(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
+        """按向量相似度检索知识库，用于关键字无法命中的同义表述"""
+        if self.semantic_index is None:
+            return []
+        if top_k is None:
+            top_k = config.KNOWLEDGE_TOP_K
+        
+        results = []
+        for doc_id, score in self.semantic_index.search(query, top_k):
+            if score < config.KNOWLEDGE_SEMANTIC_MIN_SCORE:
+                continue
+            entry_id, category, entry = self.entries[doc_id]
+            results.append({
+                "id": entry_id,
+                "type": CATEGORY_TYPES.get(category, category),
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "score": round(score, 4)
+            })
         return results
     
     def add_knowledge(self, category: str, keywords: List[str], question: str, answer: str):
@@ -109,6 +233,7 @@ class KnowledgeBase:
         }
         
         self.knowledge_data[category].append(new_knowledge)
+        self.build_index()
         
         # 保存到文件
         with open(self.kb_file, 'w', encoding='utf-8') as f:
@@ -0,0 +1,76 @@
+"""
+关键字多模式匹配模块
+"""
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+
+class KeywordAutomaton:
+    """基于Aho-Corasick算法的多关键字匹配自动机
+
+    关键字在构建时统一转换为小写，匹配时文本同样转换为小写，
+    与 ``keyword.lower() in text.lower()`` 的子串语义保持一致。
+    自动机只需构建一次，之后每段文本只需扫描一遍即可找出全部命中的关键字。
+    """
+    
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = [pattern.lower() for pattern in patterns]
+        # 空关键字是任何文本的子串，单独记录
+        self.empty_pattern_ids: List[int] = [i for i, p in enumerate(self.patterns) if not p]
+        
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+        
+        for pattern_id, pattern in enumerate(self.patterns):
+            if pattern:
+                self._insert(pattern_id, pattern)
+        self._build_failure_links()
+    
+    def _insert(self, pattern_id: int, pattern: str):
+        """将关键字插入字典树"""
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append(pattern_id)
+    
+    def _build_failure_links(self):
+        """按层次遍历构建失败指针，并合并后缀节点的输出"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                if self.output[self.fail[child]]:
+                    self.output[child] = self.output[child] + self.output[self.fail[child]]
+    
+    def search(self, text: str) -> Set[int]:
+        """返回在文本中出现的所有关键字编号"""
+        matched = set(self.empty_pattern_ids)
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        node = 0
+        for char in text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                matched.update(output[node])
+        return matched
+    
+    def search_many(self, texts: Iterable[str]) -> List[Set[int]]:
+        """依次扫描多段文本，返回每段文本命中的关键字编号"""
+        return [self.search(text) for text in texts]
@@ -0,0 +1,78 @@
+"""
+BM25排序检索模块
+"""
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# 英文/数字按单词切分，中日韩字符按连续片段切分
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+ASCII_WORD = re.compile(r"[a-z0-9_]+")
+
+
+def tokenize(text: str, ngram: int = 2) -> List[str]:
+    """将文本切分为检索词
+
+    英文按单词切分；中文没有空格分词，按字符n-gram切分，
+    长度不足n的片段整体作为一个词。
+    """
+    tokens = []
+    for segment in TOKEN_PATTERN.findall(text.lower()):
+        if ASCII_WORD.fullmatch(segment):
+            tokens.append(segment)
+        elif len(segment) <= ngram:
+            tokens.append(segment)
+        else:
+            tokens.extend(segment[i:i + ngram] for i in range(len(segment) - ngram + 1))
+    return tokens
+
+
+class BM25Index:
+    """基于倒排索引的BM25检索"""
+    
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75, ngram: int = 2):
+        self.k1 = k1
+        self.b = b
+        self.ngram = ngram
+        self.doc_count = len(documents)
+        self.doc_lengths: List[int] = []
+        # 检索词 -> [(文档序号, 词频)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        
+        for doc_id, document in enumerate(documents):
+            term_counts = Counter(tokenize(document, ngram))
+            self.doc_lengths.append(sum(term_counts.values()))
+            for term, tf in term_counts.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+        
+        total_length = sum(self.doc_lengths)
+        self.avg_doc_length = total_length / self.doc_count if self.doc_count else 0.0
+        self.idf: Dict[str, float] = {
+            term: math.log(1 + (self.doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+    
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """返回得分最高的top_k个(文档序号, 得分)，按得分从高到低排列"""
+        if not self.doc_count or top_k <= 0:
+            return []
+        
+        k1 = self.k1
+        b = self.b
+        avg_doc_length = self.avg_doc_length or 1.0
+        doc_lengths = self.doc_lengths
+        scores: Dict[int, float] = {}
+        
+        for term in set(tokenize(query, self.ngram)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in postings:
+                norm = k1 * (1 - b + b * doc_lengths[doc_id] / avg_doc_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        
+        # 同分时按文档序号靠前优先，保证结果稳定
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
@@ -0,0 +1,228 @@
+"""
+知识库语义向量检索模块
+
+依赖numpy（requirements.txt中的必需依赖），是否启用由KNOWLEDGE_SEMANTIC_ENABLED控制。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .ranking import TOKEN_PATTERN, ASCII_WORD
+
+# 向量化函数：输入文本列表，返回 (文本数, 维度) 的float32矩阵，每行已L2归一化
+Embedder = Callable[[List[str]], "np.ndarray"]
+
+
+class HashingEmbedder:
+    """基于特征哈希的本地向量化函数，不依赖网络和模型文件
+
+    英文按单词、中文按2~3字符n-gram提取特征，经crc32哈希映射到固定维度，
+    同一文本在不同进程中得到的向量完全一致。
+    """
+    
+    def __init__(self, dim: int = 512, min_ngram: int = 2, max_ngram: int = 3):
+        self.dim = dim
+        self.min_ngram = min_ngram
+        self.max_ngram = max_ngram
+        self.name = f"hashing-{dim}-{min_ngram}-{max_ngram}"
+    
+    def features(self, text: str) -> List[str]:
+        """提取文本特征"""
+        features = []
+        for segment in TOKEN_PATTERN.findall(text.lower()):
+            if ASCII_WORD.fullmatch(segment):
+                features.append(segment)
+                continue
+            if len(segment) < self.min_ngram:
+                features.append(segment)
+                continue
+            for n in range(self.min_ngram, self.max_ngram + 1):
+                features.extend(segment[i:i + n] for i in range(len(segment) - n + 1))
+        return features
+    
+    def __call__(self, texts: List[str]) -> "np.ndarray":
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                hashed = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if hashed & 0x80000000 else -1.0
+                matrix[row, hashed % self.dim] += sign
+        # 次线性词频缩放后做L2归一化
+        np.copysign(np.log1p(np.abs(matrix)), matrix, out=matrix)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix
+
+
+class SemanticIndex:
+    """知识条目向量索引
+
+    条目向量在入库时计算一次，以连续的float32矩阵写入文件并通过内存映射读取。
+    条目数达到阈值时使用IVF分区：先用k-means得到粗聚类中心，
+    查询时只在最接近的若干分区内计算相似度。
+    """
+    
+    def __init__(self, index_dir: str, embedder: Embedder, nlist: int = 0,
+                 nprobe: int = 8, ivf_min_entries: int = 10000):
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_min_entries = ivf_min_entries
+        
+        self.meta_file = os.path.join(index_dir, "semantic_index.json")
+        self.vectors_file = os.path.join(index_dir, "semantic_vectors.f32")
+        self.centroids_file = os.path.join(index_dir, "semantic_centroids.f32")
+        self.assign_file = os.path.join(index_dir, "semantic_assign.i32")
+        
+        self.vectors = None
+        self.centroids = None
+        self.inverted_lists: List["np.ndarray"] = []
+    
+    def _fingerprint(self, texts: List[str]) -> str:
+        """计算条目文本和向量化函数的指纹，用于判断索引文件是否可以复用"""
+        digest = hashlib.sha1()
+        digest.update(getattr(self.embedder, "name", type(self.embedder).__name__).encode("utf-8"))
+        digest.update(str(self.nlist).encode("utf-8"))
+        for text in texts:
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+    
+    def build(self, texts: List[str]):
+        """加载索引；索引文件不存在或条目发生变化时重新计算向量"""
+        fingerprint = self._fingerprint(texts)
+        meta = self._read_meta()
+        if meta and meta.get("fingerprint") == fingerprint and meta.get("count") == len(texts):
+            self._open(meta)
+            return
+        
+        os.makedirs(self.index_dir, exist_ok=True)
+        vectors = np.ascontiguousarray(self.embedder(texts), dtype=np.float32) if texts else None
+        meta = {
+            "fingerprint": fingerprint,
+            "count": len(texts),
+            "dim": int(vectors.shape[1]) if vectors is not None else 0,
+            "nlist": 0
+        }
+        if vectors is not None:
+            self._write_array(self.vectors_file, vectors)
+            nlist = min(self.nlist, len(texts))
+            if nlist > 1 and len(texts) >= self.ivf_min_entries:
+                centroids, assignments = self._train_ivf(vectors, nlist)
+                self._write_array(self.centroids_file, centroids)
+                self._write_array(self.assign_file, assignments)
+                meta["nlist"] = nlist
+        
+        tmp_file = self._temp_file(self.meta_file)
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_file, self.meta_file)
+        except Exception:
+            self._remove(tmp_file)
+            raise
+        self._open(meta)
+    
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _write_array(path: str, array: "np.ndarray"):
+        """先写临时文件再替换，避免其他进程读到写了一半的索引"""
+        tmp_file = SemanticIndex._temp_file(path)
+        try:
+            mapped = np.memmap(tmp_file, dtype=array.dtype, mode="w+", shape=array.shape)
+            mapped[:] = array
+            mapped.flush()
+            del mapped
+            os.replace(tmp_file, path)
+        except Exception:
+            SemanticIndex._remove(tmp_file)
+            raise
+    
+    @staticmethod
+    def _temp_file(path: str) -> str:
+        """在目标文件所在目录创建独有的临时文件
+        
+        多个工作进程启动时会同时构建索引，各自写自己的临时文件再替换，
+        不会截断其他进程正在通过内存映射写入的文件。构建本身不在进程间协调，结果相同，后替换的生效。
+        """
+        fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                        dir=os.path.dirname(path))
+        os.close(fd)
+        return tmp_file
+    
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _open(self, meta: dict):
+        """以只读内存映射方式打开索引文件"""
+        self.vectors = None
+        self.centroids = None
+        self.inverted_lists = []
+        if not meta["count"]:
+            return
+        
+        self.vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r",
+                                 shape=(meta["count"], meta["dim"]))
+        if meta["nlist"]:
+            self.centroids = np.array(np.memmap(self.centroids_file, dtype=np.float32, mode="r",
+                                                shape=(meta["nlist"], meta["dim"])))
+            assignments = np.memmap(self.assign_file, dtype=np.int32, mode="r", shape=(meta["count"],))
+            order = np.argsort(assignments, kind="stable")
+            boundaries = np.searchsorted(assignments[order], np.arange(meta["nlist"] + 1))
+            self.inverted_lists = [order[boundaries[i]:boundaries[i + 1]] for i in range(meta["nlist"])]
+    
+    @staticmethod
+    def _train_ivf(vectors: "np.ndarray", nlist: int, iterations: int = 10) -> Tuple["np.ndarray", "np.ndarray"]:
+        """球面k-means训练粗量化器，返回聚类中心和每个向量所属的分区"""
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        assignments = np.zeros(len(vectors), dtype=np.int32)
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+            for cluster in range(nlist):
+                members = vectors[assignments == cluster]
+                if len(members):
+                    center = members.sum(axis=0)
+                    norm = np.linalg.norm(center)
+                    if norm:
+                        centroids[cluster] = center / norm
+        return centroids.astype(np.float32), assignments
+    
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """返回与查询最相似的top_k个(条目序号, 余弦相似度)"""
+        if self.vectors is None or top_k <= 0:
+            return []
+        
+        query_vector = self.embedder([query])[0].astype(np.float32)
+        if self.centroids is not None:
+            probes = np.argsort(self.centroids @ query_vector)[::-1][:self.nprobe]
+            candidates = np.concatenate([self.inverted_lists[i] for i in probes])
+            if not len(candidates):
+                return []
+            scores = self.vectors[candidates] @ query_vector
+        else:
+            candidates = None
+            scores = self.vectors @ query_vector
+        
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        doc_ids = candidates[top] if candidates is not None else top
+        return [(int(doc_id), float(scores[i])) for doc_id, i in zip(doc_ids, top)]
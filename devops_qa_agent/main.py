@@ -4,7 +4,6 @@
 """
 
 import uvicorn
-from .api.server import app
 from .config import config
 
 def main():
@@ -15,7 +14,7 @@ def main():
     print(f"   - OpenAI模型: {config.OPENAI_MODEL}")
     print(f"   - 构建日志API: {config.BUILD_LOG_API_URL}")
     print(f"   - 知识库路径: {config.KNOWLEDGE_BASE_PATH}")
-    print(f"   - 流式输出延迟: {config.STREAM_DELAY}秒")
+    print(f"   - 工作进程数: {config.WORKERS}")
     print("\n✨ 系统功能:")
     print("   ✅ 多轮对话支持")
     print("   ✅ 意图识别")
@@ -25,6 +24,19 @@ def main():
     print("   ✅ WebSocket实时通信")
     print("\n🌐 访问 http://localhost:8000 开始使用")
     
+    if config.WORKERS > 1:
+        # 多个工作进程时以导入字符串传入应用，由每个进程各自导入；会话和缓存经共享的SQLite文件同步
+        # 主进程只管理工作进程，不导入应用，避免在主进程中也创建ChatAgent、加载知识库
+        uvicorn.run(
+            "devops_qa_agent.api.server:app",
+            host=config.HOST,
+            port=config.PORT,
+            workers=config.WORKERS,
+            log_level="info"
+        )
+        return
+    
+    from .api.server import app
     uvicorn.run(
         app,
         host=config.HOST,
@@ -1,8 +1,11 @@
-from typing import List, Dict, Any, Optional
+from typing import Annotated, List, Dict, Any, Optional, Union
 from pydantic import BaseModel
+from dataclasses import dataclass
 from enum import Enum
-import uuid
+from itertools import count
 from datetime import datetime
+import os
+import time
 
 class IntentType(str, Enum):
     BUILD = "build"
@@ -13,31 +16,81 @@ class MessageRole(str, Enum):
     ASSISTANT = "assistant"
     SYSTEM = "system"
 
-class Message(BaseModel):
-    id: str = None
+def _id_prefix() -> str:
+    # 进程启动时间（毫秒）加进程号，同一主机上的多个工作进程之间不会重复
+    return f"{int(time.time() * 1000):x}{os.getpid():x}-"
+
+_message_id_prefix = _id_prefix()
+_message_ids = count(1)
+# 上一条消息的创建时间，保证同一进程中连续创建的消息在微秒精度下也能区分先后
+_last_created = 0.0
+
+def _reset_message_ids():
+    global _message_id_prefix, _message_ids
+    _message_id_prefix = _id_prefix()
+    _message_ids = count(1)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_message_ids)
+
+@dataclass(init=False)
+class Message:
+    """对话消息
+
+    每轮都会创建、在检查点中保存和复制，使用带__slots__的dataclass而不是pydantic模型：
+    ID为进程前缀加递增序号，创建时间保存为time.time()的浮点数，访问timestamp时才转换为datetime。
+    同一进程中的创建时间至少比上一条消息晚1微秒，转换为微秒精度的datetime后仍能区分先后。
+    dataclass的slots参数需要Python 3.10，这里手写__slots__和__init__。
+    """
+    __slots__ = ("role", "content", "id", "created")
+    
     role: MessageRole
     content: str
-    timestamp: datetime = None
+    id: str
+    created: float
+    
+    def __init__(self, role: MessageRole, content: str, id: str = None, created: float = None):
+        global _last_created
+        self.role = role if role.__class__ is MessageRole else MessageRole(role)
+        self.content = content
+        self.id = f"{_message_id_prefix}{next(_message_ids):x}" if id is None else id
+        if created is None:
+            created = _last_created = max(time.time(), _last_created + 1e-6)
+        self.created = created
     
-    def __init__(self, **data):
-        super().__init__(**data)
-        if self.id is None:
-            self.id = str(uuid.uuid4())
-        if self.timestamp is None:
-            self.timestamp = datetime.now()
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.created)
+    
+    @classmethod
+    def from_record(cls, id: str, role: str, content: str, timestamp: Union[str, datetime, None] = None) -> "Message":
+        """由会话存储中的记录恢复消息，timestamp为ISO格式的字符串或datetime"""
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        return cls(role, content, id, timestamp.timestamp() if timestamp is not None else None)
+
+def append_messages(left: List[Message], right: Union[Message, List[Message]]) -> List[Message]:
+    """消息通道的归并函数：节点只返回本步新增的消息，追加到已有消息之后"""
+    if not right:
+        return left
+    if not isinstance(right, list):
+        right = [right]
+    return left + right
 
 class ConversationState(BaseModel):
     session_id: str
-    messages: List[Message] = []
+    # 只追加：节点和每轮的输入只包含新增的消息
+    messages: Annotated[List[Message], append_messages] = []
     current_intent: Optional[IntentType] = None
-    build_log_url: Optional[str] = None
     build_errors: List[str] = []
     knowledge_base_results: List[Dict[str, Any]] = []
     waiting_for_build_log: bool = False
-    conversation_history: List[Dict[str, Any]] = []
     problem_type: Optional[str] = None
     cd_inst_id: Optional[str] = None
     problem_desc: Optional[str] = None
+    # 早期对话的滚动摘要，以及已并入摘要的最后一条消息的时间
+    history_summary: str = ""
+    history_summary_until: Optional[datetime] = None
     
     def add_message(self, role: MessageRole, content: str):
         message = Message(role=role, content=content)
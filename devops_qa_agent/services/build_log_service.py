@@ -1,37 +1,177 @@
 import aiohttp
 import asyncio
-from typing import List, Dict, Any
+import json
+import logging
+import os
+import random
+import time
+from typing import List, Dict, Any, AsyncIterator, Optional, Union
 from ..config import config
+from .cache import SingleFlight, TieredCache
+from .log_analyzer import LogAnalysis, LogAnalyzer
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# 可以重试的HTTP状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 流水线仍在执行时的状态，错误信息还可能变化
+RUNNING_STATUSES = {"pending", "queued", "running"}
+
 
 class BuildLogService:
-    def __init__(self):
+    """构建日志服务
+    
+    所有请求共用一个长连接的aiohttp会话，由应用的lifespan负责创建和关闭；
+    连接池按主机限制连接数，并用信号量限制同时发往后端的请求数。
+    只读查询失败时按带随机抖动的指数退避重试。
+    
+    BUILD_LOG_SOURCE=raw时不使用接口返回的错误关键字，而是下载原始日志在本地流式分析。
+    """
+    
+    def __init__(self, knowledge_base=None):
         self.api_url = config.BUILD_LOG_API_URL
+        self.source = config.BUILD_LOG_SOURCE
+        self.max_retries = config.BUILD_LOG_MAX_RETRIES
+        self.retry_backoff = config.BUILD_LOG_RETRY_BACKOFF
+        self.timeout = aiohttp.ClientTimeout(
+            total=config.BUILD_LOG_TOTAL_TIMEOUT,
+            connect=config.BUILD_LOG_CONNECT_TIMEOUT,
+            sock_read=config.BUILD_LOG_READ_TIMEOUT
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(config.BUILD_LOG_MAX_CONCURRENCY)
+        
+        # 请求统计：requests-发出的HTTP请求数，retries-重试次数，failures-最终失败的调用数
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "in_flight": 0}
+        
+        # 按实例ID缓存错误信息：已结束的实例结果不再变化，执行中的实例只短暂缓存；
+        # 配置了BUILD_LOG_CACHE_PATH时结果写入多个工作进程共用的磁盘层
+        self.cache = TieredCache(
+            config.BUILD_LOG_CACHE_PATH, config.BUILD_LOG_CACHE_SIZE, config.BUILD_LOG_CACHE_TTL,
+            decode=lambda data: tuple(json.loads(data.decode("utf-8")))
+        )
+        self.running_ttl = config.BUILD_LOG_RUNNING_TTL
+        # 同一实例的并发查询只调用一次后端
+        self.single_flight = SingleFlight()
+        
+        # 原始日志分析器，错误特征包含知识库中的构建错误关键字
+        self.log_analyzer = LogAnalyzer.from_knowledge_base(knowledge_base) if knowledge_base else LogAnalyzer()
+    
+    async def start(self):
+        """创建共享的HTTP会话"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.BUILD_LOG_MAX_CONNECTIONS,
+                limit_per_host=config.BUILD_LOG_MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=config.BUILD_LOG_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+    
+    async def close(self):
+        """关闭共享的HTTP会话"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # 没有经过lifespan启动时（如脚本或测试中直接使用）按需创建
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    async def _request_json(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        """发送请求并返回JSON，连接错误、超时和5xx/429响应按退避策略重试"""
+        session = await self._get_session()
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    self.stats["requests"] += 1
+                    self.stats["in_flight"] += 1
+                    try:
+                        async with session.request(method, url, **kwargs) as response:
+                            response.raise_for_status()
+                            return await response.json()
+                    finally:
+                        self.stats["in_flight"] -= 1
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+                retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRYABLE_STATUS
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                # 全抖动退避，避免大量请求同时重试
+                delay = random.uniform(0, self.retry_backoff * (2 ** attempt))
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning("构建日志API请求失败: %s，%.2f秒后第%d次重试", e, delay, attempt)
+                await asyncio.sleep(delay)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取请求统计和实例缓存统计"""
+        cache_stats = self.cache.get_stats()
+        return {
+            **self.stats,
+            "cache": {
+                "size": cache_stats["size"],
+                "hits": cache_stats["hits"],
+                "misses": cache_stats["misses"],
+                "coalesced": self.single_flight.coalesced,
+                "backend_calls": self.single_flight.calls
+            }
+        }
     
     async def query_build_errors(self, build_log_url: str) -> List[str]:
         """调用外部API查询构建日志中的错误关键字"""
+        start = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    "build_log_url": build_log_url
-                }
-                
-                async with session.post(
-                    self.api_url,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
-                    
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("errors", [])
-                    else:
-                        print(f"构建日志API调用失败: {response.status}")
-                        return []
+            payload = {
+                "build_log_url": build_log_url
+            }
+            # 该接口只做查询，可以安全重试
+            data = await self._request_json("POST", self.api_url, json=payload)
+            metrics.BUILD_LOG_LATENCY.labels("query", "ok").observe(time.perf_counter() - start)
+            return data.get("errors", [])
                         
         except Exception as e:
-            print(f"构建日志服务异常: {e}")
+            self.stats["failures"] += 1
+            metrics.BUILD_LOG_LATENCY.labels("query", "error").observe(time.perf_counter() - start)
+            logger.error("构建日志服务异常: %s", e)
             return []
     
+    async def analyze_log(self, source: Union[str, AsyncIterator[bytes]]) -> LogAnalysis:
+        """流式分析构建日志，source可以是URL、本地文件路径或异步字节迭代器"""
+        if isinstance(source, str):
+            if source.startswith(("http://", "https://")):
+                return await self.log_analyzer.analyze_stream(self._stream_url(source))
+            if os.path.exists(source):
+                return await self.log_analyzer.analyze_file(source)
+            raise FileNotFoundError(source)
+        return await self.log_analyzer.analyze_stream(source)
+    
+    async def _stream_url(self, url: str, meta: Dict[str, Any] = None) -> AsyncIterator[bytes]:
+        """按块下载日志，meta用于带回响应头中的构建状态"""
+        session = await self._get_session()
+        # 大日志下载时间不可预估，只限制连接和两次读取之间的间隔
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=config.BUILD_LOG_CONNECT_TIMEOUT,
+            sock_read=config.BUILD_LOG_READ_TIMEOUT
+        )
+        async with self._semaphore:
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            try:
+                async with session.get(url, timeout=timeout) as response:
+                    response.raise_for_status()
+                    if meta is not None:
+                        meta["status"] = response.headers.get("X-Build-Status", "")
+                    async for chunk in response.content.iter_chunked(config.BUILD_LOG_CHUNK_SIZE):
+                        yield chunk
+            finally:
+                self.stats["in_flight"] -= 1
+    
     async def mock_query_build_errors(self, build_log_url: str) -> List[str]:
         """模拟构建日志错误查询（用于测试）"""
         # 模拟API调用延迟
@@ -60,14 +200,58 @@ class BuildLogService:
             ]
     
     async def get_build_log_errors_by_inst_id(self, cd_inst_id: str) -> List[str]:
-        """根据流水线实例ID查询构建日志错误关键字"""
-        print(f"正在查询流水线实例 {cd_inst_id} 的构建日志错误...")
+        """根据流水线实例ID查询构建日志错误关键字
+        
+        先查缓存；未命中时同一实例的并发查询合并为一次后端调用。
+        查询失败时返回空列表，不写入缓存。
+        """
+        start = time.perf_counter()
+        cached_errors = await self.cache.get(cd_inst_id)
+        if cached_errors is not None:
+            metrics.BUILD_LOG_LATENCY.labels("errors_by_inst_id", "cache_hit").observe(time.perf_counter() - start)
+            return list(cached_errors)
+        
+        try:
+            errors = await self.single_flight.do(cd_inst_id, lambda: self._fetch_build_log_errors(cd_inst_id))
+            metrics.BUILD_LOG_LATENCY.labels("errors_by_inst_id", "ok").observe(time.perf_counter() - start)
+            return list(errors)
+        except asyncio.CancelledError:
+            # 同一实例的所有查询都取消后，合并的后端请求随之取消
+            metrics.BUILD_LOG_LATENCY.labels("errors_by_inst_id", "cancelled").observe(time.perf_counter() - start)
+            raise
+        except Exception as e:
+            self.stats["failures"] += 1
+            metrics.BUILD_LOG_LATENCY.labels("errors_by_inst_id", "error").observe(time.perf_counter() - start)
+            logger.error("构建日志API调用失败: %s", e, extra={"cd_inst_id": cd_inst_id})
+            return []
+    
+    async def _fetch_build_log_errors(self, cd_inst_id: str) -> List[str]:
+        """调用后端查询实例的错误信息并写入缓存
+        
+        接口返回 {"errors": [...], "status": "finished"}，status为执行中的状态时按短TTL缓存；
+        分析原始日志时状态取自响应头X-Build-Status。
+        """
+        logger.debug("查询流水线实例的构建日志错误", extra={"cd_inst_id": cd_inst_id})
+        
+        if not config.BUILD_LOG_MOCK:
+            url = f"{self.api_url}/build-log/{cd_inst_id}"
+            if self.source == "raw":
+                meta = {}
+                analysis = await self.log_analyzer.analyze_stream(self._stream_url(f"{url}/raw", meta))
+                errors = tuple(analysis.errors)
+                status = meta.get("status", "")
+            else:
+                data = await self._request_json("GET", url)
+                errors = tuple(data.get("errors", []))
+                status = data.get("status", "")
+            running = str(status).lower() in RUNNING_STATUSES
+            await self.cache.set(cd_inst_id, errors, ttl=self.running_ttl if running else None)
+            return errors
         
         # 模拟API调用延迟
         await asyncio.sleep(1)
         
         # 模拟API调用，返回假数据
-        # 在实际环境中，这里应该调用真实的API
         mock_errors = [
             "Build error: Module not found",
             "Compilation error: syntax error at line 45",
@@ -78,20 +262,12 @@ class BuildLogService:
         
         # 根据实例ID返回不同的错误（模拟）
         if cd_inst_id == "123456":
-            return mock_errors[:3]  # 返回前3个错误
+            errors = mock_errors[:3]  # 返回前3个错误
         elif cd_inst_id == "789012":
-            return mock_errors[2:4]  # 返回第3-4个错误
+            errors = mock_errors[2:4]  # 返回第3-4个错误
         else:
-            return mock_errors  # 返回所有错误
+            errors = mock_errors  # 返回所有错误
         
-        # 实际API调用示例：
-        # try:
-        #     async with aiohttp.ClientSession() as session:
-        #         async with session.get(f"{self.api_url}/build-log/{cd_inst_id}") as response:
-        #             if response.status == 200:
-        #                 data = await response.json()
-        #                 return data.get('errors', [])
-        #             else:
-        #                 return [f"API调用失败: HTTP {response.status}"]
-        # except Exception as e:
-        #     return [f"API调用异常: {str(e)}"]
+        errors = tuple(errors)
+        await self.cache.set(cd_inst_id, errors)
+        return errors
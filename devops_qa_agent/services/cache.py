@@ -0,0 +1,330 @@
+"""
+缓存工具
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}")
+NUMBER_PATTERN = re.compile(r"\d+")
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]|_")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# 只保留两侧都是英文字母或数字的空格，中文前后的空格不影响语义
+NON_ASCII_SPACE_PATTERN = re.compile(r"(?<![a-z0-9]) | (?![a-z0-9])")
+
+
+def normalize_question(text: str) -> str:
+    """将问题归一化为缓存键
+
+    统一全角半角和大小写，去掉实例ID、UUID和数字，
+    标点替换为空格后合并连续空白，并去掉中文前后的空格。
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = UUID_PATTERN.sub(" ", text)
+    text = NUMBER_PATTERN.sub(" ", text)
+    text = PUNCTUATION_PATTERN.sub(" ", text)
+    text = WHITESPACE_PATTERN.sub(" ", text).strip()
+    return NON_ASCII_SPACE_PATTERN.sub("", text)
+
+
+def normalize_text(text: str) -> str:
+    """只统一全角半角、大小写和空白，保留数字和标点
+
+    用于回答缓存：版本号、退出码不同的问题答案也不同，不能像意图缓存那样去掉。
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = WHITESPACE_PATTERN.sub(" ", text).strip()
+    return NON_ASCII_SPACE_PATTERN.sub("", text)
+
+
+class TTLCache:
+    """带过期时间的LRU缓存
+
+    超过最大条数（或设置了sizeof时超过最大字节数）时淘汰最久未使用的条目，
+    读取时发现过期的条目直接删除。
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, max_bytes: int = None,
+                 sizeof: Callable[[Any], int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # 键 -> (过期时间, 值, 字节数)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        
+        expires_at, value, _ = item
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        size = self.sizeof(value) if self.sizeof else 0
+        self._remove(key)
+        self._data[key] = (expires_at, value, size)
+        self.total_bytes += size
+        
+        while self._data and (
+            len(self._data) > self.maxsize
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+    
+    def _remove(self, key: Hashable):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.total_bytes -= item[2]
+    
+    def delete(self, key: Hashable):
+        self._remove(key)
+    
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] >= time.monotonic()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class _Call:
+    """正在进行的一次调用及等待它的调用方数量"""
+    
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并相同键的并发调用
+    
+    同一个键同时只执行一次调用，其余调用方等待同一个结果（包括异常）。
+    调用在独立的任务中执行，单个调用方被取消不影响其他调用方；
+    所有调用方都取消后才取消该任务。
+    """
+    
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+    
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(func()))
+            self._calls[key] = call
+            self.calls += 1
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+        
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+    
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+    
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class SQLiteKVStore:
+    """基于SQLite的键值存储，作为内存缓存的磁盘层
+
+    数据库使用WAL模式，过期时间使用墙上时钟，重启后仍然有效。
+    方法均为同步调用，在事件循环中使用时应放到线程池执行。
+    """
+    
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 多个工作进程共用同一个数据库文件时，写锁冲突等待而不是立即报错
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)")
+    
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """返回 (值, 过期时间)，过期时间为墙上时钟的时间戳"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM kv WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+    
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+    
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+    
+    def prune(self):
+        """删除过期条目，并在超过最大条数时删除最早过期的条目"""
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+            count = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM kv WHERE key IN (SELECT key FROM kv ORDER BY expires_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """将任意可JSON序列化的内容计算为稳定的缓存键"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """两级缓存：内存LRU/TTL层 + 可选的SQLite磁盘层
+
+    写入时同时写入磁盘层；内存未命中时查询磁盘层，命中后按条目剩余的有效期回填内存。
+    磁盘层文件可以被同一主机上的多个工作进程共用，一个进程写入的结果其他进程也能命中。
+    值经encode/decode与字节互转，非字符串的键按JSON计算哈希后作为磁盘层的键。
+    """
+    
+    def __init__(self, path: str = None, maxsize: int = 1024, ttl: float = 3600, max_bytes: int = None,
+                 sizeof: Callable[[Any], int] = None, disk_max_entries: int = 100000,
+                 encode: Callable[[Any], bytes] = None, decode: Callable[[bytes], Any] = None):
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize, ttl, max_bytes=max_bytes, sizeof=sizeof)
+        self.disk = SQLiteKVStore(path, disk_max_entries) if path else None
+        self.encode = encode or (lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        self.decode = decode or (lambda data: json.loads(data.decode("utf-8")))
+        self.disk_hits = 0
+        self._writes_since_prune = 0
+    
+    @staticmethod
+    def _disk_key(key: Hashable) -> str:
+        return key if isinstance(key, str) else make_cache_key(key)
+    
+    async def get(self, key: Hashable) -> Any:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(None, self.disk.get, self._disk_key(key))
+        if row is None:
+            return None
+        
+        self.disk_hits += 1
+        data, expires_at = row
+        value = self.decode(data)
+        # 沿用写入时的有效期（例如运行中的构建只缓存很短时间），不按默认TTL重新计时
+        self.memory.set(key, value, ttl=expires_at - time.time())
+        return value
+    
+    async def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, ttl=ttl)
+        if self.disk is None:
+            return
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.disk.set, self._disk_key(key), self.encode(value), ttl)
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 1000:
+            self._writes_since_prune = 0
+            await loop.run_in_executor(None, self.disk.prune)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.memory.get_stats()
+        stats["disk_hits"] = self.disk_hits
+        return stats
+
+
+class AnswerCache(TieredCache):
+    """回答缓存，内存层按条数和字节数限制大小，磁盘层使进程重启后仍可命中"""
+    
+    def __init__(self, path: str = None, maxsize: int = 512, max_bytes: int = 16 * 1024 * 1024,
+                 ttl: float = 1800, disk_max_entries: int = 100000):
+        super().__init__(
+            path, maxsize, ttl, max_bytes=max_bytes,
+            sizeof=lambda value: len(value.encode("utf-8")),
+            disk_max_entries=disk_max_entries,
+            encode=lambda value: value.encode("utf-8"),
+            decode=lambda data: data.decode("utf-8")
+        )
+    
+    @staticmethod
+    def make_key(question: str, entry_ids: Iterable[str], build_errors: Iterable[str], history: str = "") -> str:
+        """由归一化问题、检索到的知识条目ID、构建错误和提示词中的对话历史计算缓存键
+
+        追问（如“那第二步呢？”）的含义取决于之前的对话，历史不同时不能复用回答。
+        """
+        return make_cache_key(normalize_text(question), sorted(entry_ids), sorted(build_errors), history)
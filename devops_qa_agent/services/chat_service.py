@@ -1,53 +1,184 @@
-from typing import Dict, Any, List
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from ..models import ConversationState, IntentType, MessageRole
+from typing import Dict, Any, List, Optional, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, START, END
+from langgraph.config import get_stream_writer
+from ..models import ConversationState, IntentType, Message, MessageRole
 from .intent_service import IntentClassifier
 from .build_log_service import BuildLogService
 from ..knowledge.base import KnowledgeBase
 from .llm_service import LLMService
+from .llm_clients import LLMClientRegistry
+from .checkpoint import BoundedMemorySaver
+from .session_store import SessionStore
+from .cache import TTLCache
+from . import logs, metrics
+from ..config import config as app_config
+from ..api.streaming import aclosing
+import logging
 import uuid
+import time
 import asyncio
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 持久化到会话存储的标量字段
+PERSISTED_STATE_FIELDS = (
+    "current_intent", "build_errors", "waiting_for_build_log",
+    "problem_type", "cd_inst_id", "problem_desc",
+    "history_summary", "history_summary_until"
+)
+
+
+class StreamStats:
+    """单次流式处理的耗时统计"""
+    
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.first_token_time = None
+        self.end_time = None
+        self.token_count = 0
+    
+    def record_token(self):
+        """记录收到一个LLM token"""
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.token_count += 1
+    
+    def finish(self):
+        """标记流式处理结束"""
+        self.end_time = time.perf_counter()
+    
+    @property
+    def ttft_ms(self) -> float:
+        """首token耗时（毫秒），尚未收到token时为None"""
+        if self.first_token_time is None:
+            return None
+        return round((self.first_token_time - self.start_time) * 1000, 1)
+    
+    @property
+    def total_ms(self) -> float:
+        """总耗时（毫秒）"""
+        end_time = self.end_time or time.perf_counter()
+        return round((end_time - self.start_time) * 1000, 1)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ttft_ms": self.ttft_ms,
+            "total_ms": self.total_ms,
+            "tokens": self.token_count
+        }
+
 
 class ChatAgent:
     def __init__(self):
-        self.intent_classifier = IntentClassifier()
-        self.build_log_service = BuildLogService()
         self.knowledge_base = KnowledgeBase()
-        self.llm_service = LLMService()
+        # 意图识别和回答生成共用一个LLM连接池
+        self.llm_clients = LLMClientRegistry.from_config()
+        self.intent_classifier = IntentClassifier(self.knowledge_base, self.llm_clients)
+        self.build_log_service = BuildLogService(self.knowledge_base)
+        self.llm_service = LLMService(self.llm_clients)
+        
+        # 提前查询的构建日志：used-被采用，cancelled-查询中途取消，discarded-查询完成但被丢弃
+        self.speculation_stats = {"used": 0, "cancelled": 0, "discarded": 0}
         
         # 创建状态图
         self.graph = self.create_graph()
         
-        # 创建内存保存器
-        self.memory = MemorySaver()
+        # 创建内存保存器，限制会话数、占用内存和空闲时间
+        self.memory = BoundedMemorySaver(
+            max_sessions=app_config.CHECKPOINT_MAX_SESSIONS,
+            max_bytes=app_config.CHECKPOINT_MAX_BYTES,
+            session_ttl=app_config.CHECKPOINT_SESSION_TTL,
+            max_checkpoints_per_thread=app_config.CHECKPOINT_KEEP_PER_THREAD
+        )
+        
+        # 持久化会话存储，检查点被淘汰或服务重启后从这里恢复历史消息
+        self.session_store = SessionStore(app_config.SESSION_DB_PATH) if app_config.SESSION_STORE_ENABLED else None
+        
+        # 多进程模式：同一会话的请求可能落在任意工作进程，本地检查点只作为会话存储的缓存。
+        # 记录每个会话的检查点对应会话存储中的第几条消息，不一致时说明其他进程处理过该会话
+        self.shared_state = app_config.SHARED_STATE_ENABLED and self.session_store is not None
+        if app_config.SHARED_STATE_ENABLED and self.session_store is None:
+            logger.warning("多进程模式需要开启会话存储，会话历史只保存在本进程")
+        self._store_versions = TTLCache(app_config.CHECKPOINT_MAX_SESSIONS, app_config.CHECKPOINT_SESSION_TTL)
         
         # 编译图
         self.app = self.graph.compile(checkpointer=self.memory)
+        
+        # 缓存和检查点的统计在输出指标时读取
+        self.bind_metrics()
+    
+    def bind_metrics(self):
+        """将缓存命中、检查点会话数等已有统计接入指标输出"""
+        def caches():
+            result = {
+                "intent": self.intent_classifier.cache.get_stats(),
+                "build_log": self.build_log_service.cache.get_stats()
+            }
+            if self.llm_service.answer_cache is not None:
+                result["answer"] = self.llm_service.answer_cache.get_stats()
+            return result
+        
+        metrics.CACHE_HITS.set_function(lambda: {(name,): stats["hits"] for name, stats in caches().items()})
+        metrics.CACHE_MISSES.set_function(lambda: {(name,): stats["misses"] for name, stats in caches().items()})
+        metrics.CACHE_HIT_RATIO.set_function(lambda: {(name,): stats["hit_ratio"] for name, stats in caches().items()})
+        metrics.CHECKPOINT_SESSIONS.set_function(lambda: {(): self.memory.session_count})
+        metrics.CHECKPOINT_BYTES.set_function(lambda: {(): self.memory.total_bytes})
+        metrics.BUILD_LOG_IN_FLIGHT.set_function(lambda: {(): self.build_log_service.stats["in_flight"]})
+        metrics.BUILD_LOG_BACKEND_CALLS.set_function(lambda: {(): self.build_log_service.single_flight.calls})
+        metrics.BUILD_LOG_COALESCED.set_function(lambda: {(): self.build_log_service.single_flight.coalesced})
+        metrics.INTENT_DECISIONS.set_function(
+            lambda: {(tier,): count for tier, count in self.intent_classifier.tier_counts.items()}
+        )
+        metrics.BUILD_LOG_SPECULATIONS.set_function(
+            lambda: {(outcome,): count for outcome, count in self.speculation_stats.items()}
+        )
+        
+        def coalesced():
+            result = {}
+            for caller, coalescer in (("LLMService", self.llm_service.coalescer),
+                                      ("IntentClassifier", self.intent_classifier.coalescer)):
+                stats = coalescer.get_stats()
+                result[(caller, "invoke")] = stats["invoke_coalesced"]
+                result[(caller, "stream")] = stats["stream_coalesced"]
+            return result
+        
+        metrics.LLM_COALESCED.set_function(coalesced)
+        
+        def llm_pool():
+            stats = self.llm_clients.get_stats()
+            busy = stats["connections"] - stats["idle_connections"]
+            return {("active",): busy, ("idle",): stats["idle_connections"]}
+        
+        metrics.LLM_POOL_CONNECTIONS.set_function(llm_pool)
+        metrics.LLM_IN_FLIGHT.set_function(lambda: {(): self.llm_clients.get_stats()["in_flight"]})
     
     def create_graph(self) -> StateGraph:
-        """创建LangGraph状态图"""
+        """创建LangGraph状态图
+        
+        意图识别、构建日志查询和知识库初查并行执行，在join_context节点汇合后再生成回答。
+        构建日志查询只在带有流水线实例ID时启动，意图不是构建问题时取消查询并丢弃结果。
+        """
         workflow = StateGraph(ConversationState)
         
-        # 添加节点
-        workflow.add_node("intent_classification", self.intent_classification_node)
-        workflow.add_node("request_build_log", self.request_build_log_node)
+        # 添加节点，每个节点的耗时记录到节点延迟直方图，节点内的日志带上节点名
+        def add_node(name, node):
+            workflow.add_node(name, metrics.timed(metrics.NODE_LATENCY, name)(logs.with_node(name)(node)))
+        
+        add_node("intent_classification", self.intent_classification_node)
+        add_node("request_build_log", self.request_build_log_node)
         #workflow.add_node("query_build_errors", self.query_build_errors_node)
         #workflow.add_node("wait_for_inst_id", self.wait_for_inst_id_node)
-        workflow.add_node("search_knowledge_base", self.search_knowledge_base_node)
-        workflow.add_node("generate_response", self.generate_response_node)
-        
-        # 设置入口点
-        workflow.set_entry_point("intent_classification")
+        add_node("search_knowledge_base", self.search_knowledge_base_node)
+        add_node("join_context", self.join_context_node)
+        add_node("generate_response", self.generate_response_node)
         
-        # 添加条件边
+        # 入口并行分发
         workflow.add_conditional_edges(
-            "intent_classification",
-            self.route_after_intent,
-            {
-                "build": "request_build_log",
-                "general": "search_knowledge_base"
-            }
+            START,
+            self.route_start,
+            ["intent_classification", "request_build_log", "search_knowledge_base"]
         )
         
         # workflow.add_conditional_edges(
@@ -68,80 +199,127 @@ class ChatAgent:
         #     }
         # )
         
-        # 添加普通边
-        workflow.add_edge("request_build_log","search_knowledge_base")
+        # 并行分支在同一步内完成，join_context在下一步只执行一次
+        workflow.add_edge("intent_classification", "join_context")
+        workflow.add_edge("request_build_log", "join_context")
+        workflow.add_edge("search_knowledge_base", "join_context")
         #workflow.add_edge("query_build_errors", "search_knowledge_base")
-        workflow.add_edge("search_knowledge_base", "generate_response")
+        workflow.add_edge("join_context", "generate_response")
         workflow.add_edge("generate_response", END)
         
         return workflow
     
-    async def intent_classification_node(self, state: ConversationState) -> ConversationState:
+    def route_start(self, state: ConversationState) -> List[str]:
+        """入口路由：带有流水线实例ID时提前查询构建日志"""
+        branches = ["intent_classification", "search_knowledge_base"]
+        if state.cd_inst_id:
+            branches.append("request_build_log")
+        return branches
+    
+    @staticmethod
+    def _run_config(session_id: str) -> Dict[str, Any]:
+        """创建单次运行的配置，intent_future用于把意图识别结果通知给并行分支"""
+        return {
+            "configurable": {
+                "thread_id": session_id,
+                "intent_future": asyncio.get_running_loop().create_future()
+            }
+        }
+    
+    @staticmethod
+    def _publish_intent(config: RunnableConfig, intent: Optional[IntentType]):
+        future = (config or {}).get("configurable", {}).get("intent_future")
+        if future is not None and not future.done():
+            future.set_result(intent)
+    
+    async def intent_classification_node(self, state: ConversationState, config: RunnableConfig) -> Dict[str, Any]:
         """意图识别节点"""
-        print("正在识别用户意图...")
-        
-        # 如果提供了问题类型，直接使用
-        if state.problem_type:
+        intent = state.current_intent
+        try:
+            # 如果提供了问题类型，直接使用
             if state.problem_type == "构建":
-                state.current_intent = IntentType.BUILD
-                print(f"根据问题类型识别到意图: {state.current_intent.value}")
-                return state
-        
-        # 否则从消息内容识别意图
-        if not state.messages:
-            return state
-        
-        user_message = state.messages[-1].content
-        intent = await self.intent_classifier.classify_intent(user_message)
+                intent = IntentType.BUILD
+                logger.info("根据问题类型识别到意图", extra={"intent": intent.value})
+            # 否则从消息内容识别意图
+            elif state.messages:
+                user_message = state.messages[-1].content
+                intent = await self.intent_classifier.classify_intent(user_message, state.cd_inst_id)
+                logger.info("识别到意图", extra={"intent": intent.value})
+        finally:
+            self._publish_intent(config, intent)
+        
+        return {"current_intent": intent}
+    
+    async def request_build_log_node(self, state: ConversationState, config: RunnableConfig) -> Dict[str, Any]:
+        """请求构建日志节点
         
-        state.current_intent = intent
-        print(f"识别到意图: {intent.value}")
+        与意图识别并行执行；意图识别先完成且不是构建问题时取消查询，结果直接丢弃。
+        """
+        logger.debug("提前查询构建日志", extra={"cd_inst_id": state.cd_inst_id})
+        fetch = asyncio.create_task(self.build_log_service.get_build_log_errors_by_inst_id(state.cd_inst_id))
+        intent_future = (config or {}).get("configurable", {}).get("intent_future")
         
-        return state
+        try:
+            if intent_future is not None:
+                await asyncio.wait({fetch, intent_future}, return_when=asyncio.FIRST_COMPLETED)
+                if intent_future.done() and intent_future.result() != IntentType.BUILD:
+                    logger.info("意图不是构建问题，取消构建日志查询")
+                    self.speculation_stats["cancelled"] += 1
+                    return {}
+            
+            build_errors = await fetch
+            # 日志先返回时等待意图识别结果，再决定是否采用
+            if intent_future is not None and await intent_future != IntentType.BUILD:
+                self.speculation_stats["discarded"] += 1
+                return {}
+        finally:
+            if not fetch.done():
+                fetch.cancel()
+        
+        self.speculation_stats["used"] += 1
+        logger.info("查询到构建日志错误关键字", extra={"error_count": len(build_errors)})
+        logs.log_payload(logger, "构建日志错误关键字", build_errors)
+        return {"build_errors": build_errors}
     
-    async def request_build_log_node(self, state: ConversationState) -> ConversationState:
-        """请求构建日志节点"""
-        print("正在检查构建日志信息...")
-        
-        # 检查是否提供了流水线实例ID
-        if state.cd_inst_id:
-            print(f"检测到流水线实例ID: {state.cd_inst_id}")
-            build_errors = await self.build_log_service.get_build_log_errors_by_inst_id(state.cd_inst_id)
-            state.build_errors = build_errors
-            print(f"查询到构建日志错误关键字: {build_errors}")
-            return state
+    async def join_context_node(self, state: ConversationState) -> Dict[str, Any]:
+        """汇合节点：根据意图整理并行分支的结果"""
+        if state.current_intent != IntentType.BUILD:
+            return {}
         
-        # 如果没有提供实例ID，设置等待状态
-        print("未检测到流水线实例ID，设置等待状态...")
-        state.waiting_for_build_log = True
+        # 构建问题但没有提供实例ID，设置等待状态
+        if not state.cd_inst_id:
+            logger.info("未检测到流水线实例ID，设置等待状态")
+            return {"waiting_for_build_log": True}
         
-        return state
+        # 知识库初查只用了问题本身，有构建错误时带上错误关键字重新检索
+        if state.build_errors:
+            return {"knowledge_base_results": self._search_knowledge(state)}
+        return {}
     
-    async def query_build_errors_node(self, state: ConversationState) -> ConversationState:
+    async def query_build_errors_node(self, state: ConversationState) -> Dict[str, Any]:
         """查询构建错误节点"""
-        print("正在查询构建日志中的错误关键字...")
+        logger.debug("查询构建日志中的错误关键字")
         
         # 如果已经有构建错误信息，直接返回
         if state.build_errors:
-            print(f"已有构建错误信息: {state.build_errors}")
-            return state
+            logger.debug("已有构建错误信息", extra={"error_count": len(state.build_errors)})
+            return {}
         
         # 如果没有实例ID，无法查询
         if not state.cd_inst_id:
-            print("没有实例ID，无法查询构建错误")
-            return state
+            logger.debug("没有实例ID，无法查询构建错误")
+            return {}
         
         # 查询构建日志错误
         build_errors = await self.build_log_service.get_build_log_errors_by_inst_id(state.cd_inst_id)
-        state.build_errors = build_errors
         
-        print(f"查询到错误关键字: {build_errors}")
+        logger.info("查询到构建日志错误关键字", extra={"error_count": len(build_errors)})
         
-        return state
+        return {"build_errors": build_errors}
     
-    async def wait_for_inst_id_node(self, state: ConversationState) -> ConversationState:
+    async def wait_for_inst_id_node(self, state: ConversationState) -> Dict[str, Any]:
         """等待用户提供实例ID节点"""
-        print("正在等待用户提供流水线实例ID...")
+        logger.debug("等待用户提供流水线实例ID")
         
         # 检查用户最新消息中是否包含实例ID
         if state.messages:
@@ -155,23 +333,24 @@ class ChatAgent:
             
             if matches:
                 # 假设第一个匹配的数字就是实例ID
-                state.cd_inst_id = matches[0]
-                print(f"从用户消息中提取到实例ID: {state.cd_inst_id}")
+                cd_inst_id = matches[0]
+                logger.info("从用户消息中提取到实例ID", extra={"cd_inst_id": cd_inst_id})
                 
                 # 添加确认消息
-                confirm_message = f"已获取到流水线实例ID: {state.cd_inst_id}，正在查询构建日志错误信息..."
-                state.add_message(MessageRole.ASSISTANT, confirm_message)
+                confirm_message = f"已获取到流水线实例ID: {cd_inst_id}，正在查询构建日志错误信息..."
+                return {
+                    "cd_inst_id": cd_inst_id,
+                    "messages": [Message(role=MessageRole.ASSISTANT, content=confirm_message)]
+                }
             else:
                 # 继续请求实例ID
                 request_message = await self.llm_service.generate_build_log_request()
-                state.add_message(MessageRole.ASSISTANT, request_message)
+                return {"messages": [Message(role=MessageRole.ASSISTANT, content=request_message)]}
         
-        return state
+        return {}
     
-    async def search_knowledge_base_node(self, state: ConversationState) -> ConversationState:
-        """搜索知识库节点"""
-        print("正在查询知识库...")
-        
+    def _search_knowledge(self, state: ConversationState) -> List[Dict[str, Any]]:
+        """按问题（构建问题再加上构建错误关键字）检索知识库"""
         # 确定搜索关键词
         search_keywords = []
         
@@ -187,29 +366,37 @@ class ChatAgent:
         
         # 组合搜索关键词
         combined_query = " ".join(search_keywords)
-        print(f"知识库搜索关键词: {combined_query}")
+        logs.log_payload(logger, "知识库搜索关键词", combined_query)
         
         try:
-            # 搜索知识库
-            results = self.knowledge_base.search_knowledge(combined_query)
+            # 搜索知识库：bm25模式按相关度返回top-k，keyword模式按关键字匹配
+            if app_config.KNOWLEDGE_SEARCH_MODE == "bm25":
+                results = self.knowledge_base.search_ranked(combined_query, app_config.KNOWLEDGE_TOP_K)
+            else:
+                results = self.knowledge_base.search_knowledge(combined_query)
             
-            # 确保knowledge_base_results属性存在
-            if not hasattr(state, 'knowledge_base_results'):
-                state.knowledge_base_results = []
+            # 关键字没有命中时，使用语义检索兜底
+            if not results:
+                results = self.knowledge_base.search_semantic(combined_query, app_config.KNOWLEDGE_TOP_K)
             
-            state.knowledge_base_results = results
-            print(f"知识库搜索结果数量: {len(results)}")
+            logger.debug("知识库检索完成", extra={"result_count": len(results)})
+            return results
             
         except Exception as e:
-            print(f"知识库搜索错误: {e}")
-            state.knowledge_base_results = []
-        
-        return state
+            logger.error("知识库搜索错误: %s", e, exc_info=True)
+            return []
     
-    async def generate_response_node(self, state: ConversationState) -> ConversationState:
+    async def search_knowledge_base_node(self, state: ConversationState) -> Dict[str, Any]:
+        """搜索知识库节点
+        
+        与意图识别并行执行，此时还不知道意图，只按问题本身检索；
+        需要结合构建错误时由join_context重新检索。
+        """
+        state = state.model_copy(update={"current_intent": None})
+        return {"knowledge_base_results": self._search_knowledge(state)}
+    
+    async def generate_response_node(self, state: ConversationState) -> Dict[str, Any]:
         """生成回答节点"""
-        print("正在生成回答...")
-        
         # 确定用户问题
         user_question = ""
         if state.problem_desc:
@@ -217,39 +404,26 @@ class ChatAgent:
         elif state.messages:
             user_question = state.messages[-1].content
         
-        # 构建上下文信息
-        context_info = []
-        
-        # 添加问题描述
-        if state.problem_desc:
-            context_info.append(f"用户问题描述: {state.problem_desc}")
-        
-        # 如果是构建类型的问题，添加构建错误信息
-        if state.current_intent == IntentType.BUILD and state.build_errors:
-            context_info.append(f"构建日志错误关键字: {', '.join(state.build_errors)}")
-        
-        # 添加知识库搜索结果
-        if state.knowledge_base_results:
-            context_info.append(f"知识库相关内容: {state.knowledge_base_results}")
-        
-        # 生成回答
-        response = await self.llm_service.generate_response(state, user_question, context_info)
-        
-        # 打印生成的回答内容
-        print(f"生成的回答内容: {response}")
-        print(f"回答长度: {len(response) if response else 0} 字符")
-        
-        state.add_message(MessageRole.ASSISTANT, response)
-        print("回答生成完成")
-        
-        return state
-    
-    def route_after_intent(self, state: ConversationState) -> str:
-        """意图识别后的路由"""
-        if state.current_intent == IntentType.BUILD:
-            return "build"
-        else:
-            return "general"
+        # 超出最近窗口的历史并入滚动摘要，随会话状态一起保存
+        self.llm_service.prompt_builder.update_summary(state)
+        
+        # 流式生成回答，每个token通过图的custom流实时推送给调用方
+        writer = get_stream_writer()
+        response_parts = []
+        async for token in self.llm_service.generate_streaming_response(state, user_question):
+            response_parts.append(token)
+            writer({"type": "token", "content": token})
+        response = "".join(response_parts)
+        
+        logs.log_payload(logger, "生成的回答", response)
+        logger.info("回答生成完成", extra={"answer_chars": len(response)})
+        
+        # 只返回新增的回答和摘要字段，消息通道追加到已有历史之后
+        return {
+            "messages": [Message(role=MessageRole.ASSISTANT, content=response)],
+            "history_summary": state.history_summary,
+            "history_summary_until": state.history_summary_until
+        }
     
     def route_after_build_log_request(self, state: ConversationState) -> str:
         """构建日志请求后的路由"""
@@ -276,162 +450,279 @@ class ChatAgent:
             # 继续等待
             return "still_waiting"
     
-
     
-    async def process_message(self, message: str, session_id: str = None, 
-                            problem_type: str = None, cd_inst_id: str = None, 
-                            problem_desc: str = None) -> ConversationState:
-        """处理用户消息"""
-        if not session_id:
-            session_id = str(uuid.uuid4())
-        
-        # 使用完整的LangGraph工作流处理
-        config = {"configurable": {"thread_id": session_id}}
+    
+    async def _load_history(self, session_id: str) -> Optional[ConversationState]:
+        """判断本地检查点能否直接使用
         
-        # 尝试从检查点恢复历史状态
-        state = None
+        能用时返回None，本轮只输入新增的用户消息和本轮设置的字段，历史由检查点中的消息通道衔接；
+        否则删除本地检查点，返回从会话存储恢复的状态，都没有时返回新状态。
+        多进程模式下会话存储中的消息数与检查点记录的不一致时，说明其他进程处理过该会话，本地检查点已过期。
+        """
         try:
-            # 获取检查点中的历史状态
-            checkpoint = await self.memory.aget_tuple(config)
-            if checkpoint and checkpoint.checkpoint:
-                # 如果有历史状态，从中恢复
-                historical_state = checkpoint.checkpoint.get('channel_values', {})
-                if historical_state:
-                    # 从历史状态创建ConversationState对象
-                    state = ConversationState(**historical_state)
-                    print(f"从检查点恢复状态，包含 {len(state.messages)} 条历史消息")
+            if self.shared_state:
+                session = await self._read_session(session_id)
+                if session is None:
+                    self._store_versions.delete(session_id)
+                elif self._store_versions.get(session_id) == session["message_count"] and self.memory.has_thread(session_id):
+                    return None
                 else:
-                    # 没有历史状态，创建新的
-                    state = ConversationState(session_id=session_id)
-                    print("创建新的对话状态")
-            else:
-                # 没有检查点，创建新的状态
-                state = ConversationState(session_id=session_id)
-                print("创建新的对话状态")
+                    await self.memory.adelete_thread(session_id)
+                    state = await self._restore_from_store(session_id, session)
+                    logger.info("本地检查点不是最新，从会话存储恢复状态", extra={"message_count": len(state.messages)})
+                    return state
+            elif self.memory.has_thread(session_id):
+                logger.debug("使用检查点中的会话状态")
+                return None
+            elif self.session_store:
+                # 检查点已被淘汰或服务重启过，从会话存储中恢复最近的消息
+                state = await self._restore_from_store(session_id)
+                if state:
+                    logger.info("从会话存储恢复状态", extra={"message_count": len(state.messages)})
+                    return state
         except Exception as e:
-            print(f"恢复状态失败: {e}，创建新的状态")
-            state = ConversationState(session_id=session_id)
+            logger.warning("恢复状态失败: %s，创建新的状态", e)
+        
+        logger.debug("创建新的对话状态")
+        # 新状态的消息不能追加到残留的检查点之后
+        await self.memory.adelete_thread(session_id)
+        return ConversationState(session_id=session_id)
+    
+    async def _read_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """提交本进程排队中的写入后读取会话存储中的会话信息"""
+        def read():
+            self.session_store.flush()
+            return self.session_store.get_session(session_id)
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, read)
+    
+    async def _restore_from_store(self, session_id: str, session: Dict[str, Any] = None) -> ConversationState:
+        """从会话存储恢复会话状态，session为已读取的会话信息"""
+        if session is None:
+            session = await self._read_session(session_id)
+        if not session:
+            return None
+        
+        loop = asyncio.get_running_loop()
+        rows, _ = await loop.run_in_executor(
+            None, self.session_store.get_messages, session_id, None, app_config.SESSION_RESTORE_MESSAGES
+        )
+        messages = [Message.from_record(row["id"], row["role"], row["content"], row["timestamp"]) for row in rows]
+        fields = {key: value for key, value in session["state"].items() if key in PERSISTED_STATE_FIELDS}
+        self._store_versions.set(session_id, session["message_count"])
+        return ConversationState(session_id=session_id, messages=messages, **fields)
+    
+    async def _sync_turn(self, session_id: str, appended: int):
+        """多进程模式下等待本轮写入提交，并记录检查点对应的会话存储消息数
+        
+        提交后的消息数与加载时的消息数加本轮新增的条数不一致时，说明其他进程同时写入了该会话，
+        不记录版本，下次请求从会话存储重新加载。
+        """
+        expected = self._store_versions.get(session_id)
+        session = await self._read_session(session_id)
+        if expected is not None and session is not None and session["message_count"] == expected + appended:
+            self._store_versions.set(session_id, session["message_count"])
+        else:
+            self._store_versions.delete(session_id)
+    
+    def _persist_turn(self, session_id: str, messages: List[Any], values: Dict[str, Any]) -> int:
+        """将本轮新增的消息追加写入会话存储（后台批量提交），返回写入的消息条数"""
+        if not self.session_store or not messages:
+            return 0
+        
+        messages = [msg if isinstance(msg, Message) else Message.from_record(**msg) for msg in messages]
+        state_fields = {}
+        for key in PERSISTED_STATE_FIELDS:
+            value = values.get(key)
+            if isinstance(value, IntentType):
+                value = value.value
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            state_fields[key] = value
+        self.session_store.append_messages(session_id, messages, state_fields)
+        return len(messages)
+    
+    async def _turn_input(self, session_id: str, message: str, problem_type: str = None,
+                          cd_inst_id: str = None, problem_desc: str = None) -> Tuple[Message, Dict[str, Any]]:
+        """构造本轮图的输入：当前用户消息和本轮设置的字段，需要恢复时再加上恢复的状态
         
-        # 添加当前用户消息
-        state.add_message(MessageRole.USER, message)
-        print(f"添加用户消息后，总消息数: {len(state.messages)}")
+        输入中没有的字段保留检查点中的值。返回用户消息和输入。
+        """
+        user_message = Message(role=MessageRole.USER, content=message)
+        turn = {"session_id": session_id}
         
         # 设置新的字段
         if problem_type:
-            state.problem_type = problem_type
+            turn["problem_type"] = problem_type
         if cd_inst_id:
-            state.cd_inst_id = cd_inst_id
+            turn["cd_inst_id"] = cd_inst_id
         if problem_desc:
-            state.problem_desc = problem_desc
+            turn["problem_desc"] = problem_desc
         
-        # 运行完整的图处理流程
-        result = await self.app.ainvoke(state, config)
+        history = await self._load_history(session_id)
+        if history is None:
+            turn["messages"] = [user_message]
+            return user_message, turn
         
-        return result
+        # 没有可用的检查点：写入恢复的（或新的）状态的所有字段
+        turn = {**{name: getattr(history, name) for name in ConversationState.model_fields}, **turn}
+        turn["messages"] = history.messages + [user_message]
+        return user_message, turn
     
-    async def process_streaming_message(self, message: str, session_id: str = None,
-                                      problem_type: str = None, cd_inst_id: str = None,
-                                      problem_desc: str = None):
-        """处理流式消息"""
+    @staticmethod
+    def _turn_messages(messages: List[Any], user_message: Message) -> List[Any]:
+        """本轮新增的消息：从本轮的用户消息开始到最后"""
+        for index in range(len(messages) - 1, -1, -1):
+            if getattr(messages[index], "id", None) == user_message.id:
+                return messages[index:]
+        return []
+    
+    def _discard_turn(self, session_id: str, user_message: Message):
+        """撤销被取消的一轮，检查点回到本轮开始前的消息
+        
+        中途取消时检查点中已有本轮的用户消息和未执行的节点，下一轮直接在其上运行会把这些节点一起执行。
+        这里删除该会话的检查点，用本轮之前的消息和各字段重新写入一个没有待执行节点的检查点。
+        会话存储只写入完成的轮次，不需要处理。在取消的过程中调用，只使用同步方法，不会再次被取消打断。
+        """
+        config = {"configurable": {"thread_id": session_id}}
+        saved = self.memory.get_tuple(config)
+        if saved is None:
+            return
+        values = saved.checkpoint["channel_values"]
+        messages = values.get("messages", [])
+        turn_messages = self._turn_messages(messages, user_message)
+        if not turn_messages:
+            # 本轮的输入还没有写入检查点
+            return
+        
+        self.memory.delete_thread(session_id)
+        history = {name: values[name] for name in ConversationState.model_fields if name in values}
+        history["messages"] = messages[:len(messages) - len(turn_messages)]
+        if history["messages"]:
+            # 作为最后一个节点的输出写入，之后没有待执行的节点
+            self.app.update_state(config, history, as_node="generate_response")
+    
+    async def process_message(self, message: str, session_id: str = None, 
+                            problem_type: str = None, cd_inst_id: str = None, 
+                            problem_desc: str = None) -> ConversationState:
+        """处理用户消息"""
         if not session_id:
             session_id = str(uuid.uuid4())
+        # 本次请求之后的日志都带上会话ID，图节点在子任务中继承该上下文
+        logs.session_id_var.set(session_id)
         
-        # 创建或获取会话状态
-        config = {"configurable": {"thread_id": session_id}}
+        # 使用完整的LangGraph工作流处理
+        config = self._run_config(session_id)
+        
+        # 检查点可用时只输入本轮新增的部分，不重新构造和校验历史消息
+        user_message, turn = await self._turn_input(session_id, message, problem_type, cd_inst_id, problem_desc)
         
-        # 尝试从检查点恢复历史状态
-        state = None
+        # 运行完整的图处理流程
         try:
-            # 获取检查点中的历史状态
-            checkpoint = await self.memory.aget_tuple(config)
-            if checkpoint and checkpoint.checkpoint:
-                # 如果有历史状态，从中恢复
-                historical_state = checkpoint.checkpoint.get('channel_values', {})
-                if historical_state:
-                    # 从历史状态创建ConversationState对象
-                    state = ConversationState(**historical_state)
-                    print(f"从检查点恢复状态，包含 {len(state.messages)} 条历史消息")
-                else:
-                    # 没有历史状态，创建新的
-                    state = ConversationState(session_id=session_id)
-                    print("创建新的对话状态")
-            else:
-                # 没有检查点，创建新的状态
-                state = ConversationState(session_id=session_id)
-                print("创建新的对话状态")
-        except Exception as e:
-            print(f"恢复状态失败: {e}，创建新的状态")
-            state = ConversationState(session_id=session_id)
+            result = await self.app.ainvoke(turn, config)
+        except asyncio.CancelledError:
+            self._discard_turn(session_id, user_message)
+            raise
+        
+        appended = self._persist_turn(session_id, self._turn_messages(result["messages"], user_message), result)
+        if self.shared_state:
+            await self._sync_turn(session_id, appended)
+        return result
+    
+    async def process_streaming_message(self, message: str, session_id: str = None,
+                                      problem_type: str = None, cd_inst_id: str = None,
+                                      problem_desc: str = None, stats: StreamStats = None):
+        """处理流式消息
         
-        # 添加当前用户消息
-        state.add_message(MessageRole.USER, message)
-        print(f"添加用户消息后，总消息数: {len(state.messages)}")
+        节点完成时输出处理步骤，生成回答时实时转发LLM的token。
+        传入stats时会记录首token耗时等统计信息。
+        """
+        if stats is None:
+            stats = StreamStats()
         
-        # 设置新的字段
-        if problem_type:
-            state.problem_type = problem_type
-        if cd_inst_id:
-            state.cd_inst_id = cd_inst_id
-        if problem_desc:
-            state.problem_desc = problem_desc
+        if not session_id:
+            session_id = str(uuid.uuid4())
+        logs.session_id_var.set(session_id)
         
-        # 保存最后一个有效的状态
-        last_valid_state = state
+        # 创建或获取会话状态
+        config = self._run_config(session_id)
         
-        # 运行图并流式输出
-        async for event in self.app.astream(state, config):
-            for node_name, node_state in event.items():
-                if node_name == "__end__":
-                    continue
-                
-                # 保存每个节点的状态，最后一个就是最终状态
-                if node_state is not None:
-                    last_valid_state = node_state
-                
-                # 根据节点名称输出对应的处理步骤
-                if node_name == "intent_classification":
-                    yield "已完成识别用户意图...\n"
-                elif node_name == "request_build_log":
-                    yield "已完成查询构建日志...\n"
-                elif node_name == "search_knowledge_base":
-                    yield "已完成查询知识库...\n"
-                elif node_name == "generate_response":
-                    yield "已完成生成回答...\n"
-                else:
-                    yield f"正在执行: {node_name}..."
-        
-        # 流程完成后，从最后一个有效状态中获取最终答案
-        print(f"流程完成，last_valid_state类型: {type(last_valid_state)}")
-        assistant_message_content = ""
-        
-        if last_valid_state:
-            messages = None
-            if isinstance(last_valid_state, ConversationState):
-                messages = last_valid_state.messages
-            elif isinstance(last_valid_state, dict) and 'messages' in last_valid_state:
-                messages = last_valid_state['messages']
-            
-            if messages:
-                print(f"从状态中找到 {len(messages)} 条消息")
-                for msg_item in reversed(messages):
-                    if isinstance(msg_item, dict) and msg_item.get('role') == 'assistant':
-                        assistant_message_content = msg_item.get('content', '')
-                        break
-                    elif hasattr(msg_item, 'role') and msg_item.role.value == 'assistant':
-                        assistant_message_content = msg_item.content
-                        break
-            else:
-                print("状态中没有找到消息列表或消息列表为空")
-        else:
-            print("last_valid_state为None")
-        
-        if assistant_message_content:
-            print(f"找到助手消息，内容长度: {len(assistant_message_content)}")
-            # 流式输出回答内容
-            chunk_size = 50  # 每次输出50个字符
-            for i in range(0, len(assistant_message_content), chunk_size):
-                chunk = assistant_message_content[i:i + chunk_size]
-                yield chunk
-                await asyncio.sleep(0.1)  # 控制输出速度
-        else:
-            print("未找到最终结果或消息")
+        # 检查点可用时只输入本轮新增的部分，不重新构造和校验历史消息
+        user_message, turn = await self._turn_input(session_id, message, problem_type, cd_inst_id, problem_desc)
+        
+        # 运行图并流式输出：updates对应节点完成，custom对应生成中的token
+        # 调用方取消（客户端断开）时图的运行随之取消，正在执行的节点中的LLM和构建日志请求一并取消
+        try:
+            async with aclosing(self.app.astream(turn, config, stream_mode=["updates", "custom"])) as events:
+                async for mode, event in events:
+                    if mode == "custom":
+                        if event.get("type") == "token":
+                            stats.record_token()
+                            yield event["content"]
+                        continue
+                    
+                    for node_name, node_state in event.items():
+                        if node_name == "__end__":
+                            continue
+                        
+                        # 根据节点名称输出对应的处理步骤
+                        if node_name == "intent_classification":
+                            yield "已完成识别用户意图...\n"
+                        elif node_name == "request_build_log":
+                            yield "已完成查询构建日志...\n"
+                        elif node_name == "search_knowledge_base":
+                            yield "已完成查询知识库...\n"
+                        elif node_name == "join_context":
+                            continue
+                        elif node_name == "generate_response":
+                            yield "\n已完成生成回答...\n"
+                        else:
+                            yield f"正在执行: {node_name}..."
+        except (asyncio.CancelledError, GeneratorExit):
+            self._discard_turn(session_id, user_message)
+            logger.info("本轮处理已取消", extra={"tokens": stats.token_count})
+            raise
+        
+        # 节点只返回变化的字段，运行结束后从检查点读取完整的最终状态
+        final_values = (await self.app.aget_state(config)).values
+        appended = self._persist_turn(session_id, self._turn_messages(final_values["messages"], user_message), final_values)
+        if self.shared_state:
+            # 本轮的消息提交后再结束响应，下一条消息落在其他进程时也能读到
+            await self._sync_turn(session_id, appended)
+        
+        stats.finish()
+        logger.info("流式处理完成", extra={"ttft_ms": stats.ttft_ms, "total_ms": stats.total_ms, "tokens": stats.token_count})
+    
+    async def get_session_history(self, session_id: str, before: int = None, limit: int = 50) -> Dict[str, Any]:
+        """分页获取会话历史消息，before为上一页返回的游标"""
+        if not self.session_store:
+            return {"messages": [], "next_cursor": None}
+        
+        loop = asyncio.get_running_loop()
+        messages, next_cursor = await loop.run_in_executor(
+            None, self.session_store.get_messages, session_id, before, limit
+        )
+        return {"messages": messages, "next_cursor": next_cursor}
+    
+    async def delete_session(self, session_id: str):
+        """删除会话的检查点和持久化记录"""
+        await self.memory.adelete_thread(session_id)
+        self._store_versions.delete(session_id)
+        if self.session_store:
+            self.session_store.delete_session(session_id)
+            if self.shared_state:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.session_store.flush)
+    
+    async def start(self):
+        """创建外部服务的共享连接"""
+        await self.build_log_service.start()
+    
+    async def close(self):
+        """关闭外部服务连接，等待会话写入完成并关闭存储"""
+        await self.build_log_service.close()
+        await self.llm_clients.aclose()
+        if self.session_store:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.session_store.close)
@@ -0,0 +1,303 @@
+"""
+会话检查点存储
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+
+# 只追加通道在blobs中的类型标记，数据为"日志代数:元素个数"
+APPEND_LOG_TYPE = "append-log"
+
+
+class _AppendLog:
+    """一个会话中只追加通道的全部元素
+
+    每次写入检查点时只追加并序列化新增的元素，序列化结果用于统计占用字节数和计算每个元素的摘要，
+    读取时按检查点记录的元素个数截取，不需要反序列化历史元素。元素按原对象保存，视为不可变。
+    通道的值不是在原有元素之后追加时（例如被整体替换或改写了历史）重建日志，代数加一。
+    """
+    
+    __slots__ = ("items", "digests", "bytes", "generation")
+    
+    def __init__(self, generation: int = 0):
+        self.items: List[Any] = []
+        self.digests: List[bytes] = []
+        self.bytes = 0
+        self.generation = generation
+    
+    def extends(self, value: List[Any], digest: Callable[[Any], bytes]) -> bool:
+        """value是否为在当前元素之后追加得到的列表
+        
+        要求长度不小于当前元素个数，且前缀与日志中的元素逐个一致：同一对象直接视为一致，
+        否则比较序列化结果的摘要。只比较最后一个元素时，改写了历史但末尾相同的列表会被误认为追加。
+        """
+        if len(value) < len(self.items):
+            return False
+        for item, logged, logged_digest in zip(value, self.items, self.digests):
+            if item is not logged and digest(item) != logged_digest:
+                return False
+        return True
+    
+    def append(self, added: List[Any], dumps: Callable[[Any], bytes]):
+        for item in added:
+            data = dumps(item)
+            self.items.append(item)
+            self.digests.append(_digest(data))
+            self.bytes += len(data)
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """有容量上限的内存检查点存储
+
+    - 每个会话只保留最近的若干个检查点，删除更早的检查点及不再被引用的通道数据
+    - 会话数或总字节数超过上限时，按最近访问时间淘汰最久未使用的会话
+    - 超过空闲时间未访问的会话直接淘汰
+
+    - append_only_channels中的通道（默认为消息列表）只保存每次新增的元素，
+      长对话每一步的检查点开销与历史长度无关
+
+    被淘汰的会话再次访问时读取不到检查点，按新会话处理。
+    
+    实现依赖InMemorySaver的内部结构（storage、blobs、writes和_load_blobs），
+    tests/test_checkpoint.py中有检查这些结构的用例，升级langgraph后需要确认其通过。
+    """
+    
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 256 * 1024 * 1024,
+                 session_ttl: float = 3600, max_checkpoints_per_thread: int = 2,
+                 append_only_channels: Iterable[str] = ("messages",), **kwargs):
+        super().__init__(**kwargs)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self.max_checkpoints_per_thread = max(1, max_checkpoints_per_thread)
+        self.append_only_channels = frozenset(append_only_channels)
+        
+        # 会话ID -> 最近访问时间，按访问先后排序
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        # 会话ID -> 占用字节数
+        self._thread_bytes: Dict[str, int] = {}
+        # 会话ID -> 该会话的通道数据键
+        self._thread_blobs: Dict[str, Set[Tuple[str, str, str, Any]]] = {}
+        # (会话ID, 命名空间) -> 检查点ID -> 该检查点引用的通道版本
+        self._checkpoint_versions: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {}
+        # 会话ID -> (命名空间, 通道) -> 日志代数 -> 只追加通道的元素，最后一项为当前代数
+        self._append_logs: Dict[str, Dict[Tuple[str, str], Dict[int, _AppendLog]]] = {}
+        self.total_bytes = 0
+        self.evicted_sessions = 0
+        self.pruned_checkpoints = 0
+    
+    @property
+    def session_count(self) -> int:
+        """当前保存的会话数"""
+        return len(self._last_access)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": self.session_count,
+            "bytes": self.total_bytes,
+            "evicted_sessions": self.evicted_sessions,
+            "pruned_checkpoints": self.pruned_checkpoints
+        }
+    
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        self._evict_idle()
+        if thread_id in self._last_access:
+            self._touch(thread_id)
+        return super().get_tuple(config)
+    
+    def has_thread(self, thread_id: str) -> bool:
+        """会话是否有检查点，不读取检查点内容
+        
+        与get_tuple一样先淘汰空闲超时的会话并刷新访问时间，保证紧接着运行图时检查点仍在。
+        """
+        self._evict_idle()
+        if not self.storage.get(thread_id):
+            return False
+        self._touch(thread_id)
+        return True
+    
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        
+        values = checkpoint["channel_values"]
+        appended = {
+            channel: values[channel] for channel in self.append_only_channels
+            if channel in new_versions and isinstance(values.get(channel), list)
+        }
+        if appended:
+            # 只追加通道不交给父类序列化，父类写入的空数据随后替换为追加日志的标记
+            checkpoint = {
+                **checkpoint,
+                "channel_values": {key: value for key, value in values.items() if key not in appended}
+            }
+        result = super().put(config, checkpoint, metadata, new_versions)
+        for channel, value in appended.items():
+            marker = self._append(thread_id, checkpoint_ns, channel, value)
+            self.blobs[(thread_id, checkpoint_ns, channel, new_versions[channel])] = marker
+        
+        blob_keys = self._thread_blobs.setdefault(thread_id, set())
+        for channel, version in new_versions.items():
+            blob_keys.add((thread_id, checkpoint_ns, channel, version))
+        versions = self._checkpoint_versions.setdefault((thread_id, checkpoint_ns), {})
+        versions[checkpoint["id"]] = dict(checkpoint["channel_versions"])
+        
+        self._prune_checkpoints(thread_id, checkpoint_ns)
+        self._touch(thread_id)
+        self._update_bytes(thread_id)
+        self._evict(keep=thread_id)
+        return result
+    
+    def _append(self, thread_id: str, checkpoint_ns: str, channel: str, value: List[Any]) -> Tuple[str, bytes]:
+        """把通道的新值写入追加日志，只处理新增的元素，返回保存到blobs中的标记"""
+        logs = self._append_logs.setdefault(thread_id, {}).setdefault((checkpoint_ns, channel), {})
+        log = logs[next(reversed(logs))] if logs else None
+        if log is None or not log.extends(value, self._item_digest):
+            # 重建日志，旧代数的日志保留到引用它的检查点都被删除为止
+            log = _AppendLog(log.generation + 1 if log is not None else 0)
+            logs[log.generation] = log
+        
+        added = value[len(log.items):]
+        if added:
+            log.append(added, self._dumps_item)
+        return APPEND_LOG_TYPE, f"{log.generation}:{len(value)}".encode()
+    
+    def _dumps_item(self, item: Any) -> bytes:
+        return self.serde.dumps_typed(item)[1]
+    
+    def _item_digest(self, item: Any) -> bytes:
+        return _digest(self._dumps_item(item))
+    
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        channel_values = {}
+        plain_versions = {}
+        for channel, version in versions.items():
+            blob = self.blobs.get((thread_id, checkpoint_ns, channel, version))
+            if blob is None or blob[0] != APPEND_LOG_TYPE:
+                plain_versions[channel] = version
+                continue
+            generation, count = map(int, blob[1].split(b":"))
+            log = self._append_logs.get(thread_id, {}).get((checkpoint_ns, channel), {}).get(generation)
+            if log is None:
+                # 日志与引用它的检查点一起删除，找不到说明数据不一致，不能当作没有元素返回
+                raise KeyError(f"检查点引用的追加日志不存在: {thread_id} {channel} 代数{generation}")
+            channel_values[channel] = log.items[:count]
+        channel_values.update(super()._load_blobs(thread_id, checkpoint_ns, plain_versions))
+        return channel_values
+    
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        super().put_writes(config, writes, task_id, task_path)
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id in self._last_access:
+            self._update_bytes(thread_id)
+    
+    def delete_thread(self, thread_id: str) -> None:
+        if thread_id in self.storage:
+            # 只删除该会话自己的数据，避免遍历所有会话
+            for checkpoint_ns, checkpoints in self.storage[thread_id].items():
+                for checkpoint_id in checkpoints:
+                    self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            del self.storage[thread_id]
+        for blob_key in self._thread_blobs.pop(thread_id, ()):
+            self.blobs.pop(blob_key, None)
+        for key in [key for key in self._checkpoint_versions if key[0] == thread_id]:
+            del self._checkpoint_versions[key]
+        self._append_logs.pop(thread_id, None)
+        self._last_access.pop(thread_id, None)
+        self.total_bytes -= self._thread_bytes.pop(thread_id, 0)
+    
+    def _touch(self, thread_id: str):
+        self._last_access[thread_id] = time.monotonic()
+        self._last_access.move_to_end(thread_id)
+    
+    def _prune_checkpoints(self, thread_id: str, checkpoint_ns: str):
+        """删除超出保留数量的旧检查点"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.max_checkpoints_per_thread:
+            return
+        
+        versions = self._checkpoint_versions[(thread_id, checkpoint_ns)]
+        # 字典按写入顺序排列，越靠前的检查点越旧
+        stale_ids = list(checkpoints)[:len(checkpoints) - self.max_checkpoints_per_thread]
+        for checkpoint_id in stale_ids:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            versions.pop(checkpoint_id, None)
+            self.pruned_checkpoints += 1
+        
+        # 删除保留的检查点都不再引用的通道数据
+        referenced = {
+            (thread_id, checkpoint_ns, channel, version)
+            for channel_versions in versions.values()
+            for channel, version in channel_versions.items()
+        }
+        blob_keys = self._thread_blobs[thread_id]
+        for blob_key in [key for key in blob_keys if key[1] == checkpoint_ns and key not in referenced]:
+            blob_keys.discard(blob_key)
+            self.blobs.pop(blob_key, None)
+        self._prune_append_logs(thread_id, checkpoint_ns)
+    
+    def _prune_append_logs(self, thread_id: str, checkpoint_ns: str):
+        """删除保留的检查点都不再引用的旧代数追加日志，当前代数的日志始终保留"""
+        referenced = set()
+        for blob_key in self._thread_blobs.get(thread_id, ()):
+            blob = self.blobs.get(blob_key)
+            if blob_key[1] == checkpoint_ns and blob is not None and blob[0] == APPEND_LOG_TYPE:
+                referenced.add((blob_key[2], int(blob[1].split(b":")[0])))
+        for (ns, channel), logs in self._append_logs.get(thread_id, {}).items():
+            if ns != checkpoint_ns or len(logs) == 1:
+                continue
+            current = next(reversed(logs))
+            for generation in [g for g in logs if g != current and (channel, g) not in referenced]:
+                del logs[generation]
+    
+    def _update_bytes(self, thread_id: str):
+        """重新统计会话占用的字节数"""
+        size = 0
+        for checkpoint_ns, checkpoints in self.storage.get(thread_id, {}).items():
+            for checkpoint_id, (checkpoint, metadata, _) in checkpoints.items():
+                size += len(checkpoint[1]) + len(metadata[1])
+                for _, _, value, _ in self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {}).values():
+                    size += len(value[1])
+        for blob_key in self._thread_blobs.get(thread_id, ()):
+            blob = self.blobs.get(blob_key)
+            if blob is not None:
+                size += len(blob[1])
+        for logs in self._append_logs.get(thread_id, {}).values():
+            size += sum(log.bytes for log in logs.values())
+        
+        self.total_bytes += size - self._thread_bytes.get(thread_id, 0)
+        self._thread_bytes[thread_id] = size
+    
+    def _evict_idle(self):
+        """淘汰空闲超时的会话"""
+        deadline = time.monotonic() - self.session_ttl
+        while self._last_access:
+            thread_id, last_access = next(iter(self._last_access.items()))
+            if last_access >= deadline:
+                break
+            self.delete_thread(thread_id)
+            self.evicted_sessions += 1
+    
+    def _evict(self, keep: str):
+        """淘汰空闲超时的会话，再按LRU淘汰超出会话数或字节数上限的会话"""
+        self._evict_idle()
+        while len(self._last_access) > self.max_sessions or self.total_bytes > self.max_bytes:
+            thread_id = next(iter(self._last_access))
+            if thread_id == keep:
+                # 只剩当前会话时不再淘汰，避免中断正在进行的对话
+                break
+            self.delete_thread(thread_id)
+            self.evicted_sessions += 1
@@ -1,26 +1,156 @@
-from typing import Dict, Any
-from langchain_openai import ChatOpenAI
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
 from langchain.prompts import ChatPromptTemplate
 from ..models import IntentType
 from ..config import config
+from ..knowledge.matcher import KeywordAutomaton
+from ..knowledge.ranking import tokenize
+from .cache import TieredCache, normalize_question
+from .llm_clients import INTENT, LLMClientRegistry
+from .llm_coalescer import LLMCoalescer
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# 内置的构建相关词汇，与知识库build_errors中的关键字一起用于本地规则匹配
+BUILD_TERMS = [
+    "构建", "编译", "打包", "流水线", "build", "compile", "compilation", "jenkins", "gitlab ci",
+    "pipeline", "maven", "mvn ", "gradle", "npm install", "pip install", "docker build",
+    "cdinstid", "ci/cd", "依赖", "dependency"
+]
+
+# 报错类文本的正则规则
+ERROR_PATTERNS = re.compile(
+    r"(\b(error|failed|failure|exception|exit code \d+)\b|报错|失败|异常|错误)",
+    re.IGNORECASE
+)
 
-class IntentClassifier:
-    def __init__(self):
-        # self.llm = ChatOpenAI(
-        #     model=config.OPENAI_MODEL,
-        #     api_key=config.OPENAI_API_KEY,
-        #     temperature=0.1
-        # )
 
+class LinearIntentModel:
+    """基于词特征的逻辑回归意图模型，以JSON格式保存在磁盘上
 
-        self.llm = ChatOpenAI(
-            model="qwq-32b",  # 百炼云上的模型名称
-            api_key="sk-d61a92f522dd49ffa38787277dc6e65b",  # 百炼云 API Key
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",  # 百炼云的 API 地址
-            temperature=0.1,
-            streaming=True  # 百炼云模型要求必须启用流式模式
+    文件格式：{"bias": 0.0, "weights": {"构建": 1.2, ...}}，
+    输出为问题属于构建类的概率。
+    """
+    
+    def __init__(self, weights: Dict[str, float], bias: float = 0.0):
+        self.weights = weights
+        self.bias = bias
+    
+    @classmethod
+    def load(cls, path: str) -> "LinearIntentModel":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get("weights", {}), data.get("bias", 0.0))
+    
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"bias": self.bias, "weights": self.weights}, f, ensure_ascii=False)
+    
+    @classmethod
+    def train(cls, samples: List[Tuple[str, IntentType]], epochs: int = 20,
+              learning_rate: float = 0.5) -> "LinearIntentModel":
+        """用(问题, 意图)样本训练模型"""
+        model = cls({}, 0.0)
+        for _ in range(epochs):
+            for text, intent in samples:
+                label = 1.0 if intent == IntentType.BUILD else 0.0
+                features = set(tokenize(text))
+                gradient = model.predict_proba(text) - label
+                model.bias -= learning_rate * gradient
+                for feature in features:
+                    model.weights[feature] = model.weights.get(feature, 0.0) - learning_rate * gradient
+        return model
+    
+    def predict_proba(self, text: str) -> float:
+        """返回问题属于构建类的概率"""
+        score = self.bias + sum(self.weights.get(feature, 0.0) for feature in set(tokenize(text)))
+        score = max(min(score, 30.0), -30.0)
+        return 1.0 / (1.0 + math.exp(-score))
+
+
+class LocalIntentClassifier:
+    """本地意图分类器，不调用LLM，返回意图和置信度"""
+    
+    def __init__(self, knowledge_base=None, model_path: str = None):
+        build_keywords = list(BUILD_TERMS)
+        general_keywords = []
+        if knowledge_base is not None:
+            for entry in knowledge_base.knowledge_data.get("build_errors", []):
+                build_keywords.extend(entry["keywords"])
+            for entry in knowledge_base.knowledge_data.get("general_qa", []):
+                general_keywords.extend(entry["keywords"])
+        
+        self.build_automaton = KeywordAutomaton(build_keywords)
+        self.general_automaton = KeywordAutomaton(general_keywords)
+        
+        self.model: Optional[LinearIntentModel] = None
+        if model_path and os.path.exists(model_path):
+            try:
+                self.model = LinearIntentModel.load(model_path)
+            except (OSError, ValueError) as e:
+                logger.warning("意图模型加载失败: %s", e)
+    
+    def classify(self, user_question: str, cd_inst_id: str = None) -> Tuple[IntentType, float]:
+        """返回(意图, 置信度)"""
+        # 带有流水线实例ID的问题基本可以确定是构建问题
+        if cd_inst_id:
+            return IntentType.BUILD, 0.95
+        
+        build_hits = len(self.build_automaton.search(user_question))
+        general_hits = len(self.general_automaton.search(user_question))
+        has_error = bool(ERROR_PATTERNS.search(user_question))
+        
+        if build_hits:
+            confidence = 0.9 if build_hits >= 2 or has_error else 0.8
+            intent = IntentType.BUILD
+        elif general_hits:
+            confidence = 0.85 if not has_error else 0.6
+            intent = IntentType.GENERAL
+        else:
+            confidence = 0.5
+            intent = IntentType.GENERAL
+        
+        # 线性模型更有把握时采用模型结论
+        if self.model is not None:
+            probability = self.model.predict_proba(user_question)
+            model_confidence = max(probability, 1 - probability)
+            if model_confidence > confidence:
+                intent = IntentType.BUILD if probability >= 0.5 else IntentType.GENERAL
+                confidence = model_confidence
+        
+        return intent, confidence
+
+
+class IntentClassifier:
+    def __init__(self, knowledge_base=None, llm_clients: LLMClientRegistry = None):
+        # 由ChatAgent传入共享的客户端注册表，单独使用时按配置创建
+        self.llm_clients = llm_clients or LLMClientRegistry.from_config()
+        self.llm = self.llm_clients.get(INTENT)
+        
+        # 本地分类器置信度足够时不再调用LLM
+        self.local_classifier = LocalIntentClassifier(knowledge_base, config.INTENT_MODEL_PATH)
+        self.confidence_threshold = config.INTENT_CONFIDENCE_THRESHOLD
+        
+        # 按归一化后的问题缓存意图识别结果，配置了INTENT_CACHE_PATH时写入多个工作进程共用的磁盘层
+        self.cache = TieredCache(
+            config.INTENT_CACHE_PATH, config.INTENT_CACHE_SIZE, config.INTENT_CACHE_TTL,
+            encode=lambda intent: intent.value.encode("utf-8"),
+            decode=lambda data: IntentType(data.decode("utf-8"))
         )
         
+        # 缓存写入之前同时到达的相同问题共享一次LLM调用
+        self.coalescer = LLMCoalescer(config.LLM_COALESCE_ENABLED)
+        
+        # 各层级做出决策的次数：cache-缓存，local-本地分类器，llm-大模型，fallback-大模型失败后的默认值
+        self.tier_counts = {"cache": 0, "local": 0, "llm": 0, "fallback": 0}
+        
         self.intent_prompt = ChatPromptTemplate.from_template("""
 你是一个专业的意图识别助手。请分析用户的问题，判断其意图类型。
 
@@ -34,24 +164,59 @@ class IntentClassifier:
 
 意图类型:""")
     
-    async def classify_intent(self, user_question: str) -> IntentType:
-        """识别用户问题的意图"""
+    async def classify_intent(self, user_question: str, cd_inst_id: str = None) -> IntentType:
+        """识别用户问题的意图，依次查询缓存、本地分类器，置信度不足时再调用LLM"""
+        # 是否带有实例ID会影响识别结果，需要作为缓存键的一部分
+        cache_key = (bool(cd_inst_id), normalize_question(user_question))
+        cached_intent = await self.cache.get(cache_key)
+        if cached_intent is not None:
+            self.tier_counts["cache"] += 1
+            return cached_intent
+        
+        intent, confidence = self.local_classifier.classify(user_question, cd_inst_id)
+        if confidence >= self.confidence_threshold:
+            self.tier_counts["local"] += 1
+            await self.cache.set(cache_key, intent)
+            logger.debug("本地意图识别", extra={"intent": intent.value, "confidence": round(confidence, 2)})
+            return intent
+        
+        start = time.perf_counter()
         try:
-            response = await self.llm.ainvoke(
-                self.intent_prompt.format(user_question=user_question)
+            response = await self.coalescer.invoke(
+                self.llm, self.intent_prompt.format(user_question=user_question)
             )
+            metrics.LLM_LATENCY.labels("IntentClassifier", "invoke").observe(time.perf_counter() - start)
             
             intent_text = response.content.strip().lower()
+            self.tier_counts["llm"] += 1
             
             if "build" in intent_text:
-                return IntentType.BUILD
+                intent = IntentType.BUILD
             else:
-                return IntentType.GENERAL
+                intent = IntentType.GENERAL
+            await self.cache.set(cache_key, intent)
+            return intent
                 
+        except asyncio.CancelledError:
+            metrics.LLM_CANCELLED.labels("IntentClassifier", "invoke").inc()
+            raise
         except Exception as e:
-            print(f"意图识别失败: {e}")
-            # 默认返回一般问题
-            return IntentType.GENERAL
+            logger.warning("意图识别LLM调用失败，使用本地分类结果: %s", e)
+            metrics.LLM_ERRORS.labels("IntentClassifier").inc()
+            self.tier_counts["fallback"] += 1
+            # 默认使用本地分类结果，不写入缓存
+            return intent
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各层级的决策次数和缓存命中统计"""
+        total = sum(self.tier_counts.values())
+        return {
+            **self.tier_counts,
+            "total": total,
+            "local_ratio": round(self.tier_counts["local"] / total, 4) if total else 0.0,
+            "cache_stats": self.cache.get_stats(),
+            "coalesce_stats": self.coalescer.get_stats()
+        }
     
     def extract_build_log_url(self, message: str) -> str:
         """从用户消息中提取构建日志链接"""
@@ -0,0 +1,186 @@
+"""
+LLM客户端注册表
+
+各用途的ChatOpenAI共用一个httpx连接池。模型、密钥、接口地址以及各用途的温度和最大token数都来自配置，
+由ChatAgent在启动时创建一次，意图识别和回答生成复用同一批长连接，连接数上限按服务商的限流统一设置。
+"""
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from ..config import config
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # pragma: no cover - h2为可选依赖，未安装时使用HTTP/1.1
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+# 用途名称
+INTENT = "intent"
+ANSWER = "answer"
+
+
+class LLMProfile:
+    """一种用途的模型参数，max_tokens为None时不限制"""
+    
+    def __init__(self, model: str, temperature: float, max_tokens: Optional[int] = None):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """响应体读完或关闭时回调一次，用于统计进行中的请求"""
+    
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self.stream = stream
+        self.on_close = on_close
+        self.closed = False
+    
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+    
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.on_close()
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """统计请求数和进行中请求数的传输层，流式响应在响应体关闭后才算结束"""
+    
+    def __init__(self, transport: httpx.AsyncHTTPTransport):
+        self.transport = transport
+        self.requests = 0
+        self.in_flight = 0
+    
+    def _finish(self):
+        self.in_flight -= 1
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self._finish()
+            raise
+        if isinstance(response.stream, httpx.ByteStream):
+            # 响应体已全部在内存中，不会再关闭流
+            self._finish()
+            return response
+        response.stream = _TrackedStream(response.stream, self._finish)
+        return response
+    
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class LLMClientRegistry:
+    """按用途提供ChatOpenAI实例，所有实例共享一个httpx.AsyncClient"""
+    
+    def __init__(self, api_key: str, base_url: str, profiles: Dict[str, LLMProfile],
+                 max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, http2: bool = True,
+                 connect_timeout: float = 5.0, timeout: float = 120.0,
+                 max_retries: int = 2, streaming: bool = True):
+        if not api_key:
+            # 不阻止启动，调用时由服务商返回鉴权错误并走各服务的降级逻辑
+            logger.warning("未配置OPENAI_API_KEY，LLM调用将失败")
+        if http2 and h2 is None:
+            logger.info("未安装h2，LLM连接池使用HTTP/1.1")
+            http2 = False
+        
+        self.api_key = api_key or "EMPTY"
+        self.base_url = base_url or None
+        self.profiles = profiles
+        self.max_retries = max_retries
+        self.streaming = streaming
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.transport = _CountingTransport(httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+        self.http_client = httpx.AsyncClient(transport=self.transport, timeout=self.timeout)
+        self._clients: Dict[str, ChatOpenAI] = {}
+    
+    @classmethod
+    def from_config(cls) -> "LLMClientRegistry":
+        def max_tokens(value: int) -> Optional[int]:
+            return value if value > 0 else None
+        
+        profiles = {
+            INTENT: LLMProfile(
+                config.INTENT_LLM_MODEL or config.OPENAI_MODEL,
+                config.INTENT_LLM_TEMPERATURE,
+                max_tokens(config.INTENT_LLM_MAX_TOKENS)
+            ),
+            ANSWER: LLMProfile(
+                config.ANSWER_LLM_MODEL or config.OPENAI_MODEL,
+                config.ANSWER_LLM_TEMPERATURE,
+                max_tokens(config.ANSWER_LLM_MAX_TOKENS)
+            )
+        }
+        return cls(
+            config.OPENAI_API_KEY, config.OPENAI_BASE_URL, profiles,
+            max_connections=config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY,
+            http2=config.LLM_HTTP2,
+            connect_timeout=config.LLM_CONNECT_TIMEOUT,
+            timeout=config.LLM_TIMEOUT,
+            max_retries=config.LLM_MAX_RETRIES,
+            streaming=config.LLM_STREAMING
+        )
+    
+    def get(self, use_case: str) -> ChatOpenAI:
+        """返回指定用途的ChatOpenAI，同一用途只创建一次"""
+        client = self._clients.get(use_case)
+        if client is None:
+            profile = self.profiles[use_case]
+            client = ChatOpenAI(
+                model=profile.model,
+                api_key=self.api_key,
+                base_url=self.base_url,
+                temperature=profile.temperature,
+                max_tokens=profile.max_tokens,
+                max_retries=self.max_retries,
+                timeout=self.timeout,
+                # 部分兼容OpenAI接口的服务商（如百炼云）要求必须启用流式模式
+                streaming=self.streaming,
+                http_async_client=self.http_client
+            )
+            self._clients[use_case] = client
+        return client
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池统计：requests-发出的HTTP请求数，in_flight-进行中的请求数，connections-已建立的连接数"""
+        # httpx没有公开连接池，取不到时只返回请求统计
+        pool = getattr(self.transport.transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        return {
+            "requests": self.transport.requests,
+            "in_flight": self.transport.in_flight,
+            "connections": len(connections),
+            "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+            "http2_connections": sum(1 for connection in connections if "HTTP/2" in connection.info()),
+            "max_connections": self.max_connections,
+            "http2": self.http2
+        }
+    
+    async def aclose(self):
+        """关闭共享连接池，之后不能再发起调用"""
+        await self.http_client.aclose()
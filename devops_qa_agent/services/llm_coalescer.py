@@ -0,0 +1,140 @@
+"""
+合并相同的并发LLM调用
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Dict, List, Sequence, Union
+
+from langchain.schema import BaseMessage
+
+from .cache import SingleFlight
+
+
+class _SharedStream:
+    """一次上游流式调用，多个订阅方共享同一个token序列
+
+    已收到的token全部保留，中途加入的订阅方先补发之前的token，保证每个订阅方拿到完整且相同的回答。
+    所有订阅方都退出后取消上游调用。
+    """
+    
+    def __init__(self, chunks: AsyncIterator[Any]):
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: BaseException = None
+        self.subscribers = 0
+        self._updated = asyncio.Event()
+        self.task = asyncio.ensure_future(self._consume(chunks))
+    
+    async def _consume(self, chunks: AsyncIterator[Any]):
+        try:
+            async for chunk in chunks:
+                if chunk.content:
+                    self.tokens.append(chunk.content)
+                    self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+    
+    def _notify(self):
+        # 唤醒当前所有等待的订阅方，之后的等待使用新的事件
+        self._updated.set()
+        self._updated = asyncio.Event()
+    
+    async def subscribe(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            if index < len(self.tokens):
+                yield self.tokens[index]
+                index += 1
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._updated.wait()
+
+
+class LLMCoalescer:
+    """合并相同提示词和模型参数的并发LLM调用
+
+    - invoke: 同一时刻相同的调用只请求一次上游，其余调用方等待同一个结果
+    - stream: 相同的流式调用共享一个上游流，每个token分发给所有订阅方
+
+    只合并正在进行中的调用，调用结束后不保留结果（跨请求的复用由回答缓存负责）。
+    enabled为False时直接调用上游。
+    """
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.single_flight = SingleFlight()
+        self._streams: Dict[str, _SharedStream] = {}
+        self.stream_calls = 0
+        self.stream_coalesced = 0
+    
+    @staticmethod
+    def make_key(llm: Any, messages: Union[str, Sequence[BaseMessage]]) -> str:
+        """由模型类型、模型参数和最终的消息列表计算键"""
+        if isinstance(messages, str):
+            payload = [["text", messages]]
+        else:
+            payload = [[message.type, message.content] for message in messages]
+        params = getattr(llm, "_identifying_params", {}) or {}
+        data = json.dumps(
+            [type(llm).__name__, params, payload],
+            ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+    
+    async def invoke(self, llm: Any, messages: Union[str, Sequence[BaseMessage]]) -> Any:
+        if not self.enabled:
+            return await llm.ainvoke(messages)
+        key = self.make_key(llm, messages)
+        return await self.single_flight.do(key, lambda: llm.ainvoke(messages))
+    
+    async def stream(self, llm: Any, messages: Union[str, Sequence[BaseMessage]]) -> AsyncIterator[str]:
+        """流式调用，逐个返回非空的token内容"""
+        if not self.enabled:
+            async for chunk in llm.astream(messages):
+                if chunk.content:
+                    yield chunk.content
+            return
+        
+        key = self.make_key(llm, messages)
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = _SharedStream(llm.astream(messages))
+            self._streams[key] = shared
+            self.stream_calls += 1
+            shared.task.add_done_callback(lambda _: self._forget(key, shared))
+        else:
+            self.stream_coalesced += 1
+        
+        shared.subscribers += 1
+        try:
+            async for token in shared.subscribe():
+                yield token
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                # 之后的相同调用重新请求上游，不再加入这个即将取消的流
+                self._forget(key, shared)
+                shared.task.cancel()
+    
+    def _forget(self, key: str, shared: _SharedStream):
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+    
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "invoke_calls": self.single_flight.calls,
+            "invoke_coalesced": self.single_flight.coalesced,
+            "stream_calls": self.stream_calls,
+            "stream_coalesced": self.stream_coalesced,
+            "in_flight": len(self.single_flight) + len(self._streams)
+        }
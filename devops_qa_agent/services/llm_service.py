@@ -1,26 +1,26 @@
+import asyncio
+import logging
+import time
 from typing import List, Dict, Any, AsyncGenerator
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from langchain.schema import HumanMessage, SystemMessage
 from ..models import ConversationState
 from ..config import config
-import asyncio
+from .cache import AnswerCache
+from .llm_clients import ANSWER, LLMClientRegistry
+from .llm_coalescer import LLMCoalescer
+from .prompt_builder import Prompt, PromptBuilder
+from . import logs, metrics
+
+logger = logging.getLogger(__name__)
+
+# 缓存命中时按该长度分块输出，与LLM流式输出的格式保持一致
+CACHED_ANSWER_CHUNK_SIZE = 20
 
 class LLMService:
-    def __init__(self):
-        # self.llm = ChatOpenAI(
-        #     model=config.OPENAI_MODEL,
-        #     api_key=config.OPENAI_API_KEY,
-        #     temperature=0.7,
-        #     streaming=True
-        # )
-        self.llm = ChatOpenAI(
-            model="qwq-32b",  # 百炼云上的模型名称
-            api_key="sk-d61a92f522dd49ffa38787277dc6e65b",  # 百炼云 API Key
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",  # 百炼云的 API 地址
-            temperature=0.7,
-            streaming=True  # 百炼云模型要求必须启用流式模式
-        )
+    def __init__(self, llm_clients: LLMClientRegistry = None):
+        # 由ChatAgent传入共享的客户端注册表，单独使用时按配置创建
+        self.llm_clients = llm_clients or LLMClientRegistry.from_config()
+        self.llm = self.llm_clients.get(ANSWER)
         
         self.system_prompt = """你是一个专业的智能助手，专门帮助用户解决技术问题。
 
@@ -32,101 +32,105 @@ class LLMService:
 5. 如果知识库信息不足，可以补充一般性建议
 
 请用中文回答，保持友好和专业的语调。"""
-    
-    def format_context(self, state: ConversationState) -> str:
-        """格式化上下文信息"""
-        context_parts = []
         
-        # 添加知识库搜索结果
-        if state.knowledge_base_results:
-            context_parts.append("相关知识点：")
-            for i, result in enumerate(state.knowledge_base_results[:3], 1):
-                context_parts.append(f"{i}. 问题：{result['question']}")
-                context_parts.append(f"   答案：{result['answer']}")
-        
-        # 添加构建错误信息
-        if state.build_errors:
-            context_parts.append(f"构建错误关键字：{', '.join(state.build_errors)}")
+        # 按token预算组装提示词，知识条目、构建错误和历史各只放入一次
+        self.prompt_builder = PromptBuilder(
+            self.system_prompt,
+            max_tokens=config.PROMPT_MAX_TOKENS,
+            top_k=config.KNOWLEDGE_TOP_K,
+            recent_messages=config.PROMPT_RECENT_MESSAGES,
+            summary_max_tokens=config.PROMPT_SUMMARY_MAX_TOKENS
+        )
         
-        # 添加对话历史
-        if state.messages:
-            context_parts.append("对话历史：")
-            context_parts.append(state.get_context())
+        # 问题、检索到的知识和构建错误都相同时直接复用之前的回答
+        self.answer_cache = None
+        if config.ANSWER_CACHE_ENABLED:
+            self.answer_cache = AnswerCache(
+                config.ANSWER_CACHE_PATH,
+                maxsize=config.ANSWER_CACHE_SIZE,
+                max_bytes=config.ANSWER_CACHE_MAX_BYTES,
+                ttl=config.ANSWER_CACHE_TTL
+            )
         
-        return "\n".join(context_parts)
+        # 同一故障引发的大量相同问题同时到达时，只向LLM发出一次请求
+        self.coalescer = LLMCoalescer(config.LLM_COALESCE_ENABLED)
+    
+    def answer_cache_key(self, state: ConversationState, user_question: str, prompt: Prompt) -> str:
+        """计算回答缓存键，只计入实际放入提示词的知识条目和对话历史"""
+        return AnswerCache.make_key(user_question, prompt.entry_ids, state.build_errors, prompt.history)
+    
+    def build_prompt(self, state: ConversationState, user_question: str, context_info: List[str] = None) -> Prompt:
+        """按token预算组装提示词"""
+        prompt = self.prompt_builder.build(state, user_question, context_info)
+        logger.debug("提示词组装完成", extra={"prompt_tokens": prompt.token_count, "budget": self.prompt_builder.max_tokens})
+        logs.log_payload(logger, "提示词", prompt.messages[-1].content)
+        return prompt
     
     async def generate_response(self, state: ConversationState, user_question: str, context_info: List[str] = None) -> str:
         """生成回答"""
-        # 构建上下文信息
-        context_parts = []
-        
-        # 添加自定义上下文信息
-        if context_info:
-            context_parts.extend(context_info)
-        
-        # 添加知识库搜索结果
-        if state.knowledge_base_results:
-            context_parts.append("相关知识点：")
-            for i, result in enumerate(state.knowledge_base_results[:3], 1):
-                context_parts.append(f"{i}. 问题：{result['question']}")
-                context_parts.append(f"   答案：{result['answer']}")
-        
-        # 添加构建错误信息
-        if state.build_errors:
-            context_parts.append(f"构建错误关键字：{', '.join(state.build_errors)}")
-        
-        # 添加对话历史
-        if state.messages:
-            context_parts.append("对话历史：")
-            context_parts.append(state.get_context())
-        
-        context = "\n".join(context_parts)
-        
-        prompt = f"""系统提示：{self.system_prompt}
-
-上下文信息：
-{context}
-
-用户问题：{user_question}
-
-请基于以上信息，为用户提供专业、准确的回答："""
-        
-        print(f"发送给LLM的提示词: {prompt[:200]}...")
-        print(f"提示词总长度: {len(prompt)} 字符")
+        prompt = self.build_prompt(state, user_question, context_info)
+        cache_key = self.answer_cache_key(state, user_question, prompt) if self.answer_cache else None
+        if cache_key:
+            cached_answer = await self.answer_cache.get(cache_key)
+            if cached_answer is not None:
+                logger.info("命中回答缓存")
+                return cached_answer
         
+        start = time.perf_counter()
         try:
-            response = await self.llm.ainvoke([
-                SystemMessage(content=self.system_prompt),
-                HumanMessage(content=f"上下文信息：\n{context}\n\n用户问题：{user_question}")
-            ])
+            response = await self.coalescer.invoke(self.llm, prompt.messages)
+            metrics.LLM_LATENCY.labels("LLMService", "invoke").observe(time.perf_counter() - start)
             
-            print(f"LLM原始响应: {response}")
-            print(f"LLM响应内容: {response.content}")
-            print(f"LLM响应类型: {type(response)}")
+            logs.log_payload(logger, "LLM响应", response)
             
+            if cache_key and response.content:
+                await self.answer_cache.set(cache_key, response.content)
             return response.content
             
+        except asyncio.CancelledError:
+            # 合并的调用在所有调用方都取消后才取消上游请求
+            metrics.LLM_CANCELLED.labels("LLMService", "invoke").inc()
+            raise
         except Exception as e:
-            print(f"LLM调用失败: {e}")
-            print(f"错误类型: {type(e)}")
-            print(f"错误详情: {str(e)}")
+            logger.error("LLM调用失败: %s: %s", type(e).__name__, e)
+            metrics.LLM_ERRORS.labels("LLMService").inc()
             return "抱歉，我暂时无法回答您的问题，请稍后再试。"
     
-    async def generate_streaming_response(self, state: ConversationState, user_question: str) -> AsyncGenerator[str, None]:
-        """生成流式回答"""
-        context = self.format_context(state)
+    async def generate_streaming_response(self, state: ConversationState, user_question: str, context_info: List[str] = None) -> AsyncGenerator[str, None]:
+        """生成流式回答，逐个返回LLM生成的token"""
+        prompt = self.build_prompt(state, user_question, context_info)
+        cache_key = self.answer_cache_key(state, user_question, prompt) if self.answer_cache else None
+        if cache_key:
+            cached_answer = await self.answer_cache.get(cache_key)
+            if cached_answer is not None:
+                logger.info("命中回答缓存")
+                for i in range(0, len(cached_answer), CACHED_ANSWER_CHUNK_SIZE):
+                    yield cached_answer[i:i + CACHED_ANSWER_CHUNK_SIZE]
+                return
+        
+        response_parts = []
+        start = time.perf_counter()
         
         try:
-            async for chunk in self.llm.astream([
-                SystemMessage(content=self.system_prompt),
-                HumanMessage(content=f"上下文信息：\n{context}\n\n用户问题：{user_question}")
-            ]):
-                if chunk.content:
-                    yield chunk.content
+            async for token in self.coalescer.stream(self.llm, prompt.messages):
+                if not response_parts:
+                    metrics.LLM_FIRST_TOKEN.labels("LLMService").observe(time.perf_counter() - start)
+                response_parts.append(token)
+                yield token
                     
+        except (asyncio.CancelledError, GeneratorExit):
+            metrics.LLM_CANCELLED.labels("LLMService", "stream").inc()
+            raise
         except Exception as e:
-            print(f"流式LLM调用失败: {e}")
+            logger.error("流式LLM调用失败: %s: %s", type(e).__name__, e)
+            metrics.LLM_ERRORS.labels("LLMService").inc()
             yield "抱歉，我暂时无法回答您的问题，请稍后再试。"
+            return
+        metrics.LLM_LATENCY.labels("LLMService", "stream").observe(time.perf_counter() - start)
+        
+        # 只缓存完整生成的回答
+        if cache_key and response_parts:
+            await self.answer_cache.set(cache_key, "".join(response_parts))
     
     async def generate_build_log_request(self) -> str:
         """生成请求流水线实例ID的消息"""
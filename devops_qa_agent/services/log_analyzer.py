@@ -0,0 +1,209 @@
+"""
+构建日志分析
+"""
+import codecs
+import re
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import aiofiles
+
+# 内置的错误特征：(错误关键字, 正则, 触发词)
+# 触发词为小写字面量，正则能匹配的行一定包含其中之一，用于在整块文本中快速定位候选行
+DEFAULT_SIGNATURES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    # javac / Maven / Gradle
+    ("Compilation error", r"\.java:\d+: error:|\[ERROR\] COMPILATION ERROR|compilation failed",
+     (": error:", "compilation")),
+    ("cannot find symbol", r"error: cannot find symbol", ("cannot find",)),
+    ("BUILD FAILURE", r"\bBUILD FAILURE\b", ("build failure",)),
+    ("Failed to execute goal", r"\[ERROR\] Failed to execute goal", ("failed to execute",)),
+    ("Could not resolve dependencies", r"Could not resolve dependencies|Could not find artifact", ("could not",)),
+    ("Gradle build failed", r"FAILURE: Build failed with an exception", ("build failed",)),
+    # npm / yarn / pnpm
+    ("npm ERR!", r"\bnpm ERR!|npm error ", ("npm err",)),
+    ("Module not found", r"Module not found|Cannot find module", ("not found", "cannot find")),
+    # pip / Python
+    ("No matching distribution", r"No matching distribution found|Could not find a version that satisfies",
+     ("no matching distribution", "could not")),
+    ("ModuleNotFoundError", r"\bModuleNotFoundError\b|\bImportError\b", ("modulenotfound", "importerror")),
+    ("Traceback", r"^Traceback \(most recent call last\)", ("traceback",)),
+    # Docker
+    ("Docker build error", r"failed to solve|returned a non-zero code|executor failed running",
+     ("failed to solve", "non-zero code", "executor failed")),
+    ("Image pull error", r"pull access denied|manifest unknown|ErrImagePull|ImagePullBackOff",
+     ("pull access denied", "manifest unknown", "imagepull")),
+    # 内存
+    ("OutOfMemoryError", r"OutOfMemoryError|JavaScript heap out of memory|Cannot allocate memory", ("memory",)),
+    ("Killed (exit code 137)", r"exit code 137|\bOOMKilled\b|^Killed$", ("exit code", "killed")),
+    # 超时
+    ("Timeout", r"\btimed out\b|\bTimeoutException\b|deadline exceeded", ("timed out", "timeout", "deadline exceeded")),
+    # 通用
+    ("Permission denied", r"Permission denied", ("permission denied",)),
+    ("Test failure", r"Tests? failed|There are test failures", ("test failed", "tests failed", "test failures")),
+    ("Exit code", r"exit (?:code|status) [1-9]\d*", ("exit code", "exit status")),
+]
+
+
+# 每次读取的字节数
+CHUNK_SIZE = 1024 * 1024
+# 单行跨数据块累积的最大字符数，保证内存上限（超长行的处理见analyze_stream）
+MAX_LINE_LENGTH = 64 * 1024
+# 每个错误关键字最多记录的行号数
+MAX_LINES_PER_ERROR = 20
+
+
+class LogAnalysis:
+    """一次日志分析的结果"""
+    
+    def __init__(self):
+        # 错误关键字 -> {"count": 出现次数, "lines": 前若干个行号}，按首次出现排序
+        self.matches: Dict[str, Dict[str, Any]] = {}
+        self.lines_scanned = 0
+        self.bytes_scanned = 0
+    
+    @property
+    def errors(self) -> List[str]:
+        """去重后的错误关键字"""
+        return list(self.matches)
+    
+    def record(self, error: str, line_number: int):
+        match = self.matches.get(error)
+        if match is None:
+            match = self.matches[error] = {"count": 0, "lines": []}
+        match["count"] += 1
+        if len(match["lines"]) < MAX_LINES_PER_ERROR and (not match["lines"] or match["lines"][-1] != line_number):
+            match["lines"].append(line_number)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "errors": self.errors,
+            "matches": self.matches,
+            "lines_scanned": self.lines_scanned,
+            "bytes_scanned": self.bytes_scanned
+        }
+
+
+class LogAnalyzer:
+    """流式构建日志错误提取器
+
+    错误特征预编译为正则，并合并为一个正则用于快速排除不相关的行；
+    日志按块读取，只保留未结束的最后一行，内存占用与日志大小无关。
+    """
+    
+    def __init__(self, signatures: Iterable[Tuple[str, str, Tuple[str, ...]]] = None, keywords: Iterable[str] = ()):
+        signatures = list(DEFAULT_SIGNATURES if signatures is None else signatures)
+        # 知识库中的构建错误关键字按字面匹配，命中时返回关键字本身，便于之后检索知识库
+        known = {error.lower() for error, _, _ in signatures}
+        for keyword in keywords:
+            if keyword and keyword.lower() not in known:
+                known.add(keyword.lower())
+                signatures.append((keyword, re.escape(keyword), (keyword.lower(),)))
+        
+        self.labels = [error for error, _, _ in signatures]
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for _, pattern, _ in signatures]
+        self.pattern = re.compile("|".join(f"(?:{pattern})" for _, pattern, _ in signatures), re.IGNORECASE)
+        # 去掉被更短触发词包含的触发词，每个触发词对整块文本查找一遍
+        triggers = sorted({trigger for _, _, group in signatures for trigger in group}, key=len)
+        self.triggers = [t for i, t in enumerate(triggers) if not any(s in t for s in triggers[:i])]
+    
+    @classmethod
+    def from_knowledge_base(cls, knowledge_base) -> "LogAnalyzer":
+        """用知识库中build_errors的关键字补充错误特征"""
+        keywords = []
+        for entry in knowledge_base.knowledge_data.get("build_errors", []):
+            keywords.extend(entry["keywords"])
+        return cls(keywords=keywords)
+    
+    def scan_text(self, text: str, analysis: LogAnalysis, first_line: int):
+        """扫描若干完整的行，first_line为第一行的行号
+        
+        先用str.find在小写文本中查找触发词得到候选行，再对候选行执行正则。
+        Python的正则对多分支模式逐位置尝试，直接扫描整块文本要慢一个数量级以上。
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # 个别字符转小写后长度变化，位置无法对应，逐行检查
+            for offset, line in enumerate(text.split("\n")):
+                self._match_line(line, analysis, first_line + offset)
+            return
+        
+        line_starts = set()
+        for trigger in self.triggers:
+            index = lowered.find(trigger)
+            while index >= 0:
+                line_starts.add(lowered.rfind("\n", 0, index) + 1)
+                line_end = lowered.find("\n", index)
+                if line_end < 0:
+                    break
+                index = lowered.find(trigger, line_end)
+        
+        line_number = first_line
+        position = 0
+        for line_start in sorted(line_starts):
+            line_number += text.count("\n", position, line_start)
+            position = line_start
+            line_end = text.find("\n", line_start)
+            self._match_line(text[line_start:] if line_end < 0 else text[line_start:line_end], analysis, line_number)
+    
+    def _match_line(self, line: str, analysis: LogAnalysis, line_number: int):
+        """检查单行命中的错误特征
+        
+        合并正则只能找出互不重叠的匹配，命中后再逐个特征检查，同一行可以命中多个特征。
+        """
+        if not self.pattern.search(line):
+            return
+        for label, pattern in zip(self.labels, self.patterns):
+            if pattern.search(line):
+                analysis.record(label, line_number)
+    
+    async def analyze_stream(self, chunks: AsyncIterator[bytes], encoding: str = "utf-8") -> LogAnalysis:
+        """分析异步字节流
+        
+        超过MAX_LINE_LENGTH的行不整行累积：分析的是该行开头的MAX_LINE_LENGTH个字符，
+        加上该行在结束它的那个数据块中的部分，中间数据块里的内容不参与匹配。
+        """
+        analysis = LogAnalysis()
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pending = ""
+        line_number = 1
+        
+        async for chunk in chunks:
+            analysis.bytes_scanned += len(chunk)
+            text = pending + decoder.decode(chunk)
+            end = text.rfind("\n")
+            if end < 0:
+                # 超长的行不再累积，只保留开头部分，行结束时再拼上最后一个数据块中的部分
+                pending = text[:MAX_LINE_LENGTH]
+                continue
+            
+            complete = text[:end]
+            self.scan_text(complete, analysis, line_number)
+            line_number += complete.count("\n") + 1
+            pending = text[end + 1:end + 1 + MAX_LINE_LENGTH]
+        
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            self.scan_text(pending, analysis, line_number)
+        else:
+            line_number -= 1
+        analysis.lines_scanned = line_number
+        return analysis
+    
+    async def analyze_file(self, path: str, chunk_size: int = CHUNK_SIZE) -> LogAnalysis:
+        """分析本地日志文件"""
+        async def read_chunks():
+            async with aiofiles.open(path, "rb") as f:
+                while True:
+                    chunk = await f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        
+        return await self.analyze_stream(read_chunks())
+    
+    def analyze_text(self, text: str) -> LogAnalysis:
+        """分析已经在内存中的日志文本"""
+        analysis = LogAnalysis()
+        analysis.bytes_scanned = len(text.encode("utf-8"))
+        self.scan_text(text, analysis, 1)
+        analysis.lines_scanned = text.count("\n") + (0 if text.endswith("\n") or not text else 1)
+        return analysis
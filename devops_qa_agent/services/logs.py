@@ -0,0 +1,186 @@
+"""
+结构化日志
+
+日志记录在事件循环线程中只合并消息参数并放入有界队列，格式化和写入由后台线程完成，输出慢时不会阻塞事件循环；
+队列满时丢弃记录并计数。每条记录自动带上当前的session_id和图节点名。
+提示词、回答等大段内容只在DEBUG级别按采样率输出，并截断到固定长度。
+"""
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime
+from typing import Any, Optional
+
+from ..config import config
+
+# 当前请求的会话ID和正在执行的图节点，由ChatAgent设置，在节点任务中自动继承
+session_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("session_id", default=None)
+node_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("node", default=None)
+
+# 包内日志的根记录器，各模块使用 logging.getLogger(__name__)
+ROOT_LOGGER = "devops_qa_agent"
+
+# 记录中的标准属性，其余属性作为结构化字段输出
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+class ContextFilter(logging.Filter):
+    """为记录补充session_id和node字段"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "session_id"):
+            record.session_id = session_id_var.get()
+        if not hasattr(record, "node"):
+            record.node = node_var.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """入队前只合并消息参数，格式化留给后台线程；队列满时丢弃记录而不是阻塞或报错"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 参数可能是可变对象，入队前先合并为字符串；结构化字段保留在记录上
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行JSON"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """便于本地查看的单行文本格式，结构化字段附在消息后面"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        extra = " ".join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES and value is not None
+        )
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if extra:
+            line += f" [{extra}]"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+def setup_logging(level: str = None, fmt: str = None, queue_size: int = None):
+    """配置包内日志：QueueHandler在调用方线程入队，QueueListener在后台线程写stdout
+
+    重复调用时先停止之前的后台线程并移除之前的处理器。
+    """
+    global _listener, _queue_handler
+    shutdown_logging()
+    
+    level = (level or config.LOG_LEVEL).upper()
+    fmt = fmt or config.LOG_FORMAT
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size or config.LOG_QUEUE_SIZE)
+    
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(ContextFilter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.addHandler(_queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def shutdown_logging():
+    """停止后台线程并移除队列处理器，队列中已有的记录会先写完"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    logger = logging.getLogger(ROOT_LOGGER)
+    for handler in list(logger.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            logger.removeHandler(handler)
+    logger.propagate = True
+
+
+def dropped_records() -> int:
+    """因队列满被丢弃的记录数"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def truncate(value: Any, limit: int = None) -> str:
+    """将大段内容转为字符串并截断，附上原始长度"""
+    text = value if isinstance(value, str) else str(value)
+    limit = config.LOG_PAYLOAD_MAX_CHARS if limit is None else limit
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…（共{len(text)}字符）"
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, **fields):
+    """在DEBUG级别按采样率输出大段内容，未开启DEBUG时不做任何格式化"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if config.LOG_PAYLOAD_SAMPLE_RATE < 1 and random.random() >= config.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    logger.debug(message, extra={**fields, "payload": truncate(payload)})
+
+
+def with_node(name: str):
+    """在节点执行期间设置node上下文的装饰器"""
+    logger = logging.getLogger(f"{ROOT_LOGGER}.graph")
+    
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = node_var.set(name)
+            logger.debug("节点开始")
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                logger.debug("节点结束")
+                node_var.reset(token)
+        return wrapper
+    
+    return decorator
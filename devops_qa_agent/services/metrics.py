@@ -0,0 +1,318 @@
+"""
+运行指标，按Prometheus文本格式输出
+"""
+import functools
+import math
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 默认的延迟分桶（秒），覆盖本地检索的毫秒级到LLM生成的数十秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类，按标签值缓存子指标
+
+    记录都发生在事件循环线程中，子指标只做普通的加法，不加锁；
+    labels()在首次出现的标签组合上创建子指标，之后只是一次字典查找。
+    """
+    
+    type_name = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+    
+    def labels(self, *values: str):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    @property
+    def sample_name(self) -> str:
+        """样本使用的名称，计数器带_total后缀；HELP和TYPE行使用同一名称"""
+        return f"{self.name}_total" if self.type_name == "counter" else self.name
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.sample_name} {self.documentation}",
+            f"# TYPE {self.sample_name} {self.type_name}",
+            *self.samples()
+        ]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0.0
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def samples(self) -> List[str]:
+        return [
+            f"{self.sample_name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in list(self._children.items())
+        ]
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0.0
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+    
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+    
+    def set(self, value: float):
+        self.value = value
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+    
+    def _new_child(self):
+        return _GaugeChild()
+    
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in list(self._children.items())
+        ]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # 每个分桶单独计数（不累加），输出时再累加，记录时只需一次二分查找
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), list(child.counts)):
+                cumulative += count
+                le = 'le="+Inf"' if math.isinf(bound) else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackGauge(_Metric):
+    """输出时才调用函数取值的指标，用于缓存命中率、会话数等已有统计，不在请求路径上做任何记录
+
+    函数返回 {标签值元组: 数值}；同名指标只保留最后设置的函数。
+    """
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), type_name: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.type_name = type_name
+        self.function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+    
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.function = function
+    
+    def samples(self) -> List[str]:
+        if self.function is None:
+            return []
+        return [
+            f"{self.sample_name}{_format_labels(self.labelnames, tuple(str(v) for v in key))} {_format_value(value)}"
+            for key, value in self.function().items()
+            if value is not None
+        ]
+
+
+class Registry:
+    """指标注册表"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+    
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标已注册: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+    
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+    
+    def callback(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 type_name: str = "gauge") -> CallbackGauge:
+        return self.register(CallbackGauge(name, documentation, labelnames, type_name))
+    
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # 某个统计函数出错不影响其他指标的输出
+                lines.append(f"# {metric.name} 采集失败: {_escape(str(e))}")
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram: Histogram, *label_values: str):
+    """记录异步函数耗时的装饰器，异常时同样记录"""
+    child = histogram.labels(*label_values)
+    
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    
+    return decorator
+
+
+REGISTRY = Registry()
+
+NODE_LATENCY = REGISTRY.histogram(
+    "devops_qa_graph_node_seconds", "对话图各节点的执行耗时", ["node"]
+)
+LLM_LATENCY = REGISTRY.histogram(
+    "devops_qa_llm_call_seconds", "LLM调用耗时，流式调用计到最后一个token", ["caller", "mode"]
+)
+LLM_ERRORS = REGISTRY.counter(
+    "devops_qa_llm_errors", "LLM调用失败次数", ["caller"]
+)
+LLM_FIRST_TOKEN = REGISTRY.histogram(
+    "devops_qa_llm_first_token_seconds", "流式LLM调用的首token耗时", ["caller"]
+)
+BUILD_LOG_LATENCY = REGISTRY.histogram(
+    "devops_qa_build_log_call_seconds", "BuildLogService调用耗时（含缓存命中）", ["operation", "outcome"]
+)
+FIRST_CHUNK_LATENCY = REGISTRY.histogram(
+    "devops_qa_first_chunk_seconds", "从收到请求到发出第一个数据块的耗时", ["endpoint"]
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "devops_qa_in_flight_requests", "正在处理的请求数", ["endpoint"]
+)
+STREAMS_CANCELLED = REGISTRY.counter(
+    "devops_qa_cancelled_streams", "客户端中途断开、未输出完的流式响应数", ["endpoint"]
+)
+LLM_CANCELLED = REGISTRY.counter(
+    "devops_qa_llm_cancelled_calls", "调用方被取消（客户端断开）时未完成的LLM调用次数", ["caller", "mode"]
+)
+CACHE_HITS = REGISTRY.callback(
+    "devops_qa_cache_hits", "缓存命中次数", ["cache"], type_name="counter"
+)
+CACHE_MISSES = REGISTRY.callback(
+    "devops_qa_cache_misses", "缓存未命中次数", ["cache"], type_name="counter"
+)
+CACHE_HIT_RATIO = REGISTRY.callback(
+    "devops_qa_cache_hit_ratio", "缓存命中率", ["cache"]
+)
+CHECKPOINT_SESSIONS = REGISTRY.callback(
+    "devops_qa_checkpoint_sessions", "检查点存储中的会话数"
+)
+CHECKPOINT_BYTES = REGISTRY.callback(
+    "devops_qa_checkpoint_bytes", "检查点存储占用的字节数"
+)
+LOG_DROPPED = REGISTRY.callback(
+    "devops_qa_log_dropped_records", "日志队列满时丢弃的记录数", type_name="counter"
+)
+BUILD_LOG_IN_FLIGHT = REGISTRY.callback(
+    "devops_qa_build_log_in_flight_requests", "正在进行的构建日志API请求数"
+)
+INTENT_DECISIONS = REGISTRY.callback(
+    "devops_qa_intent_decisions", "意图识别各层级做出决策的次数", ["tier"], type_name="counter"
+)
+BUILD_LOG_BACKEND_CALLS = REGISTRY.callback(
+    "devops_qa_build_log_backend_calls", "实际发给构建日志API的查询次数（相同查询合并后）", type_name="counter"
+)
+BUILD_LOG_COALESCED = REGISTRY.callback(
+    "devops_qa_build_log_coalesced_calls", "合并到进行中的相同查询、未单独请求构建日志API的次数", type_name="counter"
+)
+BUILD_LOG_SPECULATIONS = REGISTRY.callback(
+    "devops_qa_build_log_speculations", "与意图识别并行提前查询构建日志的结果", ["outcome"], type_name="counter"
+)
+LLM_COALESCED = REGISTRY.callback(
+    "devops_qa_llm_coalesced_calls", "合并到进行中的相同调用、未单独请求上游的LLM调用次数", ["caller", "mode"], type_name="counter"
+)
+LLM_POOL_CONNECTIONS = REGISTRY.callback(
+    "devops_qa_llm_pool_connections", "LLM连接池中的连接数", ["state"]
+)
+LLM_IN_FLIGHT = REGISTRY.callback(
+    "devops_qa_llm_in_flight_requests", "正在进行的LLM HTTP请求数（流式响应读完才结束）"
+)
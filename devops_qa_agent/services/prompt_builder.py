@@ -0,0 +1,186 @@
+"""
+提示词组装
+"""
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
+
+from ..models import ConversationState, Message, MessageRole
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+CONTEXT_HEADER = "上下文信息："
+KNOWLEDGE_HEADER = "相关知识点："
+SUMMARY_HEADER = "更早的对话摘要："
+HISTORY_HEADER = "对话历史："
+
+# 知识答案截断后至少保留的token数
+MIN_ANSWER_TOKENS = 50
+# 摘要中每条历史消息保留的最大字符数
+SUMMARY_LINE_CHARS = 80
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数
+
+    中文字符（含全角标点）按每个字符1个token计算，其余字符按每4个字符1个token计算，
+    对Qwen等模型的分词结果偏保守，不需要加载分词器。
+    """
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """将文本截断到不超过max_tokens个token"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) + 1 <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…" if low else ""
+
+
+class Prompt:
+    """组装好的提示词"""
+    
+    def __init__(self, messages: List[BaseMessage], token_count: int, entry_ids: List[str], history: str = ""):
+        self.messages = messages
+        # 估算的输入token数
+        self.token_count = token_count
+        # 实际放入提示词的知识条目ID和对话历史（含摘要），用于计算回答缓存键
+        self.entry_ids = entry_ids
+        self.history = history
+
+
+class PromptBuilder:
+    """按token预算组装提示词
+
+    每部分内容只放入一次，按优先级依次填充：用户问题、构建错误、知识条目、对话历史。
+    对话历史只保留最近若干条原文，更早的消息压缩为滚动摘要保存在会话状态中。
+    """
+    
+    def __init__(self, system_prompt: str, max_tokens: int = 3000, top_k: int = 3,
+                 recent_messages: int = 6, summary_max_tokens: int = 400):
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.recent_messages = recent_messages
+        self.summary_max_tokens = summary_max_tokens
+    
+    def update_summary(self, state: ConversationState):
+        """将超出最近窗口的历史消息并入滚动摘要
+
+        当前用户消息不计入历史；摘要超过上限时丢弃最早的内容。
+        """
+        history = self._unsummarized(state)[:-1]
+        overflow = history[:max(len(history) - self.recent_messages, 0)]
+        if not overflow:
+            return
+        
+        lines = [state.history_summary] if state.history_summary else []
+        for msg in overflow:
+            content = WHITESPACE_PATTERN.sub(" ", msg.content).strip()
+            if len(content) > SUMMARY_LINE_CHARS:
+                content = content[:SUMMARY_LINE_CHARS] + "…"
+            lines.append(f"{msg.role.value}: {content}")
+        
+        summary = "\n".join(lines)
+        while estimate_tokens(summary) > self.summary_max_tokens and "\n" in summary:
+            summary = summary.split("\n", 1)[1]
+        state.history_summary = truncate_to_tokens(summary, self.summary_max_tokens)
+        state.history_summary_until = overflow[-1].timestamp
+    
+    def build(self, state: ConversationState, user_question: str, context_info: List[str] = None) -> Prompt:
+        """组装发送给LLM的消息列表"""
+        # 各部分单独估算后相加不会少于整体估算，标题和换行也计入预算
+        budget = self.max_tokens - estimate_tokens(self.system_prompt) - estimate_tokens(CONTEXT_HEADER) - 2
+        sections = []
+        
+        # 1. 用户问题：始终保留
+        question = f"用户问题：{user_question}"
+        current = state.messages[-1] if state.messages else None
+        if current is not None and current.role == MessageRole.USER and current.content != user_question:
+            question = f"用户消息：{current.content}\n{question}"
+        question = truncate_to_tokens(question, max(budget // 2, 1))
+        budget -= estimate_tokens(question)
+        
+        # 2. 构建错误和调用方补充的上下文
+        extra = []
+        if state.build_errors:
+            extra.append(f"构建错误关键字：{', '.join(state.build_errors)}")
+        if context_info:
+            extra.extend(part for part in context_info if part)
+        for part in extra:
+            part = truncate_to_tokens(part, budget)
+            if part:
+                sections.append(part)
+                budget -= estimate_tokens(part) + 1
+        
+        # 3. 知识条目：按排序依次放入，放不下的答案截断
+        entry_ids = []
+        knowledge = []
+        budget -= estimate_tokens(KNOWLEDGE_HEADER) + 1
+        for i, result in enumerate(state.knowledge_base_results[:self.top_k], 1):
+            header = f"{i}. 问题：{result['question']}\n   答案："
+            remaining = budget - estimate_tokens(header) - 1
+            # 剩余预算只够放入很短的片段时不再放入
+            if remaining < min(MIN_ANSWER_TOKENS, estimate_tokens(result["answer"])):
+                break
+            answer = truncate_to_tokens(result["answer"], remaining)
+            knowledge.append(header + answer)
+            entry_ids.append(result.get("id") or result["question"])
+            budget -= estimate_tokens(header + answer) + 1
+        if knowledge:
+            sections.append(KNOWLEDGE_HEADER + "\n" + "\n".join(knowledge))
+        else:
+            budget += estimate_tokens(KNOWLEDGE_HEADER) + 1
+        
+        # 4. 对话历史：从最近的消息往前放，放得下时再加上摘要
+        history = []
+        recent = []
+        budget -= estimate_tokens(HISTORY_HEADER) + 1
+        for msg in reversed(self._unsummarized(state)[:-1][-self.recent_messages:]):
+            line = f"{msg.role.value}: {msg.content}"
+            cost = estimate_tokens(line) + 1
+            if cost > budget:
+                break
+            recent.append(line)
+            budget -= cost
+        summary_cost = estimate_tokens(SUMMARY_HEADER) + estimate_tokens(state.history_summary) + 2
+        if state.history_summary and summary_cost <= budget:
+            history.append(SUMMARY_HEADER + "\n" + state.history_summary)
+            budget -= summary_cost
+        if recent:
+            history.append(HISTORY_HEADER + "\n" + "\n".join(reversed(recent)))
+        sections.extend(history)
+        
+        context = "\n".join(sections)
+        content = f"{CONTEXT_HEADER}\n{context}\n\n{question}" if context else question
+        messages = [
+            SystemMessage(content=self.system_prompt),
+            HumanMessage(content=content)
+        ]
+        token_count = estimate_tokens(self.system_prompt) + estimate_tokens(content)
+        return Prompt(messages, token_count, entry_ids, "\n".join(history))
+    
+    @staticmethod
+    def _unsummarized(state: ConversationState) -> List[Message]:
+        """返回尚未并入摘要的消息（包含当前用户消息）"""
+        until: Optional[datetime] = state.history_summary_until
+        if until is None:
+            return state.messages
+        # 消息按时间先后排列，从最新的消息往前找到摘要截止的位置，只为未并入摘要的消息构造datetime
+        messages = state.messages
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].timestamp <= until:
+                return messages[index + 1:]
+        return messages
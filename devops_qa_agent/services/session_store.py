@@ -0,0 +1,247 @@
+"""
+会话持久化存储
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..models import Message
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT '{}',
+    message_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS messages_message_id ON messages (session_id, message_id);
+"""
+
+# 写入线程的停止信号
+_STOP = object()
+# 数据库被其他进程锁定（超过busy_timeout）时的重试间隔（秒），按次数递增
+BUSY_RETRY_DELAY = 0.5
+
+
+def _is_busy(error: sqlite3.Error) -> bool:
+    """是否为数据库被其他连接锁定导致的错误"""
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(error)
+
+
+class SessionStore:
+    """基于SQLite（WAL模式）的会话存储
+
+    消息按行追加写入，不会重写历史消息；会话的标量字段单独保存为一行JSON。
+    写操作放入队列，由后台线程批量提交，不阻塞事件循环和流式输出；
+    数据库被锁定时重试，整批提交失败时逐个重新提交，单个操作失败不影响同批中其他会话的写入。
+    读操作为同步调用，在事件循环中使用时应放到线程池执行。
+    """
+    
+    def __init__(self, path: str, batch_size: int = 200, busy_retries: int = 3):
+        self.path = path
+        self.batch_size = batch_size
+        self.busy_retries = busy_retries
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        self._write_conn = self._connect()
+        self._write_conn.executescript(SCHEMA)
+        self._read_conn = self._connect()
+        self._read_lock = threading.Lock()
+        
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="session-store-writer", daemon=True)
+        self._writer.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    # ---------------- 写操作（异步批量提交） ----------------
+    
+    def append_messages(self, session_id: str, messages: List[Message], state: Dict[str, Any] = None):
+        """追加新消息并更新会话的标量字段"""
+        rows = [
+            (msg.id, msg.role.value, msg.content, msg.timestamp.isoformat() if msg.timestamp else None)
+            for msg in messages
+        ]
+        self._queue.put(("append", session_id, rows, json.dumps(state or {}, ensure_ascii=False)))
+    
+    def delete_session(self, session_id: str):
+        self._queue.put(("delete", session_id, None, None))
+    
+    def flush(self):
+        """等待队列中的写操作全部提交"""
+        self._queue.join()
+    
+    def close(self):
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._write_conn.close()
+        with self._read_lock:
+            self._read_conn.close()
+    
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = any(item is _STOP for item in batch)
+            operations = [item for item in batch if item is not _STOP]
+            try:
+                if operations:
+                    self._write(operations)
+            except Exception:
+                # 写入线程退出后flush会一直阻塞，任何异常都只记录
+                logger.exception("会话存储写入失败")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+    
+    def _write(self, operations: List[Tuple]):
+        """提交一批写操作；整批失败时逐个重新提交，只丢弃失败的操作"""
+        try:
+            self._commit(operations)
+            return
+        except Exception as e:
+            if len(operations) > 1:
+                logger.warning("会话存储批量写入失败，逐个重新提交: %s", e, extra={"operations": len(operations)})
+            else:
+                logger.error("会话存储写入失败，丢弃该操作: %s", e,
+                             extra={"session_id": operations[0][1], "action": operations[0][0]})
+                return
+        
+        for operation in operations:
+            try:
+                self._commit([operation])
+            except Exception as e:
+                logger.error("会话存储写入失败，丢弃该操作: %s", e,
+                             extra={"session_id": operation[1], "action": operation[0]})
+    
+    def _commit(self, operations: List[Tuple]):
+        """在一个事务中提交写操作，数据库被其他进程锁定时等待后重试"""
+        for attempt in range(self.busy_retries + 1):
+            try:
+                self._apply(operations)
+                return
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == self.busy_retries:
+                    raise
+                logger.warning("会话存储被锁定，稍后重试: %s", e, extra={"attempt": attempt + 1})
+                time.sleep(BUSY_RETRY_DELAY * (attempt + 1))
+    
+    def _apply(self, operations: List[Tuple]):
+        """在一个事务中提交一批写操作"""
+        conn = self._write_conn
+        now = time.time()
+        # 先取得写锁再读取消息数，多个进程同时写入同一会话时不会分配相同的序号
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for action, session_id, rows, state in operations:
+                if action == "delete":
+                    conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                    conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    continue
+                
+                conn.execute(
+                    "INSERT INTO sessions (session_id, state, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    (session_id, state, now, now)
+                )
+                next_seq = conn.execute(
+                    "SELECT message_count FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                inserted = 0
+                for message_id, role, content, timestamp in rows:
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO messages (session_id, seq, message_id, role, content, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (session_id, next_seq + inserted, message_id, role, content, timestamp)
+                    )
+                    inserted += cursor.rowcount
+                if inserted:
+                    conn.execute(
+                        "UPDATE sessions SET message_count = message_count + ? WHERE session_id = ?",
+                        (inserted, session_id)
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    
+    # ---------------- 读操作 ----------------
+    
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """获取会话的标量字段和消息数"""
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT state, message_count, created_at, updated_at FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "state": json.loads(row[0]),
+            "message_count": row[1],
+            "created_at": row[2],
+            "updated_at": row[3]
+        }
+    
+    def get_messages(self, session_id: str, before: int = None, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """按游标分页获取消息
+
+        返回序号小于before的最近limit条消息（按时间正序）以及下一页的游标，
+        没有更早的消息时游标为None。
+        """
+        if before is None:
+            sql = ("SELECT seq, message_id, role, content, timestamp FROM messages "
+                   "WHERE session_id = ? ORDER BY seq DESC LIMIT ?")
+            params = (session_id, limit + 1)
+        else:
+            sql = ("SELECT seq, message_id, role, content, timestamp FROM messages "
+                   "WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?")
+            params = (session_id, before, limit + 1)
+        
+        with self._read_lock:
+            rows = self._read_conn.execute(sql, params).fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        messages = [
+            {"seq": seq, "id": message_id, "role": role, "content": content, "timestamp": timestamp}
+            for seq, message_id, role, content, timestamp in rows
+        ]
+        next_cursor = rows[0][0] if has_more and rows else None
+        return messages, next_cursor
@@ -146,13 +146,16 @@ class ChatApp {
                 // 处理流式响应
                 const reader = response.body.getReader();
                 const decoder = new TextDecoder();
+                // 帧内容为UTF-8原文，一次读取可能在多字节字符或一行的中间结束，未读完的部分留到下一次
+                let buffer = '';
                 
                 while (true) {
                     const { done, value } = await reader.read();
                     if (done) break;
                     
-                    const chunk = decoder.decode(value);
-                    const lines = chunk.split('\n');
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop();
                     
                     for (const line of lines) {
                         if (line.startsWith('data: ')) {
@@ -0,0 +1,153 @@
+"""
+构建日志服务测试
+"""
+import asyncio
+
+from aiohttp import web
+
+from devops_qa_agent.config import config
+from devops_qa_agent.services.build_log_service import BuildLogService
+
+
+async def start_server(handler):
+    app = web.Application()
+    app.router.add_route("*", "/api/build-log{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/api/build-log"
+
+
+def test_shared_session_retries_and_limits_concurrency(monkeypatch):
+    monkeypatch.setattr(config, "BUILD_LOG_MOCK", False)
+    monkeypatch.setattr(config, "BUILD_LOG_MAX_CONCURRENCY", 4)
+    monkeypatch.setattr(config, "BUILD_LOG_RETRY_BACKOFF", 0.01)
+    calls = {"seen": set(), "in_flight": 0, "max_in_flight": 0, "peers": set()}
+    
+    async def handler(request):
+        inst_id = request.path.rsplit("/", 1)[-1]
+        calls["peers"].add(request.transport.get_extra_info("peername"))
+        # 每个实例的第一次请求返回503，验证重试
+        if inst_id not in calls["seen"]:
+            calls["seen"].add(inst_id)
+            return web.Response(status=503)
+        calls["in_flight"] += 1
+        calls["max_in_flight"] = max(calls["max_in_flight"], calls["in_flight"])
+        await asyncio.sleep(0.02)
+        calls["in_flight"] -= 1
+        return web.json_response({"errors": [inst_id]})
+    
+    async def scenario():
+        runner, url = await start_server(handler)
+        monkeypatch.setattr(config, "BUILD_LOG_API_URL", url)
+        service = BuildLogService()
+        await service.start()
+        try:
+            first = await service.get_build_log_errors_by_inst_id("100")
+            results = await asyncio.gather(*[
+                service.get_build_log_errors_by_inst_id(str(i)) for i in range(1, 20)
+            ])
+            return first, results, service.get_stats()
+        finally:
+            await service.close()
+            await runner.cleanup()
+    
+    first, results, stats = asyncio.run(scenario())
+    assert first == ["100"]
+    assert results == [[str(i)] for i in range(1, 20)]
+    assert stats["retries"] == 20 and stats["failures"] == 0
+    assert calls["max_in_flight"] <= 4
+    # 连接复用：连接数不超过并发上限
+    assert len(calls["peers"]) <= 4
+
+
+def test_instance_cache_coalesces_concurrent_queries(monkeypatch):
+    monkeypatch.setattr(config, "BUILD_LOG_MOCK", False)
+    monkeypatch.setattr(config, "BUILD_LOG_RUNNING_TTL", 0)
+    calls = {"count": 0}
+    
+    async def handler(request):
+        calls["count"] += 1
+        await asyncio.sleep(0.05)
+        inst_id = request.path.rsplit("/", 1)[-1]
+        status = "running" if inst_id == "running" else "finished"
+        return web.json_response({"errors": ["BUILD FAILED"], "status": status})
+    
+    async def scenario():
+        runner, url = await start_server(handler)
+        monkeypatch.setattr(config, "BUILD_LOG_API_URL", url)
+        service = BuildLogService()
+        try:
+            results = await asyncio.gather(*[
+                service.get_build_log_errors_by_inst_id("123456") for _ in range(50)
+            ])
+            cached = await service.get_build_log_errors_by_inst_id("123456")
+            # 执行中的实例过期后重新查询
+            await service.get_build_log_errors_by_inst_id("running")
+            await service.get_build_log_errors_by_inst_id("running")
+            return results, cached, service.get_stats()["cache"]
+        finally:
+            await service.close()
+            await runner.cleanup()
+    
+    results, cached, stats = asyncio.run(scenario())
+    assert results == [["BUILD FAILED"]] * 50
+    assert cached == ["BUILD FAILED"]
+    assert calls["count"] == 3
+    assert stats["coalesced"] == 49
+    assert stats["hits"] == 1
+    assert stats["backend_calls"] == 3
+
+
+def test_raw_log_is_analyzed_locally(monkeypatch):
+    monkeypatch.setattr(config, "BUILD_LOG_MOCK", False)
+    monkeypatch.setattr(config, "BUILD_LOG_SOURCE", "raw")
+    monkeypatch.setattr(config, "BUILD_LOG_CHUNK_SIZE", 16)
+    log = "[INFO] start\nnpm ERR! code ELIFECYCLE\nPermission denied\n".encode("utf-8")
+    
+    async def handler(request):
+        assert request.path.endswith("/build-log/42/raw")
+        return web.Response(body=log, headers={"X-Build-Status": "finished"})
+    
+    async def scenario():
+        runner, url = await start_server(handler)
+        monkeypatch.setattr(config, "BUILD_LOG_API_URL", url)
+        service = BuildLogService()
+        try:
+            return await service.get_build_log_errors_by_inst_id("42")
+        finally:
+            await service.close()
+            await runner.cleanup()
+    
+    assert asyncio.run(scenario()) == ["npm ERR!", "Permission denied"]
+
+
+def test_stand_in_server_matches_service_contract(monkeypatch):
+    from benchmarks.build_log_server import BuildLogStandIn
+    
+    monkeypatch.setattr(config, "BUILD_LOG_MOCK", False)
+    stand_in = BuildLogStandIn(latency="fixed:0", errors_per_response=2, log_size_kb=64, chunk_size=4096)
+    
+    async def scenario():
+        runner = web.AppRunner(stand_in.create_app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(config, "BUILD_LOG_API_URL", f"http://127.0.0.1:{port}/api/build-log")
+        service = BuildLogService()
+        try:
+            queried = await service.query_build_errors("https://jenkins.example.com/job/app/1/console")
+            by_id = await service.get_build_log_errors_by_inst_id("7")
+            analysis = await service.analyze_log(f"http://127.0.0.1:{port}/api/build-log/build-log/7/raw")
+            return queried, by_id, analysis
+        finally:
+            await service.close()
+            await runner.cleanup()
+    
+    queried, by_id, analysis = asyncio.run(scenario())
+    assert len(queried) == 2 and len(by_id) == 2
+    assert stand_in.stats["query"] == 1 and stand_in.stats["errors"] == 1 and stand_in.stats["raw"] == 1
+    assert analysis.bytes_scanned == stand_in.stats["raw_bytes"] >= 64 * 1024
@@ -0,0 +1,98 @@
+"""
+缓存测试
+"""
+import asyncio
+
+from devops_qa_agent.services.cache import AnswerCache, SingleFlight, TieredCache, TTLCache, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("构建失败 怎么办？") == normalize_question("构建失败怎么办")
+    assert normalize_question("实例 123456 构建失败!") == normalize_question("实例654321构建失败")
+    assert normalize_question("BUILD  Failed") == "build failed"
+
+
+def test_ttl_cache_evicts_by_size_bytes_and_ttl():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "b" not in cache and "a" in cache and "c" in cache
+    
+    cache = TTLCache(maxsize=10, ttl=60, max_bytes=10, sizeof=len)
+    cache.set("a", "12345")
+    cache.set("b", "123456")
+    assert "a" not in cache and cache.total_bytes == 6
+    
+    cache.set("c", "1", ttl=-1)
+    assert cache.get("c") is None
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_answer_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "answers.db")
+    key = AnswerCache.make_key("Maven 构建失败怎么办？", ["build_errors:1", "build_errors:0"], ["B", "A"])
+    assert key == AnswerCache.make_key("ＭＡＶＥＮ  构建失败怎么办？", ["build_errors:0", "build_errors:1"], ["A", "B"])
+    
+    async def run():
+        cache = AnswerCache(path)
+        await cache.set(key, "检查构建日志")
+        assert await cache.get(key) == "检查构建日志"
+        
+        restarted = AnswerCache(path)
+        assert await restarted.get(key) == "检查构建日志"
+        assert restarted.get_stats()["disk_hits"] == 1
+    
+    asyncio.run(run())
+
+
+def test_disk_hit_keeps_remaining_ttl(tmp_path):
+    path = str(tmp_path / "build_logs.db")
+    
+    async def run():
+        writer = TieredCache(path, ttl=3600)
+        await writer.set("running", {"status": "running"}, ttl=0.2)
+        
+        # 另一个进程从磁盘层读到后，内存层只保留剩余的有效期
+        reader = TieredCache(path, ttl=3600)
+        assert await reader.get("running") == {"status": "running"}
+        await asyncio.sleep(0.3)
+        return await reader.get("running")
+    
+    assert asyncio.run(run()) is None
+
+
+def test_answer_cache_key_keeps_numbers_and_history():
+    # 版本号、退出码不同的问题不能共用回答
+    assert AnswerCache.make_key("python 3.12 构建失败", [], []) != AnswerCache.make_key("python 2.7 构建失败", [], [])
+    assert AnswerCache.make_key("exit code 137", [], []) != AnswerCache.make_key("exit code 1", [], [])
+    # 同样的追问在不同的对话历史下不能共用回答
+    first = AnswerCache.make_key("那第二步呢？", [], [], "对话历史：\nuser: Maven构建失败怎么办")
+    second = AnswerCache.make_key("那第二步呢？", [], [], "对话历史：\nuser: Docker镜像拉取失败怎么办")
+    assert first != second
+
+
+def test_single_flight_survives_waiter_cancellation():
+    flight = SingleFlight()
+    calls = []
+    
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+    
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0.01)
+        # 一个调用方取消不影响另一个调用方拿到结果
+        first.cancel()
+        result = await second
+        return result, len(flight)
+    
+    result, pending = asyncio.run(scenario())
+    assert result == "result"
+    assert calls == [1]
+    assert flight.coalesced == 1
+    assert pending == 0
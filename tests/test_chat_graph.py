@@ -0,0 +1,132 @@
+"""
+对话图并行分支测试
+"""
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+from devops_qa_agent.api.streaming import ClientDisconnected, coalesce
+from devops_qa_agent.config import config
+from devops_qa_agent.models import IntentType
+from devops_qa_agent.services import metrics
+from devops_qa_agent.services.chat_service import ChatAgent
+
+
+def make_agent(monkeypatch, tmp_path) -> ChatAgent:
+    monkeypatch.setattr(config, "SESSION_DB_PATH", str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    agent = ChatAgent()
+    agent.llm_service.llm = GenericFakeChatModel(messages=iter([AIMessage(content="回答")] * 10))
+    
+    async def classify_intent(user_question, cd_inst_id=None):
+        await asyncio.sleep(0.15)
+        return IntentType.BUILD if "构建" in user_question else IntentType.GENERAL
+    
+    async def get_build_log_errors_by_inst_id(cd_inst_id):
+        await asyncio.sleep(0.2)
+        return ["Build error: Module not found"]
+    
+    agent.intent_classifier.classify_intent = classify_intent
+    agent.build_log_service.get_build_log_errors_by_inst_id = get_build_log_errors_by_inst_id
+    return agent
+
+
+def test_build_log_fetch_runs_alongside_intent(monkeypatch, tmp_path):
+    agent = make_agent(monkeypatch, tmp_path)
+    
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await agent.process_message("构建失败了", "s1", cd_inst_id="123456")
+        elapsed = loop.time() - start
+        
+        general = await agent.process_message("如何优化性能", "s2", cd_inst_id="123456")
+        await agent.close()
+        return result, elapsed, general
+    
+    result, elapsed, general = asyncio.run(scenario())
+    assert result["build_errors"] == ["Build error: Module not found"]
+    # 关键路径取决于较慢的日志查询，而不是两者之和
+    assert elapsed < 0.3
+    # 不是构建问题时提前取消日志查询，结果不写入状态
+    assert general["build_errors"] == []
+    assert agent.speculation_stats == {"used": 1, "cancelled": 1, "discarded": 0}
+    output = metrics.REGISTRY.render().splitlines()
+    assert 'devops_qa_build_log_speculations_total{outcome="used"} 1' in output
+    assert 'devops_qa_build_log_speculations_total{outcome="cancelled"} 1' in output
+
+
+def test_session_moves_between_workers(monkeypatch, tmp_path):
+    # 两个ChatAgent共用一个会话存储文件，模拟多进程模式下同一会话的请求落在不同的工作进程
+    monkeypatch.setattr(config, "SHARED_STATE_ENABLED", True)
+    worker_a = make_agent(monkeypatch, tmp_path)
+    worker_b = make_agent(monkeypatch, tmp_path)
+    
+    async def scenario():
+        await worker_a.process_message("第一个问题", "s1")
+        await worker_b.process_message("第二个问题", "s1")
+        # worker_a的本地检查点缺少第二轮，需要从会话存储重新加载
+        result = await worker_a.process_message("第三个问题", "s1")
+        await worker_a.close()
+        await worker_b.close()
+        return result
+    
+    result = asyncio.run(scenario())
+    questions = [message.content for message in result["messages"] if message.role.value == "user"]
+    assert questions == ["第一个问题", "第二个问题", "第三个问题"]
+    assert len(result["messages"]) == 6
+
+
+class SlowChatModel(GenericFakeChatModel):
+    """逐个token慢速输出的模型，记录流是否被取消"""
+    
+    cancelled: bool = False
+    
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        try:
+            for i in range(100):
+                await asyncio.sleep(0.01)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=f"t{i} "))
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def test_disconnect_cancels_turn_and_rolls_back_checkpoint(monkeypatch, tmp_path):
+    agent = make_agent(monkeypatch, tmp_path)
+    
+    async def scenario():
+        await agent.process_message("第一个问题", "s1")
+        slow = SlowChatModel(messages=iter([]))
+        agent.llm_service.llm = slow
+        
+        disconnected = asyncio.get_running_loop().create_future()
+        frames = coalesce(agent.process_streaming_message("第二个问题", "s1"), 0.01, 1024, disconnected)
+        received = []
+        with pytest.raises(ClientDisconnected):
+            async for frame in frames:
+                received.append(frame)
+                if "t3 " in "".join(received):
+                    disconnected.set_result(None)
+        
+        # 上游LLM流在共享流的任务中异步取消，检查点回到本轮之前，没有待执行的节点
+        await asyncio.sleep(0.05)
+        assert slow.cancelled
+        snapshot = await agent.app.aget_state({"configurable": {"thread_id": "s1"}})
+        assert snapshot.next == ()
+        assert [message.content for message in snapshot.values["messages"]] == ["第一个问题", "回答"]
+        
+        agent.llm_service.llm = GenericFakeChatModel(messages=iter([AIMessage(content="回答")] * 10))
+        result = await agent.process_message("第三个问题", "s1")
+        agent.session_store.flush()
+        history = (await agent.get_session_history("s1"))["messages"]
+        await agent.close()
+        return result, history
+    
+    result, history = asyncio.run(scenario())
+    assert [message.content for message in result["messages"]] == ["第一个问题", "回答", "第三个问题", "回答"]
+    # 被取消的一轮没有写入会话存储
+    assert [row["content"] for row in history] == ["第一个问题", "回答", "第三个问题", "回答"]
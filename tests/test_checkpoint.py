@@ -0,0 +1,156 @@
+"""
+会话检查点存储测试
+"""
+import asyncio
+import copy
+from typing import Annotated, List
+
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, StateGraph
+from pydantic import BaseModel
+
+from devops_qa_agent.models import Message, MessageRole, append_messages
+from devops_qa_agent.services.checkpoint import APPEND_LOG_TYPE, BoundedMemorySaver
+
+
+class CounterState(BaseModel):
+    items: List[str] = []
+
+
+async def append_node(state: CounterState) -> CounterState:
+    state.items.append("x")
+    return state
+
+
+class ChatState(BaseModel):
+    messages: Annotated[List[Message], append_messages] = []
+    turns: int = 0
+
+
+async def reply_node(state: ChatState):
+    return {"messages": [Message(role=MessageRole.ASSISTANT, content="回答")], "turns": state.turns + 1}
+
+
+def build_app(saver):
+    workflow = StateGraph(CounterState)
+    workflow.add_node("append", append_node)
+    workflow.set_entry_point("append")
+    workflow.add_edge("append", END)
+    return workflow.compile(checkpointer=saver)
+
+
+def test_bounded_saver_prunes_and_evicts():
+    saver = BoundedMemorySaver(max_sessions=2, max_checkpoints_per_thread=1)
+    app = build_app(saver)
+    
+    async def run(thread_id):
+        config = {"configurable": {"thread_id": thread_id}}
+        snapshot = await saver.aget_tuple(config)
+        items = snapshot.checkpoint["channel_values"]["items"] if snapshot else []
+        return await app.ainvoke(CounterState(items=items), config)
+    
+    async def scenario():
+        for _ in range(3):
+            assert (await run("a"))["items"] == ["x"] * (_ + 1)
+        assert all(len(checkpoints) == 1 for checkpoints in saver.storage["a"].values())
+        
+        await run("b")
+        await run("c")
+        # 会话a最久未访问，被淘汰后按新会话处理
+        assert saver.session_count == 2
+        assert "a" not in saver.storage
+        assert (await run("a"))["items"] == ["x"]
+        assert saver.get_stats()["evicted_sessions"] == 2
+        assert saver.total_bytes == sum(saver._thread_bytes.values())
+    
+    asyncio.run(scenario())
+
+
+def test_messages_checkpoint_stores_only_appended_messages():
+    saver = BoundedMemorySaver()
+    workflow = StateGraph(ChatState)
+    workflow.add_node("reply", reply_node)
+    workflow.set_entry_point("reply")
+    workflow.add_edge("reply", END)
+    app = workflow.compile(checkpointer=saver)
+    config = {"configurable": {"thread_id": "t"}}
+    
+    async def scenario():
+        sent = []
+        sizes = []
+        for turn in range(30):
+            message = Message(role=MessageRole.USER, content=f"问题{turn}" * 20)
+            sent.append(message.id)
+            # 每轮只输入新增的用户消息，历史由检查点中的消息通道衔接
+            result = await app.ainvoke({"messages": [message]}, config)
+            sizes.append(saver.total_bytes)
+        return sent, sizes, result
+    
+    sent, sizes, result = asyncio.run(scenario())
+    assert result["turns"] == 30
+    assert [message.id for message in result["messages"][::2]] == sent
+    # 消息通道在blobs中只是标记，每轮新增的字节数不随历史增长
+    blobs = [blob for key, blob in saver.blobs.items() if key[2] == "messages"]
+    assert blobs and all(blob[0] == APPEND_LOG_TYPE for blob in blobs)
+    assert sizes[-1] - sizes[-2] <= (sizes[2] - sizes[1]) * 1.5
+    
+    messages = saver.get_tuple(config).checkpoint["channel_values"]["messages"]
+    assert [message.id for message in messages] == [message.id for message in result["messages"]]
+    
+    saver.delete_thread("t")
+    assert saver.total_bytes == 0 and not saver.has_thread("t")
+
+
+def put_messages(saver, messages, version):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": messages}
+    checkpoint["channel_versions"] = {"messages": version}
+    config = {"configurable": {"thread_id": "t", "checkpoint_ns": ""}}
+    return saver.put(config, checkpoint, {}, {"messages": version})
+
+
+def load_messages(saver, config):
+    return saver.get_tuple(config).checkpoint["channel_values"]["messages"]
+
+
+def test_rewritten_history_rebuilds_log_and_keeps_old_checkpoints():
+    saver = BoundedMemorySaver(max_checkpoints_per_thread=3)
+    a, b, c, d, e = (Message(role=MessageRole.USER, content=content) for content in "abcde")
+    
+    first = put_messages(saver, [a, b], 1)
+    # 内容相同的副本视为同一元素，仍然按追加处理
+    put_messages(saver, [copy.copy(a), copy.copy(b), c], 2)
+    assert list(saver._append_logs["t"][("", "messages")]) == [0]
+    
+    # 改写了历史但长度和末尾相同，重建日志，引用旧日志的检查点仍能读到原来的消息
+    rewritten = put_messages(saver, [d, b, c], 3)
+    assert list(saver._append_logs["t"][("", "messages")]) == [0, 1]
+    assert load_messages(saver, rewritten) == [d, b, c]
+    assert [message.id for message in load_messages(saver, first)] == [a.id, b.id]
+    
+    # 引用旧日志的检查点都被删除后，旧日志随之删除
+    put_messages(saver, [d, b, c, e], 4)
+    assert list(saver._append_logs["t"][("", "messages")]) == [0, 1]
+    latest = put_messages(saver, [d, b, c, e, a], 5)
+    assert list(saver._append_logs["t"][("", "messages")]) == [1]
+    assert load_messages(saver, latest) == [d, b, c, e, a]
+    assert saver.total_bytes == sum(saver._thread_bytes.values())
+
+
+def test_in_memory_saver_internal_layout():
+    """BoundedMemorySaver依赖的InMemorySaver内部结构"""
+    saver = InMemorySaver()
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"items": ["x"]}
+    checkpoint["channel_versions"] = {"items": 1}
+    config = {"configurable": {"thread_id": "t", "checkpoint_ns": ""}}
+    config = saver.put(config, checkpoint, {}, {"items": 1})
+    saver.put_writes(config, [("items", ["y"])], "task")
+    
+    saved, metadata, parent_id = saver.storage["t"][""][checkpoint["id"]]
+    assert isinstance(saved, tuple) and isinstance(metadata, tuple) and parent_id is None
+    assert isinstance(saver.blobs[("t", "", "items", 1)], tuple)
+    writes = saver.writes[("t", "", checkpoint["id"])]
+    assert all(len(key) == 2 and len(value) == 4 for key, value in writes.items())
+    assert saver._load_blobs("t", "", {"items": 1}) == {"items": ["x"]}
@@ -0,0 +1,28 @@
+"""
+意图识别级联测试
+"""
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from devops_qa_agent.knowledge.base import KnowledgeBase
+from devops_qa_agent.models import IntentType
+from devops_qa_agent.services.intent_service import IntentClassifier
+
+
+def test_llm_only_called_below_threshold():
+    classifier = IntentClassifier(KnowledgeBase())
+    classifier.llm = FakeListChatModel(responses=["build"])
+    
+    async def run():
+        return [
+            await classifier.classify_intent("Jenkins BUILD FAILED 编译失败"),
+            await classifier.classify_intent("今天天气怎么样"),
+            await classifier.classify_intent("这个怎么处理", cd_inst_id="123456"),
+            # 归一化后与第二个问题相同，直接命中缓存
+            await classifier.classify_intent("今天 天气怎么样？"),
+        ]
+    
+    assert asyncio.run(run()) == [IntentType.BUILD] * 4
+    assert classifier.tier_counts == {"cache": 1, "local": 2, "llm": 1, "fallback": 0}
+    assert classifier.cache.get_stats()["hits"] == 1
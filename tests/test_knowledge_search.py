@@ -0,0 +1,135 @@
+"""
+知识库关键字匹配测试
+"""
+import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from devops_qa_agent.knowledge import semantic
+from devops_qa_agent.knowledge.base import KnowledgeBase
+from devops_qa_agent.knowledge.matcher import KeywordAutomaton
+
+
+def reference_search(knowledge_data, query, error_keywords=None):
+    """逐条目、逐关键字子串匹配的参考实现"""
+    results = []
+    if error_keywords:
+        for error_kb in knowledge_data.get("build_errors", []):
+            for keyword in error_keywords:
+                if any(kw.lower() in keyword.lower() for kw in error_kb["keywords"]):
+                    results.append({
+                        "type": "build_error",
+                        "question": error_kb["question"],
+                        "answer": error_kb["answer"],
+                        "matched_keyword": keyword
+                    })
+    for general_kb in knowledge_data.get("general_qa", []):
+        for keyword in general_kb["keywords"]:
+            if keyword.lower() in query.lower():
+                results.append({
+                    "type": "general",
+                    "question": general_kb["question"],
+                    "answer": general_kb["answer"],
+                    "matched_keyword": keyword
+                })
+                break
+    return results
+
+
+def make_knowledge_base(knowledge_data):
+    kb = KnowledgeBase.__new__(KnowledgeBase)
+    kb.kb_path = tempfile.mkdtemp()
+    kb.embedder = None
+    kb.semantic_index = None
+    kb.knowledge_data = knowledge_data
+    kb.build_index()
+    return kb
+
+
+def test_automaton_matches_substrings():
+    automaton = KeywordAutomaton(["he", "She", "his", "hers", "构建失败", "失败", ""])
+    assert automaton.search("USHERS") == {0, 1, 3, 6}
+    assert automaton.search("流水线构建失败了") == {4, 5, 6}
+    assert automaton.search("") == {6}
+
+
+def test_search_knowledge_matches_reference():
+    rng = random.Random(42)
+    alphabet = "abcAB构建失败依赖部署 "
+    words = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(60)]
+    
+    def entries(count):
+        return [
+            {
+                "keywords": rng.sample(words, rng.randint(1, 4)),
+                "question": f"q{i}",
+                "answer": f"a{i}"
+            }
+            for i in range(count)
+        ]
+    
+    for _ in range(50):
+        knowledge_data = {"build_errors": entries(20), "general_qa": entries(20)}
+        kb = make_knowledge_base(knowledge_data)
+        query = "".join(rng.choice(alphabet) for _ in range(30))
+        error_keywords = ["".join(rng.choice(alphabet) for _ in range(12)) for _ in range(5)]
+        error_keywords.append(error_keywords[0])
+        
+        assert kb.search_knowledge(query, error_keywords) == reference_search(knowledge_data, query, error_keywords)
+        assert kb.search_knowledge(query) == reference_search(knowledge_data, query)
+
+
+def test_tokenize_uses_cjk_bigrams():
+    from devops_qa_agent.knowledge.ranking import tokenize
+    assert tokenize("构建失败 BUILD-Failed 的") == ["构建", "建失", "失败", "build", "failed", "的"]
+
+
+def test_search_ranked_orders_by_relevance():
+    kb = make_knowledge_base({
+        "build_errors": [
+            {"keywords": ["BUILD FAILED", "编译失败"], "question": "构建失败怎么办？", "answer": "检查构建日志"},
+            {"keywords": ["Missing dependency", "依赖缺失"], "question": "依赖缺失如何解决？", "answer": "重新安装依赖"}
+        ],
+        "general_qa": [
+            {"keywords": ["部署", "deploy"], "question": "如何部署应用？", "answer": "构建项目后启动服务"}
+        ]
+    })
+    results = kb.search_ranked("依赖缺失 missing dependency", top_k=2)
+    assert [r["id"] for r in results][0] == "build_errors:1"
+    assert len(results) <= 2
+    assert all(a["score"] >= b["score"] for a, b in zip(results, results[1:]))
+    assert kb.search_ranked("hello", top_k=3) == []
+
+
+def test_semantic_index_reuses_vectors(tmp_path):
+    calls = []
+    embedder = semantic.HashingEmbedder(dim=256)
+    
+    def counting_embedder(texts):
+        calls.append(len(texts))
+        return embedder(texts)
+    
+    texts = ["构建失败 检查构建日志", "依赖缺失 重新安装依赖", "权限不足 修改文件权限"]
+    # 索引目录不存在时自动创建
+    index_dir = str(tmp_path / "knowledge_index")
+    index = semantic.SemanticIndex(index_dir, counting_embedder)
+    index.build(texts)
+    assert index.search("文件权限不足", top_k=1)[0][0] == 2
+    
+    # 条目未变化时复用内存映射文件，不再重新计算向量
+    reloaded = semantic.SemanticIndex(index_dir, counting_embedder)
+    reloaded.build(texts)
+    assert calls == [3, 1]
+    assert reloaded.search("重新安装依赖", top_k=1)[0][0] == 1
+
+
+def test_concurrent_semantic_builds_use_separate_temp_files(tmp_path):
+    texts = [f"构建失败 错误{i}" for i in range(200)]
+    indexes = [semantic.SemanticIndex(str(tmp_path), semantic.HashingEmbedder(dim=256)) for _ in range(4)]
+    # 模拟多个工作进程同时首次构建索引
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda index: index.build(texts), indexes))
+    
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    assert all(index.search("错误7", top_k=1)[0][0] == 7 for index in indexes)
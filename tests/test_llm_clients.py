@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import httpx
+
+from devops_qa_agent.services.llm_clients import ANSWER, INTENT, LLMClientRegistry, LLMProfile
+
+
+def make_registry(**kwargs):
+    profiles = {
+        INTENT: LLMProfile("intent-model", 0.1, max_tokens=16),
+        ANSWER: LLMProfile("answer-model", 0.7)
+    }
+    return LLMClientRegistry("test-key", "http://llm.test/v1", profiles, **kwargs)
+
+
+def test_use_cases_share_one_http_pool():
+    registry = make_registry(max_connections=8, http2=False)
+    intent, answer = registry.get(INTENT), registry.get(ANSWER)
+    assert registry.get(INTENT) is intent
+    assert intent.model_name == "intent-model" and intent.temperature == 0.1 and intent.max_tokens == 16
+    assert answer.model_name == "answer-model" and answer.max_tokens is None
+    assert intent.http_async_client is answer.http_async_client is registry.http_client
+    assert registry.get_stats()["max_connections"] == 8
+
+
+def test_requests_are_counted_until_response_is_closed():
+    registry = make_registry(streaming=False)
+    
+    body = json.dumps({
+        "id": "1", "object": "chat.completion", "created": 0, "model": "answer-model",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": "检查依赖版本"}}]
+    }).encode("utf-8")
+    
+    async def stream():
+        yield body
+    
+    def handler(request):
+        # 与真实连接一样按流返回响应体，读完后才算请求结束
+        return httpx.Response(200, headers={"content-type": "application/json"}, content=stream())
+    
+    registry.transport.transport = httpx.MockTransport(handler)
+    
+    async def scenario():
+        response = await registry.get(ANSWER).ainvoke("构建失败怎么办")
+        stats = registry.get_stats()
+        await registry.aclose()
+        return response.content, stats
+    
+    content, stats = asyncio.run(scenario())
+    assert content == "检查依赖版本"
+    assert stats["requests"] == 1 and stats["in_flight"] == 0
@@ -0,0 +1,76 @@
+import asyncio
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from devops_qa_agent.services.llm_coalescer import LLMCoalescer
+
+
+class FakeLLM:
+    def __init__(self, tokens, temperature=0.7):
+        self.tokens = tokens
+        self.temperature = temperature
+        self.calls = 0
+    
+    @property
+    def _identifying_params(self):
+        return {"model": "fake", "temperature": self.temperature}
+    
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(0.02)
+        return AIMessage(content="".join(self.tokens))
+    
+    async def astream(self, messages):
+        self.calls += 1
+        for token in self.tokens:
+            await asyncio.sleep(0.01)
+            yield AIMessage(content=token)
+
+
+def test_make_key_covers_messages_and_model_params():
+    messages = [SystemMessage(content="系统"), HumanMessage(content="构建失败怎么办")]
+    key = LLMCoalescer.make_key(FakeLLM([]), messages)
+    assert key == LLMCoalescer.make_key(FakeLLM([]), list(messages))
+    assert key != LLMCoalescer.make_key(FakeLLM([], temperature=0.1), messages)
+    assert key != LLMCoalescer.make_key(FakeLLM([]), messages[1:])
+
+
+def test_concurrent_identical_calls_share_one_upstream_request():
+    coalescer = LLMCoalescer()
+    llm = FakeLLM(["构建", "失败", "请检查依赖"])
+    messages = [HumanMessage(content="构建失败怎么办")]
+    
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [token async for token in coalescer.stream(llm, messages)]
+    
+    async def scenario():
+        responses = await asyncio.gather(*(coalescer.invoke(llm, messages) for _ in range(5)))
+        # 第二个订阅方在流进行到一半时加入，仍然拿到完整的token序列
+        streams = await asyncio.gather(collect(0), collect(0.015), collect(0))
+        return responses, streams
+    
+    responses, streams = asyncio.run(scenario())
+    assert {response.content for response in responses} == {"构建失败请检查依赖"}
+    assert streams == [["构建", "失败", "请检查依赖"]] * 3
+    assert llm.calls == 2
+    stats = coalescer.get_stats()
+    assert stats["invoke_coalesced"] == 4 and stats["stream_coalesced"] == 2 and stats["in_flight"] == 0
+
+
+def test_stream_is_cancelled_when_all_subscribers_leave():
+    coalescer = LLMCoalescer()
+    llm = FakeLLM(["a"] * 50)
+    messages = [HumanMessage(content="问题")]
+    
+    async def scenario():
+        stream = coalescer.stream(llm, messages)
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        await asyncio.sleep(0.02)
+        # 取消后的相同调用重新请求上游
+        return [token async for token in coalescer.stream(llm, messages)]
+    
+    tokens = asyncio.run(scenario())
+    assert len(tokens) == 50 and llm.calls == 2
+    assert coalescer.get_stats()["in_flight"] == 0
@@ -0,0 +1,51 @@
+"""
+构建日志分析测试
+"""
+import asyncio
+
+from devops_qa_agent.services.log_analyzer import LogAnalyzer
+
+SAMPLE_LOG = """[INFO] Scanning for projects...
+[INFO] 编译中 -- 依赖下载完成
+src/main/java/App.java:12: error: cannot find symbol
+[ERROR] Failed to execute goal org.apache.maven.plugins:maven-compiler-plugin:3.8.1:compile
+npm ERR! code ELIFECYCLE
+Step 7/9 : RUN pip install -r requirements.txt
+ERROR: No matching distribution found for foo==9.9
+java.lang.OutOfMemoryError: Java heap space
+编译失败，请检查日志
+Killed
+"""
+
+
+async def iterate(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_streaming_matches_in_memory_analysis():
+    analyzer = LogAnalyzer(keywords=["编译失败", "Permission denied"])
+    expected = analyzer.analyze_text(SAMPLE_LOG)
+    # 很小的块会切断行和多字节字符
+    streamed = asyncio.run(analyzer.analyze_stream(iterate(SAMPLE_LOG.encode("utf-8"), 7)))
+    
+    assert streamed.to_dict() == expected.to_dict()
+    assert streamed.lines_scanned == 10
+    assert streamed.errors == [
+        "Compilation error", "cannot find symbol", "Failed to execute goal", "npm ERR!",
+        "No matching distribution", "OutOfMemoryError", "编译失败", "Killed (exit code 137)"
+    ]
+    assert streamed.matches["cannot find symbol"]["lines"] == [3]
+    assert streamed.matches["编译失败"]["lines"] == [9]
+    assert streamed.matches["Killed (exit code 137)"]["lines"] == [10]
+
+
+def test_long_lines_do_not_accumulate():
+    analyzer = LogAnalyzer()
+    data = b"x" * (5 * 1024 * 1024) + b" BUILD FAILURE\nnext line timed out\n"
+    analysis = asyncio.run(analyzer.analyze_stream(iterate(data, 64 * 1024)))
+    
+    # 超长行不会整行缓存，后面的行号仍然正确
+    assert analysis.errors == ["BUILD FAILURE", "Timeout"]
+    assert analysis.matches["Timeout"]["lines"] == [2]
+    assert analysis.lines_scanned == 2
@@ -0,0 +1,57 @@
+"""
+结构化日志测试
+"""
+import asyncio
+import json
+import logging
+import queue
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from devops_qa_agent.config import config
+from devops_qa_agent.services import logs
+from devops_qa_agent.services.chat_service import ChatAgent
+
+
+def test_records_carry_session_and_node(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(config, "SESSION_DB_PATH", str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "LOG_PAYLOAD_MAX_CHARS", 10)
+    agent = ChatAgent()
+    agent.llm_service.llm = GenericFakeChatModel(messages=iter([AIMessage(content="部署步骤：" + "很长的回答" * 50)]))
+    
+    logs.setup_logging(level="DEBUG", fmt="json")
+    try:
+        async def scenario():
+            await agent.process_message("如何部署应用？", "log-session")
+            await agent.close()
+        
+        asyncio.run(scenario())
+    finally:
+        logs.shutdown_logging()
+    
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+    intent = next(r for r in records if r["message"] == "识别到意图")
+    assert intent["session_id"] == "log-session"
+    assert intent["node"] == "intent_classification"
+    assert intent["intent"] == "general"
+    
+    answer = next(r for r in records if r["message"] == "生成的回答")
+    assert answer["node"] == "generate_response"
+    assert answer["payload"].startswith("部署步骤：很长的回答") and "共" in answer["payload"]
+    assert len(answer["payload"]) < 30
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = logs.DroppingQueueHandler(queue.Queue(maxsize=1))
+    logger = logging.getLogger("devops_qa_agent.tests.dropping")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        for i in range(5):
+            logger.warning("记录 %d", i)
+    finally:
+        logger.removeHandler(handler)
+    assert handler.dropped == 4
+    assert handler.queue.get_nowait().msg == "记录 0"
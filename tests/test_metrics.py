@@ -0,0 +1,81 @@
+"""
+运行指标测试
+"""
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from devops_qa_agent.config import config
+from devops_qa_agent.services import metrics
+from devops_qa_agent.services.chat_service import ChatAgent
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    histogram = registry.histogram("test_seconds", "测试耗时", ["node"], buckets=(0.1, 1.0))
+    gauge = registry.callback("test_ratio", "测试比例", ["cache"])
+    gauge.set_function(lambda: {("intent",): 0.5})
+    
+    child = histogram.labels("search")
+    for value in (0.05, 0.5, 0.5, 3.0):
+        child.observe(value)
+    
+    lines = registry.render().splitlines()
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{node="search",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{node="search",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{node="search",le="+Inf"} 4' in lines
+    assert 'test_seconds_sum{node="search"} 4.05' in lines
+    assert 'test_seconds_count{node="search"} 4' in lines
+    assert 'test_ratio{cache="intent"} 0.5' in lines
+
+
+def test_counter_metadata_uses_sample_name():
+    registry = metrics.Registry()
+    registry.counter("test_errors", "测试错误数", ["kind"]).labels("timeout").inc()
+    registry.callback("test_dropped", "测试丢弃数", type_name="counter").set_function(lambda: {(): 3})
+    
+    lines = registry.render().splitlines()
+    # HELP和TYPE行与样本使用同一名称
+    assert lines == [
+        "# HELP test_errors_total 测试错误数",
+        "# TYPE test_errors_total counter",
+        'test_errors_total{kind="timeout"} 1',
+        "# HELP test_dropped_total 测试丢弃数",
+        "# TYPE test_dropped_total counter",
+        "test_dropped_total 3"
+    ]
+
+
+def test_graph_nodes_and_caches_are_reported(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "SESSION_DB_PATH", str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    agent = ChatAgent()
+    agent.llm_service.llm = GenericFakeChatModel(messages=iter([AIMessage(content="回答")]))
+    before = metrics.NODE_LATENCY.labels("generate_response").count
+    
+    async def fetch_build_log_errors(cd_inst_id):
+        await asyncio.sleep(0.05)
+        return []
+    
+    agent.build_log_service._fetch_build_log_errors = fetch_build_log_errors
+    
+    async def scenario():
+        await agent.process_message("如何部署应用？", "metrics")
+        await asyncio.gather(*(agent.build_log_service.get_build_log_errors_by_inst_id("123456") for _ in range(3)))
+        await agent.close()
+    
+    asyncio.run(scenario())
+    assert metrics.NODE_LATENCY.labels("generate_response").count == before + 1
+    output = metrics.REGISTRY.render()
+    assert 'devops_qa_graph_node_seconds_count{node="intent_classification"}' in output
+    assert 'devops_qa_llm_call_seconds_count{caller="LLMService",mode="stream"}' in output
+    assert 'devops_qa_cache_hit_ratio{cache="intent"}' in output
+    assert "devops_qa_checkpoint_sessions 1" in output
+    # 同一实例的三个并发查询合并为一次后端调用
+    assert "devops_qa_build_log_backend_calls_total 1" in output
+    assert "devops_qa_build_log_coalesced_calls_total 2" in output
+    # 一次意图识别计入其中一个层级
+    decisions = [line for line in output.splitlines() if line.startswith("devops_qa_intent_decisions_total{")]
+    assert len(decisions) == 4 and sum(int(line.rsplit(" ", 1)[1]) for line in decisions) == 1
@@ -0,0 +1,26 @@
+"""
+数据模型测试
+"""
+from datetime import datetime
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from devops_qa_agent.models import ConversationState, Message, MessageRole
+
+
+def test_message_ids_are_compact_and_unique():
+    messages = [Message(role=MessageRole.USER, content="问题") for _ in range(1000)]
+    assert len({message.id for message in messages}) == 1000
+    assert all(len(message.id) < 36 for message in messages)
+    # 构造ConversationState时不复制消息对象
+    state = ConversationState(session_id="s", messages=messages)
+    assert state.messages[0] is messages[0]
+
+
+def test_message_restores_from_record_and_checkpoint():
+    message = Message.from_record("m1", "assistant", "回答", "2024-01-01T10:00:00")
+    assert message.role is MessageRole.ASSISTANT
+    assert message.timestamp == datetime(2024, 1, 1, 10, 0, 0)
+    
+    serde = JsonPlusSerializer()
+    assert serde.loads_typed(serde.dumps_typed([message])) == [message]
@@ -0,0 +1,73 @@
+"""
+提示词组装测试
+"""
+from devops_qa_agent.models import ConversationState, MessageRole
+from devops_qa_agent.services.cache import AnswerCache
+from devops_qa_agent.services.prompt_builder import PromptBuilder, estimate_tokens
+
+
+def make_state(turns: int) -> ConversationState:
+    state = ConversationState(session_id="s1")
+    for i in range(turns):
+        state.add_message(MessageRole.USER, f"第{i}个问题")
+        state.add_message(MessageRole.ASSISTANT, f"第{i}个回答")
+    state.add_message(MessageRole.USER, "当前问题")
+    return state
+
+
+def test_prompt_sections_appear_once_within_budget():
+    state = make_state(1)
+    state.build_errors = ["OutOfMemoryError"]
+    state.knowledge_base_results = [
+        {"id": f"general_qa:{i}", "question": f"知识{i}", "answer": "答" * 500} for i in range(3)
+    ]
+    builder = PromptBuilder("系统提示", max_tokens=800, top_k=3)
+    prompt = builder.build(state, "当前问题")
+    content = prompt.messages[-1].content
+    
+    assert prompt.token_count <= 800
+    assert content.count("OutOfMemoryError") == 1
+    assert content.count("知识0") == 1
+    assert content.count("当前问题") == 1
+    # 预算不足时按排序放入知识条目，最后一条答案被截断
+    assert prompt.entry_ids == ["general_qa:0", "general_qa:1"]
+    assert "知识2" not in content
+    # 历史优先级最低，预算用完后不再放入
+    assert "第0个问题" not in content
+
+
+def test_history_is_rolled_into_summary():
+    state = make_state(5)
+    builder = PromptBuilder("系统提示", max_tokens=2000, recent_messages=4, summary_max_tokens=20)
+    builder.update_summary(state)
+    
+    assert state.history_summary.startswith("user: 第")
+    assert estimate_tokens(state.history_summary) <= 20
+    content = builder.build(state, "当前问题").messages[-1].content
+    assert "更早的对话摘要" in content
+    # 最近4条保留原文，并入摘要的消息不再重复出现在对话历史中
+    history = content.split("对话历史：\n", 1)[1].split("\n\n", 1)[0]
+    assert history.splitlines() == ["user: 第3个问题", "assistant: 第3个回答", "user: 第4个问题", "assistant: 第4个回答"]
+    
+    # 再次更新时不会重复并入已经摘要过的消息
+    summary = state.history_summary
+    builder.update_summary(state)
+    assert state.history_summary == summary
+
+
+def test_prompt_history_feeds_answer_cache_key():
+    builder = PromptBuilder("系统提示", max_tokens=2000)
+    first_turn = ConversationState(session_id="s1")
+    first_turn.add_message(MessageRole.USER, "那第二步呢？")
+    assert builder.build(first_turn, "那第二步呢？").history == ""
+    
+    keys = []
+    for question in ("Maven构建失败怎么办", "Docker镜像拉取失败怎么办"):
+        state = ConversationState(session_id=question)
+        state.add_message(MessageRole.USER, question)
+        state.add_message(MessageRole.ASSISTANT, "第一步检查配置")
+        state.add_message(MessageRole.USER, "那第二步呢？")
+        prompt = builder.build(state, "那第二步呢？")
+        assert question in prompt.history
+        keys.append(AnswerCache.make_key("那第二步呢？", prompt.entry_ids, state.build_errors, prompt.history))
+    assert keys[0] != keys[1]
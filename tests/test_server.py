@@ -0,0 +1,115 @@
+"""
+接口流式输出测试
+"""
+import asyncio
+import json
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+from devops_qa_agent.api import server
+from devops_qa_agent.config import config
+from devops_qa_agent.models import IntentType
+from devops_qa_agent.services.chat_service import ChatAgent
+
+TOKENS = [f"t{i} " for i in range(20)]
+TOKEN_PATTERN = re.compile(r"t\d+ ")
+
+
+class TokenModel(GenericFakeChatModel):
+    """按固定间隔逐个输出TOKENS的模型，记录已输出的token数"""
+    
+    produced: int = 0
+    
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for token in TOKENS:
+            await asyncio.sleep(0.02)
+            self.produced += 1
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+@pytest.fixture
+def model(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "SESSION_DB_PATH", str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "SSE_FRAME_WINDOW_MS", 5)
+    monkeypatch.setattr(config, "WS_FRAME_WINDOW_MS", 5)
+    agent = ChatAgent()
+    model = TokenModel(messages=iter([]))
+    agent.llm_service.llm = model
+    
+    async def classify_intent(user_question, cd_inst_id=None):
+        return IntentType.GENERAL
+    
+    agent.intent_classifier.classify_intent = classify_intent
+    monkeypatch.setattr(server, "chat_agent", agent)
+    yield model
+    asyncio.run(agent.close())
+
+
+def check_frames(frames, produced):
+    """token按顺序分多帧到达，第一个包含token的帧在模型输出完之前就已发出"""
+    assert "".join(TOKENS) in "".join(frames)
+    token_frames = [index for index, frame in enumerate(frames) if TOKEN_PATTERN.search(frame)]
+    assert len(token_frames) > 1
+    assert produced[token_frames[0]] < len(TOKENS)
+
+
+def test_sse_streams_tokens_incrementally(model):
+    async def scenario():
+        finished = asyncio.Event()
+        body = json.dumps({"message": "如何优化性能", "session_id": "s1"}).encode()
+        requests = [{"type": "http.request", "body": body, "more_body": False}]
+        events = []
+        
+        async def receive():
+            if requests:
+                return requests.pop()
+            await finished.wait()
+            return {"type": "http.disconnect"}
+        
+        async def send(message):
+            # 记录每次写出时模型已经输出的token数
+            if message["type"] == "http.response.body" and message.get("body"):
+                events.append((message["body"], model.produced))
+        
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/api/chat", "raw_path": b"/api/chat", "query_string": b"",
+            "root_path": "", "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 1), "server": ("testserver", 80)
+        }
+        await server.app(scope, receive, send)
+        finished.set()
+        return events
+    
+    frames, produced = [], []
+    for body, count in asyncio.run(scenario()):
+        for event in body.decode().split("\n\n"):
+            if event:
+                frames.append(json.loads(event[len("data: "):]))
+                produced.append(count)
+    
+    assert frames[-1]["complete"] is True
+    assert all("chunk" in frame for frame in frames[:-1])
+    check_frames([frame["chunk"] for frame in frames[:-1]], produced)
+
+
+def test_websocket_streams_tokens_incrementally(model):
+    frames, produced = [], []
+    with TestClient(server.app).websocket_connect("/ws/s2") as websocket:
+        websocket.send_text(json.dumps({"message": "如何优化性能"}))
+        assert websocket.receive_json()["type"] == "status"
+        while True:
+            frame = websocket.receive_json()
+            frames.append(frame)
+            produced.append(model.produced)
+            if frame["type"] != "chunk":
+                break
+    
+    assert frames[-1]["type"] == "complete"
+    check_frames([frame["content"] for frame in frames[:-1]], produced)
@@ -0,0 +1,63 @@
+"""
+会话持久化存储测试
+"""
+import os
+import tempfile
+
+from devops_qa_agent.models import Message, MessageRole
+from devops_qa_agent.services.session_store import SessionStore
+
+
+def test_session_store_appends_and_paginates():
+    path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    store = SessionStore(path)
+    messages = [Message(role=MessageRole.USER, content=f"问题{i}") for i in range(5)]
+    store.append_messages("s1", messages[:3], {"current_intent": "build"})
+    # 重复追加同一条消息不会产生重复记录
+    store.append_messages("s1", messages[2:], {"current_intent": "general"})
+    store.flush()
+    
+    session = store.get_session("s1")
+    assert session["message_count"] == 5
+    assert session["state"] == {"current_intent": "general"}
+    
+    page, cursor = store.get_messages("s1", limit=2)
+    assert [m["content"] for m in page] == ["问题3", "问题4"]
+    page, cursor = store.get_messages("s1", before=cursor, limit=2)
+    assert [m["content"] for m in page] == ["问题1", "问题2"]
+    page, cursor = store.get_messages("s1", before=cursor, limit=2)
+    assert [m["content"] for m in page] == ["问题0"]
+    assert cursor is None
+    store.close()
+    
+    # 重启后数据仍然存在，删除后不再可见
+    store = SessionStore(path)
+    assert store.get_session("s1")["message_count"] == 5
+    store.delete_session("s1")
+    store.flush()
+    assert store.get_session("s1") is None
+    assert store.get_messages("s1") == ([], None)
+    store.close()
+
+
+def test_failed_operation_does_not_drop_batch_or_stop_writer():
+    store = SessionStore(os.path.join(tempfile.mkdtemp(), "sessions.db"))
+    good = Message(role=MessageRole.USER, content="问题")
+    operations = [
+        ("append", "s1", [(good.id, "user", "问题", None)], "{}"),
+        # 格式错误的记录，写入时抛出异常
+        ("append", "s2", [("m1", "user")], "{}"),
+        ("append", "s3", [(good.id, "user", "问题", None)], "{}"),
+    ]
+    # 同一批中的其他会话照常写入
+    store._write(operations)
+    assert store.get_session("s1")["message_count"] == 1
+    assert store.get_session("s2") is None
+    assert store.get_session("s3")["message_count"] == 1
+    
+    # 非SQLite异常不会使写入线程退出，之后的写入和flush正常
+    store._queue.put(("append", "s4", None, "{}"))
+    store.append_messages("s5", [good])
+    store.flush()
+    assert store.get_session("s5")["message_count"] == 1
+    store.close()
@@ -0,0 +1,95 @@
+"""
+流式输出测试
+"""
+import asyncio
+import json
+
+import pytest
+
+from devops_qa_agent.api.streaming import ClientDisconnected, FrameEncoder, coalesce
+
+
+def test_frame_encoder_matches_json():
+    encoder = FrameEncoder({"type": "chunk", "session_id": "s1"}, "content", b"data: ", b"\n\n")
+    frame = encoder.encode('构建"失败"\n')
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    assert json.loads(frame[6:]) == {"type": "chunk", "session_id": "s1", "content": '构建"失败"\n'}
+
+
+def test_coalesce_merges_tokens_within_window():
+    async def tokens():
+        for i in range(40):
+            await asyncio.sleep(0.001)
+            yield f"t{i} "
+    
+    async def collect(window, max_chars):
+        return [frame async for frame in coalesce(tokens(), window, max_chars)]
+    
+    frames = asyncio.run(collect(0.05, 1024))
+    assert "".join(frames) == "".join(f"t{i} " for i in range(40))
+    # 第一帧立即输出，之后按时间窗口合并
+    assert frames[0] == "t0 "
+    assert len(frames) < 10
+    
+    # 攒够字符数时不等窗口结束
+    frames = asyncio.run(collect(10, 8))
+    assert all(len(frame) <= 8 + 4 for frame in frames[1:])
+    assert len(frames) > 10
+
+
+def test_coalesce_flushes_before_error_and_cancels_upstream_on_close():
+    cancelled = []
+    
+    async def failing():
+        yield "a"
+        yield "b"
+        raise RuntimeError("上游失败")
+    
+    async def endless():
+        try:
+            while True:
+                yield "x"
+                await asyncio.sleep(0.001)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+    
+    async def scenario():
+        received = []
+        with pytest.raises(RuntimeError):
+            async for frame in coalesce(failing(), 0.01, 1024):
+                received.append(frame)
+        assert "".join(received) == "ab"
+        
+        frames = coalesce(endless(), 0.01, 1024)
+        await frames.__anext__()
+        await frames.aclose()
+    
+    asyncio.run(scenario())
+    assert cancelled == [True]
+
+
+def test_coalesce_cancels_upstream_when_client_disconnects():
+    cancelled = []
+    
+    async def slow_first_token():
+        try:
+            await asyncio.sleep(10)
+            yield "x"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+    
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        disconnected = loop.create_future()
+        loop.call_later(0.01, disconnected.set_result, None)
+        start = loop.time()
+        # 等待首个token期间断开，不必等到下一次写入
+        with pytest.raises(ClientDisconnected):
+            async for _ in coalesce(slow_first_token(), 0, 1024, disconnected):
+                pass
+        return loop.time() - start
+    
+    assert asyncio.run(scenario()) < 1
+    assert cancelled == [True]